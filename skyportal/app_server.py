@@ -1,14 +1,33 @@
+import threading
+
+import tornado.ioloop
 import tornado.web
 
 from baselayer.app.app_server import MainPageHandler
 
-from skyportal.handlers import (SourceHandler, CommentHandler, GroupHandler,
-                                GroupUserHandler, PlotPhotometryHandler,
+from skyportal.handlers import (SourceHandler, SourceBulkHandler,
+                                CommentHandler, CommentAttachmentHandler,
+                                GroupHandler, GroupUserHandler,
+                                PlotPhotometryHandler,
                                 PlotSpectroscopyHandler, ProfileHandler,
                                 BecomeUserHandler, LogoutHandler,
-                                PhotometryHandler, TokenHandler,
-                                SysInfoHandler, UserInfoHandler)
-from skyportal import models, model_util, openapi
+                                PhotometryHandler, PhotometryStreamHandler,
+                                SpectrumHandler, SpectrumStreamHandler,
+                                TokenHandler, SysInfoHandler,
+                                UserInfoHandler, MetricsHandler,
+                                CPUProfileHandler, MemoryProfileHandler,
+                                OpenAPIHandler, ChangeFeedHandler)
+from skyportal import (cutouts, fanout, metrics, models, model_util, openapi,
+                       outbox, query_log, schema, slow_query_log, tracing)
+from skyportal.compression import CompressedContentEncoding
+
+
+def warmup():
+    """Import the modules that handlers load lazily because they are slow
+    to import, and generate the model schemas."""
+    import astropy.time  # noqa: F401
+    from skyportal import plot, spectrum_io, stream_parsers  # noqa: F401
+    schema.setup_schema()
 
 
 def make_app(cfg, baselayer_handlers, baselayer_settings):
@@ -34,19 +53,29 @@ def make_app(cfg, baselayer_handlers, baselayer_settings):
 
     handlers = baselayer_handlers + [
         # API endpoints
+        (r'/api/sources/bulk', SourceBulkHandler),
         (r'/api/sources(/.*)?', SourceHandler),
         (r'/api/groups/(.*)/users/(.*)?', GroupUserHandler),
         (r'/api/groups(/.*)?', GroupHandler),
         (r'/api/comment(/[0-9]+)?', CommentHandler),
         (r'/api/comment(/[0-9]+)/(download_attachment)', CommentHandler),
+        (r'/api/comment(/[0-9]+)/attachment', CommentAttachmentHandler),
+        (r'/api/photometry/stream', PhotometryStreamHandler),
         (r'/api/photometry(/.*)?', PhotometryHandler),
+        (r'/api/spectrum/stream', SpectrumStreamHandler),
+        (r'/api/spectrum(/.*)?', SpectrumHandler),
         (r'/api/user(/.*)?', UserInfoHandler),
         (r'/api/sysinfo', SysInfoHandler),
+        (r'/api/changes', ChangeFeedHandler),
+        (r'/api/openapi.json', OpenAPIHandler),
 
         (r'/api/internal/tokens(/.*)?', TokenHandler),
         (r'/api/internal/profile', ProfileHandler),
         (r'/api/internal/plot/photometry/(.*)', PlotPhotometryHandler),
         (r'/api/internal/plot/spectroscopy/(.*)', PlotSpectroscopyHandler),
+        (r'/api/internal/metrics', MetricsHandler),
+        (r'/api/internal/profiler/cpu', CPUProfileHandler),
+        (r'/api/internal/profiler/memory(/[0-9]+)?', MemoryProfileHandler),
 
         (r'/become_user(/.*)?', BecomeUserHandler),
         (r'/logout', LogoutHandler),
@@ -62,11 +91,38 @@ def make_app(cfg, baselayer_handlers, baselayer_settings):
     settings.update({})  # Specify any additional settings here
 
     app = tornado.web.Application(handlers, **settings)
+    app.add_transform(CompressedContentEncoding)
     models.init_db(**cfg['database'])
-    model_util.create_tables()
-    model_util.setup_permissions()
+    metrics.instrument_engine(models.DBSession().get_bind())
+    if cfg['debug:query_log']:
+        query_log.enable()
+    if cfg['slow_query_log:threshold_ms']:
+        slow_query_log.enable(
+            threshold_ms=cfg['slow_query_log:threshold_ms'],
+            explain=cfg['slow_query_log:explain'],
+            explain_interval=cfg['slow_query_log:explain_interval'],
+            path=cfg['slow_query_log:path'])
+    tracing.configure(sample_rate=cfg['tracing:sample_rate'],
+                      exporter=cfg['tracing:exporter'],
+                      path=cfg['tracing:path'],
+                      otlp_endpoint=cfg['tracing:otlp_endpoint'])
+    fanout.membership.ttl = cfg['websocket:membership_ttl']
+    outbox.outbox.window = cfg['websocket:coalesce_ms'] / 1000
+    outbox.outbox.max_size = cfg['websocket:max_queue']
+    metrics.instrument_outbox(outbox.outbox)
+    model_util.ensure_bootstrapped()
     app.cfg = cfg
 
-    app.openapi_spec = openapi.spec_from_handlers(handlers)
+    app.openapi_spec = openapi.CachedSpec(handlers, cfg['openapi:cache_dir'])
+
+    if cfg['cutouts:resolve_interval']:
+        # Retry PS1 thumbnails that could not be resolved when created
+        tornado.ioloop.PeriodicCallback(
+            cutouts.schedule_pending,
+            cfg['cutouts:resolve_interval'] * 1000).start()
+
+    if cfg['server:warmup']:
+        threading.Thread(target=warmup, daemon=True,
+                         name='skyportal-warmup').start()
 
     return app
@@ -0,0 +1,174 @@
+"""Chunked storage of binary attachments.
+
+Attachments are stored as raw bytes, split over rows of the
+`attachment_chunks` table, so that neither uploads nor downloads ever need to
+hold a whole file in memory.  Each attachment is identified by the SHA-256
+hash of its contents; uploading the same file twice stores it only once,
+and an attachment is deleted along with the last comment referring to it
+(see `delete_unused`).
+"""
+
+import base64
+import hashlib
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
+from sqlalchemy.orm import Session
+
+from .models import DBSession, Attachment, AttachmentChunk, Comment
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class AttachmentWriter:
+    """Incrementally write an attachment to the database.
+
+    Data passed to `write` is hashed and stored as it arrives; `close`
+    finalizes the attachment and returns it.
+
+    By default the writer uses a session of its own, committed by `close`
+    (or rolled back by `abort`), so that an upload received over several
+    IOLoop iterations is unaffected by other requests using `DBSession` in
+    the meantime; the attachment is returned in `DBSession`.  If `session`
+    is given, the attachment is written in it and nothing is committed, so
+    that the caller controls the surrounding transaction.
+
+    Examples
+    --------
+    >>> writer = AttachmentWriter()
+    >>> for block in iter(lambda: f.read(65536), b''):
+    ...     writer.write(block)
+    >>> comment.attachment = writer.close()
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE, session=None):
+        self.chunk_size = chunk_size
+        self.own_session = session is None
+        self.session = (Session(bind=DBSession().get_bind())
+                        if session is None else session)
+        self.attachment = Attachment(size=0, chunk_size=chunk_size)
+        self.session.add(self.attachment)
+        self.session.flush()
+
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._seq = 0
+
+    def _store_chunk(self, data):
+        self.session.execute(AttachmentChunk.__table__.insert(),
+                             {'attachment_id': self.attachment.id,
+                              'seq': self._seq, 'data': bytes(data)})
+        self._seq += 1
+
+    def write(self, data):
+        self._hash.update(data)
+        self.attachment.size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._store_chunk(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+
+    def close(self):
+        """Store any buffered data and return the finished `Attachment`.
+
+        If an attachment with identical contents already exists, the newly
+        written copy is discarded and the existing one returned instead.
+        The final row is inserted with ``ON CONFLICT DO NOTHING``, so that
+        concurrent uploads of the same file end up sharing it.
+        """
+        try:
+            if self._buffer:
+                self._store_chunk(self._buffer)
+                self._buffer = bytearray()
+
+            table = Attachment.__table__
+            chunks = AttachmentChunk.__table__
+            sha256 = self._hash.hexdigest()
+            attachment_id = self.session.execute(
+                psql.insert(table)
+                .values(sha256=sha256, size=self.attachment.size,
+                        chunk_size=self.chunk_size)
+                .on_conflict_do_nothing(index_elements=['sha256'])
+                .returning(table.c.id)).scalar()
+            if attachment_id is not None:
+                self.session.execute(
+                    chunks.update()
+                    .where(chunks.c.attachment_id == self.attachment.id)
+                    .values(attachment_id=attachment_id))
+            # Chunks of a duplicate upload are deleted along with it
+            self.session.execute(table.delete().where(
+                table.c.id == self.attachment.id))
+            self.session.expunge(self.attachment)
+        except Exception:
+            self.abort()
+            raise
+
+        if not self.own_session:
+            return (self.session.query(Attachment)
+                    .filter(Attachment.sha256 == sha256).one())
+        self.session.commit()
+        self.session.close()
+        self.session = None
+        return Attachment.query.filter(Attachment.sha256 == sha256).one()
+
+    def abort(self):
+        """Discard the data written so far, if the writer has its own
+        session; does nothing once the writer is closed."""
+        if self.own_session and self.session is not None:
+            self.session.rollback()
+            self.session.close()
+            self.session = None
+
+
+def store_attachment(data, chunk_size=CHUNK_SIZE):
+    """Store a complete in-memory `bytes` object as an attachment, within
+    the current transaction of `DBSession`."""
+    writer = AttachmentWriter(chunk_size=chunk_size, session=DBSession())
+    data = memoryview(data)
+    for i in range(0, len(data), chunk_size):
+        writer.write(data[i:i + chunk_size])
+    return writer.close()
+
+
+def store_base64_attachment(data, chunk_size=CHUNK_SIZE):
+    """Store base64-encoded `data` as an attachment, decoding it in blocks
+    rather than all at once, within the current transaction of
+    `DBSession`."""
+    writer = AttachmentWriter(chunk_size=chunk_size, session=DBSession())
+    data = ''.join(data.split())
+    # 4 characters of base64 encode 3 bytes
+    step = chunk_size // 3 * 4
+    for i in range(0, len(data), step):
+        writer.write(base64.b64decode(data[i:i + step]))
+    return writer.close()
+
+
+def delete_unused(attachment_ids):
+    """Delete the given attachments if no comment refers to them anymore,
+    within the current transaction."""
+    attachment_ids = [i for i in attachment_ids if i is not None]
+    if not attachment_ids:
+        return
+    table = Attachment.__table__
+    DBSession().execute(table.delete().where(
+        table.c.id.in_(attachment_ids)
+    ).where(~sa.exists().where(Comment.attachment_id == table.c.id)))
+
+
+def iter_attachment(attachment, start=0, end=None):
+    """Yield the bytes of `attachment` in the half-open range [start, end).
+
+    Only the chunks overlapping the requested range are read, one at a time.
+    """
+    if end is None or end > attachment.size:
+        end = attachment.size
+    chunk_size = attachment.chunk_size
+
+    for seq in range(start // chunk_size, (end - 1) // chunk_size + 1):
+        chunk_start = seq * chunk_size
+        data = DBSession().execute(
+            sa.select([AttachmentChunk.data])
+            .where(AttachmentChunk.attachment_id == attachment.id)
+            .where(AttachmentChunk.seq == seq)
+        ).scalar()
+        yield bytes(data[max(start - chunk_start, 0):end - chunk_start])
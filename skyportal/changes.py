@@ -0,0 +1,103 @@
+"""Incremental feed of created and modified sources, photometry, spectra and
+comments.
+
+Each row records the id of the transaction that last wrote it (`txid`, see
+`models.py`).  Changes are ordered by `(txid, type, id)`, and a page of
+changes ends with an opaque cursor encoding the position of its last change;
+the next request passes it back to continue from there.  Each table is read
+with a keyset query on its `(txid, id)` index, so that a poll costs a few
+index lookups regardless of the size of the database.
+
+A row only becomes visible when its transaction commits, which may be long
+after it was written (e.g. streamed uploads or bulk imports), and
+transactions do not commit in the order of their ids.  So that the cursor
+never moves past rows of transactions still in flight, only changes of
+transactions older than the oldest one in progress (the `xmin` of the
+current snapshot) are returned: all of those have committed or rolled back,
+and any later write gets a larger transaction id.  A long transaction thus
+holds back the feed until it finishes, but none of its changes are skipped.
+Deleted rows do not appear in the feed.
+"""
+
+import base64
+import heapq
+import json
+
+import sqlalchemy as sa
+
+from .models import (DBSession, Comment, GroupSource, Photometry, Source,
+                     Spectrum)
+
+
+# Order of the types for changes with the same transaction id; never reorder
+TYPES = [('source', Source), ('photometry', Photometry),
+         ('spectrum', Spectrum), ('comment', Comment)]
+
+
+def encode_cursor(txid, rank, id):
+    position = [txid, rank, id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return `(txid, rank, id)`; raises ValueError if invalid."""
+    try:
+        txid, rank, id = json.loads(base64.urlsafe_b64decode(cursor))
+        return int(txid), int(rank), id
+    except Exception:
+        raise ValueError(f'Invalid cursor {cursor!r}')
+
+
+def _after(model, rank, position):
+    """Rows of `model` (with type `rank`) after the cursor position."""
+    if position is None:
+        return sa.true()
+    txid, cursor_rank, id = position
+    table = model.__table__
+    if rank > cursor_rank:
+        return table.c.txid >= txid
+    if rank < cursor_rank:
+        return table.c.txid > txid
+    return sa.tuple_(table.c.txid, table.c.id) > (txid, id)
+
+
+def changes(group_ids, cursor=None, limit=500):
+    """Changes visible to members of `group_ids` after `cursor`.
+
+    Returns
+    -------
+    changes : list of dict
+        `{'type', 'id', 'modified', 'data'}` for at most `limit` changes.
+    cursor : str
+        Cursor to pass to get the following changes.
+    has_more : bool
+        Whether more changes are ready to be fetched.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    visible_sources = (sa.select([GroupSource.source_id])
+                       .where(GroupSource.group_id.in_(group_ids)))
+    # Transactions with smaller ids have all finished
+    horizon = DBSession().execute(sa.select([
+        sa.func.txid_snapshot_xmin(sa.func.txid_current_snapshot())
+    ])).scalar()
+
+    pages = []
+    for rank, (name, model) in enumerate(TYPES):
+        table = model.__table__
+        source_id = table.c.id if model is Source else table.c.source_id
+        rows = (DBSession().query(model)
+                .filter(_after(model, rank, position))
+                .filter(table.c.txid < horizon)
+                .filter(source_id.in_(visible_sources))
+                .order_by(table.c.txid, table.c.id)
+                .limit(limit + 1).all())
+        pages.append([(row.txid, rank, row.id, name, row) for row in rows])
+
+    merged = list(heapq.merge(*pages, key=lambda c: c[:3]))
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    if merged:
+        cursor = encode_cursor(*merged[-1][:3])
+    return ([{'type': name, 'id': id, 'modified': row.modified, 'data': row}
+             for txid, rank, id, name, row in merged],
+            cursor, has_more)
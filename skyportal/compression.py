@@ -0,0 +1,91 @@
+"""Response compression negotiated from the `Accept-Encoding` header.
+
+`CompressedContentEncoding` is a Tornado output transform that compresses
+responses with Brotli (if the `brotli` package is installed) or gzip,
+whichever the client prefers.  Unlike Tornado's `GZipContentEncoding`, each
+chunk is flushed through the compressor as it is written, so that streamed
+responses (see `BaseHandler.success_stream`) reach the client
+incrementally.
+"""
+
+import zlib
+
+import tornado.web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accepted_encodings(header):
+    """Map each encoding in an `Accept-Encoding` header to its quality."""
+    encodings = {}
+    for item in header.split(','):
+        encoding, _, params = item.strip().partition(';')
+        quality = 1.
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.
+        if encoding:
+            encodings[encoding.strip().lower()] = quality
+    return encodings
+
+
+def negotiate(header):
+    """The preferred supported encoding ('br' or 'gzip'), or None."""
+    accepted = accepted_encodings(header or '')
+    supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_quality = None, 0
+    for encoding in supported:  # ties go to the more compact encoding
+        quality = accepted.get(encoding, accepted.get('*', 0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressedContentEncoding(tornado.web.GZipContentEncoding):
+    BROTLI_QUALITY = 5
+
+    def __init__(self, request):
+        self._encoding = negotiate(request.headers.get('Accept-Encoding'))
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        if 'Vary' in headers:
+            headers['Vary'] += ', Accept-Encoding'
+        else:
+            headers['Vary'] = 'Accept-Encoding'
+        if self._encoding:
+            ctype = headers.get('Content-Type', '').split(';')[0]
+            if (not self._compressible_type(ctype) or
+                    (finishing and len(chunk) < self.MIN_LENGTH) or
+                    'Content-Encoding' in headers):
+                self._encoding = None
+        if self._encoding:
+            headers['Content-Encoding'] = self._encoding
+            if self._encoding == 'br':
+                self._compressor = brotli.Compressor(
+                    quality=self.BROTLI_QUALITY)
+            else:
+                self._compressor = zlib.compressobj(
+                    self.GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            chunk = self.transform_chunk(chunk, finishing)
+            if 'Content-Length' in headers:
+                if finishing:
+                    headers['Content-Length'] = str(len(chunk))
+                else:
+                    del headers['Content-Length']
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if not self._encoding:
+            return chunk
+        if self._encoding == 'br':
+            return self._compressor.process(chunk) + (
+                self._compressor.finish() if finishing
+                else self._compressor.flush())
+        return self._compressor.compress(chunk) + self._compressor.flush(
+            zlib.Z_FINISH if finishing else zlib.Z_SYNC_FLUSH)
@@ -0,0 +1,253 @@
+"""Background resolution of external survey cutout URLs.
+
+Some survey cutout services (currently only PanSTARRS-1) do not allow us to
+construct an image URL directly; instead, we have to request an HTML page and
+scrape the image location out of it.  That request can be slow or hang, so it
+is never performed inside a request handler or ingest transaction.  Instead,
+`Source.add_linked_thumbnails` creates the `Thumbnail` row without a URL and
+hands it to a `CutoutResolver`, which fills it in from a worker thread.
+Thumbnails that could not be resolved then (e.g. because the circuit breaker
+was open) are retried periodically by the app server (`schedule_pending`).
+
+Resolved URLs are stored in the `survey_cutouts` table, so that each position
+is only ever looked up once.
+"""
+
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import sqlalchemy as sa
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .models import DBSession, Photometry, Source, SurveyCutout, Thumbnail
+
+
+PS1_QUERY_URL = "http://ps1images.stsci.edu/cgi-bin/ps1cutouts"
+PS1_IMAGE_RE = re.compile('src="(//ps1images.stsci.edu.*?)"')
+
+
+class CircuitBreaker:
+    """Stop calling an external service after repeated failures.
+
+    After `max_failures` consecutive failures the breaker "opens" and
+    `allow` returns False for `reset_timeout` seconds.  After that, a single
+    trial call is let through; if it succeeds the breaker closes again,
+    otherwise it stays open for another `reset_timeout` seconds.
+    """
+    def __init__(self, max_failures=5, reset_timeout=60):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: let one trial request through
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+
+
+class CutoutResolver:
+    """Resolve survey cutout URLs on a pool of worker threads.
+
+    Parameters
+    ----------
+    ps1_url : str
+        Location of the PS1 cutout query service.  Tests point this at a local
+        HTTP server.
+    max_workers : int
+        Number of worker threads (and pooled HTTP connections).
+    timeout : float
+        Timeout, in seconds, for each HTTP request.
+    retries : int
+        Number of times a failed request (connection errors, 5xx responses) is
+        retried, with exponential backoff.
+    breaker : CircuitBreaker, optional
+        Circuit breaker guarding the external service.
+    """
+    def __init__(self, ps1_url=PS1_QUERY_URL, max_workers=4, timeout=10,
+                 retries=3, breaker=None):
+        self.ps1_url = ps1_url
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+
+        retry = Retry(total=retries, backoff_factor=0.5,
+                      status_forcelist=(500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='cutouts')
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
+    def fetch_panstarrs_url(self, ra, dec):
+        """Query the PS1 cutout service for the color image at (ra, dec).
+
+        This blocks on the external service; call it from a worker thread.
+        Returns None if the service is unavailable or no image was found.
+        """
+        if not self.breaker.allow():
+            return None
+
+        try:
+            response = self.session.get(
+                self.ps1_url,
+                params=[('pos', f'{ra} {dec}'), ('filter', 'color'),
+                        ('filter', 'g'), ('filter', 'r'), ('filter', 'i'),
+                        ('filetypes', 'stack'), ('size', 400)],
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+        except requests.RequestException:
+            self.breaker.record_failure()
+            return None
+
+        self.breaker.record_success()
+        match = PS1_IMAGE_RE.search(response.content.decode())
+        return 'http:' + match.group(1) if match else None
+
+    def cached_panstarrs_url(self, ra, dec):
+        """Return the PS1 cutout URL for (ra, dec) if it was resolved before,
+        or None."""
+        return (DBSession().query(SurveyCutout.url)
+                .filter(SurveyCutout.survey == 'ps1')
+                .filter(SurveyCutout.ra == ra)
+                .filter(SurveyCutout.dec == dec)
+                .scalar())
+
+    def panstarrs_url(self, ra, dec):
+        """Return the PS1 cutout URL for (ra, dec), using the cache if possible.
+
+        Successfully resolved URLs are added to the cache.  This blocks on
+        the external service; call it from a worker thread.
+        """
+        cached = self.cached_panstarrs_url(ra, dec)
+        if cached is not None:
+            return cached
+
+        url = self.fetch_panstarrs_url(ra, dec)
+        if url is not None:
+            DBSession().add(SurveyCutout(survey='ps1', ra=ra, dec=dec,
+                                         url=url))
+            try:
+                DBSession().commit()
+            except sa.exc.IntegrityError:
+                # Another worker resolved the same position concurrently
+                DBSession().rollback()
+        return url
+
+    def _resolve_thumbnail(self, thumbnail_id, ra, dec):
+        try:
+            url = self.panstarrs_url(ra, dec)
+            if url is not None:
+                (DBSession().query(Thumbnail)
+                 .filter(Thumbnail.id == thumbnail_id)
+                 .update({'public_url': url}, synchronize_session=False))
+                DBSession().commit()
+            return url
+        except Exception:
+            DBSession().rollback()
+            raise
+        finally:
+            DBSession.remove()
+
+    def _lookup(self, ra, dec):
+        try:
+            return self.panstarrs_url(ra, dec)
+        finally:
+            DBSession.remove()
+
+    def lookup(self, ra, dec):
+        """Resolve (and cache) the PS1 cutout URL for (ra, dec) in the
+        background; returns a `concurrent.futures.Future`."""
+        return self.executor.submit(self._lookup, ra, dec)
+
+    def submit(self, thumbnail_id, ra, dec):
+        """Fill in `public_url` of the given PS1 thumbnail in the background.
+
+        A thumbnail that is already being resolved is not queued again.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the URL, or None if it could not be determined.
+        """
+        with self._in_flight_lock:
+            future = self._in_flight.get(thumbnail_id)
+            if future is not None:
+                return future
+            future = self._in_flight[thumbnail_id] = self.executor.submit(
+                self._resolve_thumbnail, thumbnail_id, ra, dec)
+        # Outside the lock: runs immediately if the future is already done
+        future.add_done_callback(lambda f: self._done(thumbnail_id))
+        return future
+
+    def _done(self, thumbnail_id):
+        with self._in_flight_lock:
+            self._in_flight.pop(thumbnail_id, None)
+
+    def resolve_pending(self):
+        """Queue all PS1 thumbnails that do not have a URL yet, e.g. because
+        the circuit breaker was open when they were created.
+        """
+        pending = (DBSession().query(Thumbnail.id, Source.ra, Source.dec)
+                   .join(Photometry, Thumbnail.photometry_id == Photometry.id)
+                   .join(Source, Photometry.source_id == Source.id)
+                   .filter(Thumbnail.type == 'ps1')
+                   .filter(Thumbnail.public_url.is_(None))
+                   .all())
+        return [self.submit(*row) for row in pending]
+
+    def _resolve_pending(self):
+        try:
+            return self.resolve_pending()
+        finally:
+            DBSession.remove()
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """Return the process-wide `CutoutResolver`, creating it if needed."""
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = CutoutResolver()
+        return _resolver
+
+
+def schedule_pending():
+    """Queue the unresolved PS1 thumbnails on the process-wide resolver; the
+    database query also runs on a worker thread."""
+    resolver = get_resolver()
+    return resolver.executor.submit(resolver._resolve_pending)
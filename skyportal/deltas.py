@@ -0,0 +1,71 @@
+"""Incremental updates of sources, pushed to clients.
+
+Instead of asking every client to refetch a source whenever one of its
+comments, photometry points or spectra changes (`skyportal/REFRESH_SOURCE`),
+handlers push a `skyportal/SOURCE_DELTA` message carrying the changed
+entities:
+
+    {"source_id": "14gqr", "version": 8, "entity": "comment",
+     "op": "created", "data": [{"id": 31, "text": ..., ...}]}
+
+`Source.version` is incremented in the transaction making the change, so
+that a client holding version 7 of the source can apply the delta, while a
+client that missed a message (its version is not `version - 1`) falls back
+to refetching the source.  Deltas of a source queued together for a client
+are merged into one message listing them in order (see `merge`):
+
+    {"source_id": "14gqr", "version": 9, "deltas": [{..., "version": 8},
+                                                    {..., "version": 9}]}
+"""
+
+from . import serialize
+from .models import DBSession, Source
+
+
+SOURCE_DELTA = 'skyportal/SOURCE_DELTA'
+
+ENTITIES = ('comment', 'photometry', 'spectrum')
+OPS = ('created', 'updated', 'deleted')
+
+
+def bump_source_version(source_id, session=None):
+    """Increment the version of a source, within the current transaction of
+    `session` (by default `DBSession`), and return the new version (or None
+    if there is no such source)."""
+    table = Source.__table__
+    return (session or DBSession()).execute(
+        table.update().where(table.c.id == source_id)
+        .values(version=table.c.version + 1)
+        .returning(table.c.version)).scalar()
+
+
+def source_delta(source_id, version, entity, op, data):
+    """Payload of a `SOURCE_DELTA` message; `data` is a list of entities
+    (ORM objects or dicts)."""
+    if entity not in ENTITIES or op not in OPS:
+        raise ValueError(f'Invalid delta {entity} {op}')
+    return {'source_id': source_id, 'version': version, 'entity': entity,
+            'op': op, 'data': serialize.to_primitive(list(data))}
+
+
+def merge(first, second):
+    """Combine two (possibly merged) deltas of a source into a message
+    listing them in order."""
+    return {'source_id': second['source_id'], 'version': second['version'],
+            'deltas': (first.get('deltas', [first]) +
+                       second.get('deltas', [second]))}
+
+
+def comment_data(comment):
+    """A comment as shown by the frontend, with its author's username."""
+    return {'id': comment.id, 'source_id': comment.source_id,
+            'text': comment.text, 'created_at': comment.created_at,
+            'attachment_name': comment.attachment_name,
+            'user': {'username': comment.user.username}}
+
+
+def spectrum_data(spectrum):
+    """Spectrum metadata, without the (large) data arrays."""
+    return {'id': spectrum.id, 'source_id': spectrum.source_id,
+            'instrument_id': spectrum.instrument_id,
+            'observed_at': spectrum.observed_at}
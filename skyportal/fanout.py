@@ -0,0 +1,98 @@
+"""Targeted fan-out of websocket messages about sources.
+
+Messages about a source (see `skyportal.deltas`) are pushed only to the
+users who can see it, that is, the members of the groups the source belongs
+to, rather than broadcast to every connected client.
+
+`MembershipIndex` caches the users of each source for `ttl` seconds, so
+that a burst of messages about a source costs a single query.  Handlers
+changing group memberships (of users or sources) call `invalidate`; as the
+cache is per process, other app processes see the change after at most
+`ttl` seconds, until when a user removed from a group may still receive
+messages about its sources, and a user added to it will refetch the source
+when they next see a version gap.
+"""
+
+import collections
+import threading
+import time
+
+import sqlalchemy as sa
+
+from .models import DBSession, GroupSource, GroupUser
+
+
+def source_users(source_ids):
+    """Map each of `source_ids` to the set of ids of the users who can see
+    it."""
+    users = {source_id: set() for source_id in source_ids}
+    rows = DBSession().execute(
+        sa.select([GroupSource.source_id, GroupUser.user_id]).distinct()
+        .select_from(GroupSource.__table__.join(
+            GroupUser.__table__,
+            GroupSource.group_id == GroupUser.group_id))
+        .where(GroupSource.source_id.in_(list(source_ids))))
+    for source_id, user_id in rows:
+        users[source_id].add(user_id)
+    return users
+
+
+class MembershipIndex:
+    """Least recently used cache of the users of each source.
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds during which a cached entry is used.
+    max_size : int
+        Maximum number of sources cached.
+    load : callable
+        Function mapping a list of source ids to a dict of sets of user ids
+        (`source_users` by default).
+    """
+    def __init__(self, ttl=30, max_size=10000, load=source_users):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.load = load
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+    def users(self, source_ids):
+        """Return a dict mapping each of `source_ids` to a frozenset of the
+        ids of the users who can see it."""
+        now = time.monotonic()
+        result, missing = {}, []
+        with self.lock:
+            for source_id in source_ids:
+                entry = self.entries.get(source_id)
+                if entry is not None and entry[0] > now:
+                    self.entries.move_to_end(source_id)
+                    result[source_id] = entry[1]
+                else:
+                    missing.append(source_id)
+            self.hits += len(result)
+            self.misses += len(missing)
+        if missing:
+            loaded = {source_id: frozenset(users) for source_id, users
+                      in self.load(missing).items()}
+            with self.lock:
+                for source_id, users in loaded.items():
+                    self.entries[source_id] = (now + self.ttl, users)
+                    self.entries.move_to_end(source_id)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+            result.update(loaded)
+        return result
+
+    def invalidate(self, source_ids=None):
+        """Forget the users of `source_ids` (by default, of all sources)."""
+        with self.lock:
+            if source_ids is None:
+                self.entries.clear()
+            else:
+                for source_id in source_ids:
+                    self.entries.pop(source_id, None)
+
+
+membership = MembershipIndex()
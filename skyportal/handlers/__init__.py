@@ -1,17 +1,22 @@
-from baselayer.app.handlers import (BaseHandler, MainPageHandler,
-                                    SocketAuthTokenHandler, ProfileHandler,
-                                    LogoutHandler)
+from baselayer.app.handlers import (MainPageHandler, SocketAuthTokenHandler,
+                                    ProfileHandler, LogoutHandler)
 from baselayer.app.custom_exceptions import AccessError
 
-from .source import SourceHandler
-from .comment import CommentHandler
+from .base import BaseHandler
+from .source import SourceHandler, SourceBulkHandler
+from .comment import CommentHandler, CommentAttachmentHandler
 from .group import GroupHandler, GroupUserHandler
 from .plot import PlotPhotometryHandler, PlotSpectroscopyHandler
 from .profile import ProfileHandler
 from .logout import LogoutHandler
 from .become_user import BecomeUserHandler
-from .photometry import PhotometryHandler
+from .photometry import PhotometryHandler, PhotometryStreamHandler
+from .spectrum import SpectrumHandler, SpectrumStreamHandler
 from .token import TokenHandler
 from .sysinfo import SysInfoHandler
 from .userinfo import UserInfoHandler
+from .metrics import MetricsHandler
+from .profiler import CPUProfileHandler, MemoryProfileHandler
+from .openapi import OpenAPIHandler
+from .changes import ChangeFeedHandler
 
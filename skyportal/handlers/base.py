@@ -0,0 +1,147 @@
+
+from sqlalchemy.orm import Session
+from baselayer.app.handlers.base import BaseHandler as BaselayerHandler
+
+from .. import (fanout, metrics, outbox, query_log, serialize,
+               slow_query_log, tracing)
+from ..models import DBSession
+
+
+class BaseHandler(BaselayerHandler):
+    """Base class of all SkyPortal handlers.
+
+    Records request metrics (see `skyportal.metrics`), counts messages
+    pushed to websocket clients, traces sampled requests (see
+    `skyportal.tracing`) and, if `debug:query_log` is enabled, records the
+    SQL statements of each request (see `skyportal.query_log`).  The
+    handler name is recorded for the slow query log.  Responses are
+    serialized with `skyportal.serialize`, and large lists can be streamed
+    with `success_stream`.  Handlers support conditional requests with
+    `is_current` and `not_modified`.  Messages about a source are pushed
+    to the users who can see it with `push_source`; these and messages
+    pushed to all users are coalesced by `skyportal.outbox`.
+    """
+    def prepare(self):
+        slow_query_log.set_handler(
+            f'{self.request.method} {type(self).__name__}')
+        self._request_metrics = metrics.start_request()
+        self._trace = tracing.start_trace(
+            f'{self.request.method} {type(self).__name__}',
+            self.request.headers.get('traceparent'),
+            **{'http.method': self.request.method,
+               'http.target': self.request.path})
+        if self._trace is not None:
+            self.set_header('X-Trace-Id', self._trace.trace.trace_id)
+        super().prepare()
+        if self.cfg['debug:query_log']:
+            self._query_log = query_log.start_request()
+
+    def finish(self, chunk=None):
+        log = getattr(self, '_query_log', None)
+        if log is not None and not self._headers_written:
+            self.set_header('X-Query-Count', log.count)
+            repeated = log.repeated(self.cfg['debug:n_plus_one_threshold'])
+            if repeated:
+                shape, n, sites = repeated[0]
+                self.set_header('X-Query-Repeated', f'{n}x at {sites[0]}')
+        return super().finish(chunk)
+
+    def on_finish(self):
+        request = getattr(self, '_request_metrics', None)
+        if request is not None:
+            metrics.finish_request(request, type(self).__name__,
+                                   self.request.method, self.get_status())
+        trace = getattr(self, '_trace', None)
+        if trace is not None:
+            tracing.finish_trace(trace,
+                                 **{'http.status_code': self.get_status()})
+        log = getattr(self, '_query_log', None)
+        if log is not None:
+            query_log.finish_request(
+                log, f'{self.request.method} {self.request.path}',
+                self.cfg['debug:n_plus_one_threshold'])
+        super().on_finish()
+
+    def success(self, data={}, action=None, payload={}):
+        """Write a successful JSON response, serialized with
+        `skyportal.serialize.to_json`, and optionally push `action` to the
+        current user's frontend."""
+        if action is not None:
+            self.push(action, payload)
+        with tracing.span('serialize'):
+            body = serialize.to_json({'status': 'success', 'data': data})
+        self.set_header('Content-Type', 'application/json')
+        self.write(body)
+
+    def is_current(self, version):
+        """Set the `ETag` header from a version stamp (see
+        `skyportal.versioning`), and return whether the client's cached
+        copy, as given by `If-None-Match`, is still current.  If so, the
+        handler should check access to the resource and call `not_modified`.
+
+        No `Last-Modified` header is sent: the latest timestamp of a
+        resource does not change when one of its rows is deleted, whereas
+        its ETag does.
+        """
+        self.set_header('ETag', f'"{version.etag}"')
+        # Clients may cache responses, but must revalidate them
+        self.set_header('Cache-Control', 'private, no-cache')
+        if self.request.headers.get('If-None-Match'):
+            return self.check_etag_header()
+        return False
+
+    def not_modified(self):
+        self.set_status(304)
+        self.finish()
+
+    async def success_stream(self, query, chunk_size=1000):
+        """Write a successful JSON response whose data are the results of
+        `query`, streamed in chunks of `chunk_size` objects.
+
+        The query is run in a separate session, on a server-side cursor
+        (`yield_per`), and each chunk is serialized and flushed to the client
+        before the next one is fetched, so that memory use does not grow
+        with the number of results.  The query must not eagerly load
+        collections, which `yield_per` does not support.
+        """
+        session = Session(bind=DBSession().get_bind())
+        try:
+            rows = query.with_session(session).yield_per(chunk_size)
+            self.set_header('Content-Type', 'application/json')
+            self.write(b'{"status":"success","data":[')
+            separator = b''
+            chunk = []
+            with tracing.span('serialize', streamed=True):
+                for row in rows:
+                    chunk.append(row)
+                    if len(chunk) == chunk_size:
+                        self.write(separator + serialize.to_json(chunk)[1:-1])
+                        separator, chunk = b',', []
+                        await self.flush()
+                if chunk:
+                    self.write(separator + serialize.to_json(chunk)[1:-1])
+            self.write(b']}')
+        finally:
+            session.close()
+
+    def push(self, action, payload={}):
+        metrics.WEBSOCKET_MESSAGES.inc(action=action, target='user')
+        with tracing.span('push', action=action, target='user'):
+            return super().push(action, payload)
+
+    def push_all(self, action, payload={}):
+        metrics.WEBSOCKET_MESSAGES.inc(action=action, target='all')
+        with tracing.span('push', action=action, target='all'):
+            outbox.outbox.push('*', action, payload)
+
+    def push_source(self, source_id, action, payload={}):
+        """Push `action` to the frontends of the users who can see the
+        source `source_id` (see `skyportal.fanout`)."""
+        with tracing.span('push', action=action, target='source') as span:
+            user_ids = fanout.membership.users([source_id])[source_id]
+            if span is not None:
+                span.attributes['recipients'] = len(user_ids)
+            for user_id in user_ids:
+                outbox.outbox.push(user_id, action, payload)
+        metrics.WEBSOCKET_MESSAGES.inc(len(user_ids), action=action,
+                                       target='source')
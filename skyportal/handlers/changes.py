@@ -0,0 +1,76 @@
+from baselayer.app.access import auth_or_token
+from .base import BaseHandler
+from .. import changes
+
+
+MAX_LIMIT = 5000
+
+
+class ChangeFeedHandler(BaseHandler):
+    @auth_or_token
+    def get(self):
+        """
+        ---
+        description: |
+          Retrieve sources, photometry, spectra and comments created or
+          modified since a cursor, oldest first, restricted to sources of
+          the caller's groups.  Start without a cursor, then pass the
+          returned cursor to poll for further changes.  Changes are held
+          back while older transactions are still in progress.
+        parameters:
+          - in: query
+            name: cursor
+            schema:
+              type: string
+            description: Cursor returned by the previous request
+          - in: query
+            name: limit
+            schema:
+              type: integer
+            description: Maximum number of changes (default 500, max 5000)
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  allOf:
+                    - Success
+                    - type: object
+                      properties:
+                        changes:
+                          type: array
+                          items:
+                            type: object
+                            properties:
+                              type:
+                                type: string
+                                enum: [source, photometry, spectrum, comment]
+                              id: {}
+                              modified:
+                                type: string
+                              data:
+                                type: object
+                        cursor:
+                          type: string
+                        has_more:
+                          type: boolean
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
+        try:
+            limit = int(self.get_query_argument('limit', 500))
+        except ValueError:
+            return self.error('limit must be an integer')
+        if not 0 < limit <= MAX_LIMIT:
+            return self.error(f'limit must be between 1 and {MAX_LIMIT}')
+
+        group_ids = [group.id for group in self.current_user.groups]
+        try:
+            results, cursor, has_more = changes.changes(
+                group_ids, self.get_query_argument('cursor', None), limit)
+        except ValueError as e:
+            return self.error(str(e))
+        return self.success({'changes': results, 'cursor': cursor,
+                             'has_more': has_more})
@@ -1,8 +1,43 @@
 import tornado.web
-import base64
 from baselayer.app.access import permissions, auth_or_token
-from baselayer.app.handlers.base import BaseHandler
-from ..models import DBSession, Source, User, Comment, Role
+from .base import BaseHandler
+from .. import deltas, versioning
+from ..models import DBSession, Source, User, Comment, Role, Token
+from ..attachments import (AttachmentWriter, delete_unused, iter_attachment,
+                           store_attachment, store_base64_attachment)
+from .streaming import StreamingUploadHandler
+
+
+def _parse_range(range_header, size):
+    """Parse a single-range HTTP `Range` header into a [start, end) tuple.
+
+    Returns None if there is no (usable) range header.
+    """
+    if not range_header or not range_header.startswith('bytes='):
+        return None
+    spec = range_header[len('bytes='):]
+    if ',' in spec:
+        return None  # multiple ranges are not supported; send everything
+    start, _, end = spec.partition('-')
+    try:
+        if start == '':
+            start, end = max(size - int(end), 0), size
+        else:
+            start = int(start)
+            end = min(int(end) + 1, size) if end else size
+    except ValueError:
+        return None
+    return start, end
+
+
+def _is_author(user_or_token, comment):
+    """Whether a user (or the creator of a token) wrote `comment`, or is a
+    system admin."""
+    if 'System admin' in {acl.id for acl in user_or_token.acls}:
+        return True
+    user_id = (user_or_token.created_by_id
+               if isinstance(user_or_token, Token) else user_or_token.id)
+    return comment.user_id == user_id
 
 
 class CommentHandler(BaseHandler):
@@ -23,21 +58,54 @@ class CommentHandler(BaseHandler):
               application/json:
                 schema: SingleComment
         """
-        comment = Comment.query.get(comment_id)
         if action == 'download_attachment':
-            self.set_header(
-                "Content-Disposition", "attachment; "
-                f"filename={comment.attachment_name}")
-            self.write(base64.b64decode(comment.attachment_bytes))
-        else:
-            # TODO: Ensure that it's okay for anyone to read any comment
-            return self.success(data=comment)
+            return self._download_attachment(Comment.query.get(comment_id))
+        # TODO: Ensure that it's okay for anyone to read any comment
+        if self.is_current(versioning.comment_version(comment_id)):
+            return self.not_modified()
+        return self.success(data=Comment.query.get(comment_id))
+
+    async def _download_attachment(self, comment):
+        if comment is None or comment.attachment is None:
+            return self.error('Comment has no attachment.')
+        attachment = comment.attachment
+
+        self.set_header("Accept-Ranges", "bytes")
+        self.set_header("Content-Type",
+                        comment.attachment_type or 'application/octet-stream')
+        self.set_header(
+            "Content-Disposition", "attachment; "
+            f"filename={comment.attachment_name}")
+        self.set_header("Etag", f'"{attachment.sha256}"')
+
+        start, end = 0, attachment.size
+        byte_range = _parse_range(self.request.headers.get("Range"),
+                                  attachment.size)
+        if byte_range is not None:
+            start, end = byte_range
+            if start >= end:
+                self.set_status(416)
+                self.set_header("Content-Range", f"bytes */{attachment.size}")
+                return self.finish()
+            self.set_status(206)
+            self.set_header("Content-Range",
+                            f"bytes {start}-{end - 1}/{attachment.size}")
+        self.set_header("Content-Length", end - start)
+
+        for data in iter_attachment(attachment, start, end):
+            self.write(data)
+            await self.flush()
+        self.finish()
 
     @permissions(['Comment'])
     def post(self):
         """
         ---
-        description: Post a comment
+        description: |
+          Post a comment.  Attachments sent inline (base64 in JSON, or
+          multipart/form-data) are held in memory with the request; upload
+          large files with `PUT /api/comment/{comment_id}/attachment`
+          instead, which streams them to storage.
         parameters:
           - in: path
             name: comment
@@ -51,29 +119,46 @@ class CommentHandler(BaseHandler):
                     - Success
                     - type: object
                       properties:
-                        source_id:
+                        comment_id:
                           type: integer
-                          description: Associated source ID
+                          description: New comment ID
         """
-        data = self.get_json()
-        source_id = data['source_id']
-        if 'attachment' in data and 'body' in data['attachment']:
-            attachment_bytes = str.encode(data['attachment']['body']
-                                          .split('base64,')[-1])
-            attachment_name = data['attachment']['name']
+        content_type = self.request.headers.get('Content-Type', '')
+        attachment, attachment_name, attachment_type = None, None, None
+        if content_type.startswith('multipart/form-data'):
+            data = {k: self.get_body_argument(k) for k in
+                    self.request.body_arguments}
+            if 'attachment' in self.request.files:
+                upload = self.request.files['attachment'][0]
+                attachment = store_attachment(upload['body'])
+                attachment_name = upload['filename']
+                attachment_type = upload['content_type']
         else:
-            attachment_bytes, attachment_name = None, None
+            data = self.get_json()
+            if 'attachment' in data and 'body' in data['attachment']:
+                header, _, body = (data['attachment']['body']
+                                   .rpartition('base64,'))
+                attachment = store_base64_attachment(body)
+                attachment_name = data['attachment']['name']
+                if header.startswith('data:'):
+                    attachment_type = header[5:].rstrip(';') or None
+        source_id = data['source_id']
 
         comment = Comment(user=self.current_user, text=data['text'],
-                          source_id=source_id, attachment_bytes=attachment_bytes,
-                          attachment_name=attachment_name)
+                          source_id=source_id, attachment=attachment,
+                          attachment_name=attachment_name,
+                          attachment_type=attachment_type)
 
         DBSession().add(comment)
+        DBSession().flush()
+        version = deltas.bump_source_version(comment.source_id)
         DBSession().commit()
 
-        self.push_all(action='skyportal/REFRESH_SOURCE',
-                      payload={'source_id': comment.source_id})
-        return self.success()
+        self.push_source(comment.source_id, deltas.SOURCE_DELTA,
+                         deltas.source_delta(
+                             comment.source_id, version, 'comment', 'created',
+                             [deltas.comment_data(comment)]))
+        return self.success({'comment_id': comment.id})
 
     @permissions(['Comment'])
     def put(self, comment_id):
@@ -95,11 +180,13 @@ class CommentHandler(BaseHandler):
         # TODO: Check ownership
         comment = Comment.query.get(comment_id)
         comment.text = data['text']
-
+        version = deltas.bump_source_version(comment.source_id)
         DBSession().commit()
 
-        self.push_all(action='skyportal/REFRESH_SOURCE',
-                      payload={'source_id': comment.source_id})
+        self.push_source(comment.source_id, deltas.SOURCE_DELTA,
+                         deltas.source_delta(
+                             comment.source_id, version, 'comment', 'updated',
+                             [deltas.comment_data(comment)]))
         return self.success()
 
     @permissions(['Comment'])
@@ -121,9 +208,100 @@ class CommentHandler(BaseHandler):
         """
         # TODO: Check ownership
         comment = Comment.query.get(comment_id)
-        DBSession().delete(c)
+        source_id, attachment_id = comment.source_id, comment.attachment_id
+        DBSession().delete(comment)
+        DBSession().flush()
+        delete_unused([attachment_id])
+        version = deltas.bump_source_version(source_id)
+        DBSession().commit()
+
+        self.push_source(source_id, deltas.SOURCE_DELTA,
+                         deltas.source_delta(
+                             source_id, version, 'comment', 'deleted',
+                             [{'id': int(comment_id)}]))
+        return self.success()
+
+
+@tornado.web.stream_request_body
+class CommentAttachmentHandler(StreamingUploadHandler):
+    """Attach a file to a comment, streaming the raw request body to storage.
+
+    Only the author of the comment (or a system admin) may change its
+    attachment; other uploads are rejected before any data is stored.
+    """
+    required_acls = ['Comment']
+    writer = None
+
+    def start_stream(self):
+        comment_id = self.path_args[0].lstrip('/')
+        comment = Comment.query.get(comment_id)
+        if comment is None:
+            raise ValueError(f'Invalid comment ID: {comment_id}')
+        if not _is_author(self.current_user, comment):
+            raise ValueError('Only the author of a comment may change its '
+                             'attachment')
+        self.writer = AttachmentWriter()
+
+    def receive(self, chunk):
+        try:
+            self.writer.write(chunk)
+        except Exception:
+            self.writer.abort()
+            raise
+
+    def on_finish(self):
+        if self.writer is not None:
+            # Discards a partial upload, e.g. if the client went away
+            self.writer.abort()
+        super().on_finish()
+
+    def put(self, comment_id):
+        """
+        ---
+        description: Upload a comment attachment
+        parameters:
+          - in: path
+            name: comment_id
+            required: true
+            schema:
+              type: integer
+          - in: query
+            name: name
+            required: true
+            description: File name of the attachment
+            schema:
+              type: string
+        requestBody:
+          content:
+            application/octet-stream: {}
+        responses:
+          200:
+            content:
+              application/json:
+                schema: Success
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
+        if self.stream_error is not None:
+            return self.error(f'Could not store attachment: {self.stream_error}')
+
+        comment = Comment.query.get(comment_id)
+        if comment is None:
+            self.writer.abort()
+            return self.error(f'Invalid comment ID: {comment_id}')
+        previous_id = comment.attachment_id
+        comment.attachment = self.writer.close()
+        DBSession().flush()
+        delete_unused([previous_id])
+        comment.attachment_name = self.get_query_argument('name')
+        comment.attachment_type = self.request.headers.get('Content-Type')
+        version = deltas.bump_source_version(comment.source_id)
         DBSession().commit()
 
-        self.push_all(action='skyportal/REFRESH_SOURCE',
-                      payload={'source_id': comment.source_id})
+        self.push_source(comment.source_id, deltas.SOURCE_DELTA,
+                         deltas.source_delta(
+                             comment.source_id, version, 'comment', 'updated',
+                             [deltas.comment_data(comment)]))
         return self.success()
@@ -1,7 +1,8 @@
 import tornado.web
 from sqlalchemy.orm import joinedload
 from baselayer.app.access import permissions, auth_or_token
-from baselayer.app.handlers.base import BaseHandler
+from .base import BaseHandler
+from .. import fanout, versioning
 from ..models import DBSession, Group, GroupUser, User
 
 
@@ -39,8 +40,14 @@ class GroupHandler(BaseHandler):
                 application/json:
                   schema: Error
         """
+        is_admin = 'Super admin' in [role.id for role in
+                                     self.current_user.roles]
         if group_id is not None:
-            if 'Super admin' in [role.id for role in self.current_user.roles]:
+            if self.is_current(versioning.group_version(group_id)):
+                if not is_admin:
+                    Group.get_if_owned_by(group_id, self.current_user)
+                return self.not_modified()
+            if is_admin:
                 info = Group.query.options(joinedload(Group.users)).options(
                     joinedload(Group.group_users)).get(group_id)
             else:
@@ -49,11 +56,12 @@ class GroupHandler(BaseHandler):
                     options=[joinedload(Group.users),
                              joinedload(Group.group_users)])
         else:
+            if self.is_current(versioning.group_listing_version(
+                    self.current_user, is_admin)):
+                return self.not_modified()
             info = {}
             info['user_groups'] = list(self.current_user.groups)
-            info['all_groups'] = (list(Group.query) if 'Super admin' in
-                                  [role.id for role in self.current_user.roles]
-                                  else None)
+            info['all_groups'] = list(Group.query) if is_admin else None
         if info is not None:
             return self.success(info)
         else:
@@ -142,6 +150,7 @@ class GroupHandler(BaseHandler):
         g = Group.query.get(group_id)
         DBSession().delete(g)
         DBSession().commit()
+        fanout.membership.invalidate()
 
         return self.success(action='skyportal/FETCH_GROUPS')
 
@@ -199,6 +208,7 @@ class GroupUserHandler(BaseHandler):
         gu.admin = data['admin']
         DBSession().add(gu)
         DBSession().commit()
+        fanout.membership.invalidate()
 
         self.push_all(action='skyportal/REFRESH_GROUP',
                       payload={'group_id': gu.group_id})
@@ -231,6 +241,7 @@ class GroupUserHandler(BaseHandler):
         (GroupUser.query.filter(GroupUser.group_id == group_id)
                    .filter(GroupUser.user_id == user_id).delete())
         DBSession().commit()
+        fanout.membership.invalidate()
         self.push_all(action='skyportal/REFRESH_GROUP',
                       payload={'group_id': int(group_id)})
         return self.success()
@@ -0,0 +1,18 @@
+import tornado.web
+
+from .base import BaseHandler
+from .. import metrics
+
+
+class MetricsHandler(BaseHandler):
+    """Metrics in the Prometheus text format, for internal scrapers.
+
+    Only served to the addresses listed in the `metrics:allowed_ips`
+    configuration option, since scrapers do not authenticate.
+    """
+    def get(self):
+        allowed_ips = self.cfg['metrics:allowed_ips'] or []
+        if self.request.remote_ip not in allowed_ips:
+            raise tornado.web.HTTPError(403)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(metrics.expose())
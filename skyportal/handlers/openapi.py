@@ -0,0 +1,16 @@
+from .base import BaseHandler
+
+
+class OpenAPIHandler(BaseHandler):
+    """The OpenAPI spec of the SkyPortal API, as JSON.
+
+    The spec is generated on the first request (see `openapi.CachedSpec`);
+    its fingerprint doubles as the ETag, so that clients can revalidate
+    their copy without downloading it again.
+    """
+    def compute_etag(self):
+        return f'"{self.application.openapi_spec.fingerprint}"'
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.write(self.application.openapi_spec.to_json())
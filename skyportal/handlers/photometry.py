@@ -1,9 +1,11 @@
+import numpy as np
 import tornado.web
-from astropy.time import Time
 from sqlalchemy.orm import joinedload
 from baselayer.app.access import permissions, auth_or_token
-from baselayer.app.handlers.base import BaseHandler
+from .base import BaseHandler
+from .. import deltas
 from ..models import DBSession, Photometry, Comment
+from .streaming import StreamingUploadHandler
 
 
 class PhotometryHandler(BaseHandler):
@@ -40,9 +42,10 @@ class PhotometryHandler(BaseHandler):
             data['obsTime'] = [data['obsTime']]
             data['mag'] = [data['mag']]
             data['e_mag'] = [data['e_mag']]
-        ids = []
+        points = []
         for i in range(len(data['mag'])):
             if not (data['timeScale'] == 'tcb' and data['timeFormat'] == 'iso'):
+                from astropy.time import Time  # imported lazily: slow to load
                 t = Time(data['obsTime'][i],
                          format=data['timeFormat'],
                          scale=data['timeScale'])
@@ -58,10 +61,18 @@ class PhotometryHandler(BaseHandler):
                            instrument_id=data['instrumentID'],
                            lim_mag=data['lim_mag'],
                            filter=data['filter'])
-            ids.append(p.id)
             DBSession().add(p)
+            points.append(p)
+        DBSession().flush()
+        ids = [p.id for p in points]
+        version = deltas.bump_source_version(data['sourceID'])
         DBSession().commit()
+        # Reload the points expired by the commit in one query
+        points = Photometry.query.filter(Photometry.id.in_(ids)).all()
+        delta = deltas.source_delta(data['sourceID'], version, 'photometry',
+                                    'created', points)
 
+        self.push_source(data['sourceID'], deltas.SOURCE_DELTA, delta)
         return self.success({"ids": ids})
 
     """TODO any need for get/put/delete?
@@ -92,3 +103,155 @@ class PhotometryHandler(BaseHandler):
 
     return self.success(action='cesium/FETCH_SOURCES')
     """
+
+
+@tornado.web.stream_request_body
+class PhotometryStreamHandler(StreamingUploadHandler):
+    """Upload large photometry tables without buffering the request body.
+
+    Rows are parsed as they arrive and inserted in batches of `batch_rows`,
+    so memory use is bounded regardless of upload size.
+    """
+    required_acls = ['Upload data']
+    batch_rows = 10000
+
+    def start_stream(self):
+        self.source_id = self.get_query_argument('sourceID')
+        self.instrument_id = int(self.get_query_argument('instrumentID'))
+        self.time_format = self.get_query_argument('timeFormat')
+        self.time_scale = self.get_query_argument('timeScale')
+        self.filter = self.get_query_argument('filter', None)
+        columns = self.get_query_argument('columns', None)
+        # imported lazily: pandas is slow to load
+        from ..stream_parsers import parser_for
+        self.parser = parser_for(self.request.headers.get('Content-Type'),
+                                 columns.split(',') if columns else None)
+        self.pending = []
+        self.n_pending = 0
+        self.count = 0
+
+    def _insert(self, df):
+        if len(df) == 0:
+            return
+        if self.time_scale == 'tcb' and self.time_format == 'iso':
+            obs_time = df['obsTime'].values
+        else:
+            from astropy.time import Time  # imported lazily: slow to load
+            obs_time = Time(df['obsTime'].values, format=self.time_format,
+                            scale=self.time_scale).tcb.iso
+
+        import pandas as pd  # imported lazily: slow to load
+        n = len(df)
+        nan = np.full(n, np.nan)
+        rows = pd.DataFrame({
+            'source_id': self.source_id,
+            'instrument_id': self.instrument_id,
+            'observed_at': obs_time,
+            'time_scale': 'tcb',
+            'time_format': 'iso',
+            'mag': df['mag'].values if 'mag' in df else nan,
+            'e_mag': df['e_mag'].values if 'e_mag' in df else nan,
+            'lim_mag': df['lim_mag'].values if 'lim_mag' in df else nan,
+            'filter': df['filter'].values if 'filter' in df else self.filter,
+        })
+        rows = rows.astype(object).where(rows.notnull(), None)
+        self.session.execute(Photometry.__table__.insert(),
+                             rows.to_dict('records'))
+        self.count += n
+
+    def _flush(self):
+        if self.pending:
+            import pandas as pd  # imported lazily: slow to load
+            self._insert(pd.concat(self.pending, ignore_index=True))
+        self.pending, self.n_pending = [], 0
+
+    def receive(self, chunk):
+        df = self.parser.feed(chunk)
+        if df is not None:
+            self.pending.append(df)
+            self.n_pending += len(df)
+            if self.n_pending >= self.batch_rows:
+                self._flush()
+
+    def post(self):
+        """
+        ---
+        description: Stream a photometry table
+        parameters:
+          - in: query
+            name: sourceID
+            required: true
+            schema:
+              type: string
+          - in: query
+            name: instrumentID
+            required: true
+            schema:
+              type: integer
+          - in: query
+            name: timeFormat
+            required: true
+            schema:
+              type: string
+          - in: query
+            name: timeScale
+            required: true
+            schema:
+              type: string
+          - in: query
+            name: filter
+            required: false
+            schema:
+              type: string
+          - in: query
+            name: columns
+            required: false
+            description: |
+              Comma-separated column names, required for binary uploads and
+              for CSV without a header line.  Recognized columns are
+              obsTime, mag, e_mag, lim_mag and filter.
+            schema:
+              type: string
+        requestBody:
+          content:
+            text/csv: {}
+            application/x-npy: {}
+            application/octet-stream: {}
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  allOf:
+                    - Success
+                    - type: object
+                      properties:
+                        count:
+                          type: integer
+                          description: Number of photometry points stored
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
+        if self.stream_error is None:
+            try:
+                df = self.parser.close()
+                if df is not None:
+                    self.pending.append(df)
+                self._flush()
+            except Exception as e:
+                self.session.rollback()
+                self.stream_error = str(e)
+        if self.stream_error is not None:
+            return self.error(f'Could not store photometry: {self.stream_error}')
+
+        if self.count:
+            deltas.bump_source_version(self.source_id, self.session)
+        self.session.commit()
+
+        if self.count:
+            # Too many points for a delta: clients refetch the source
+            self.push_source(self.source_id, 'skyportal/REFRESH_SOURCE',
+                             {'source_id': self.source_id})
+        return self.success({"count": self.count})
@@ -1,6 +1,6 @@
-from baselayer.app.handlers.base import BaseHandler
+from .base import BaseHandler
 from baselayer.app.access import auth_or_token
-from .. import plot
+from .. import tracing, versioning
 
 import tornado.web
 
@@ -9,7 +9,11 @@ import tornado.web
 class PlotPhotometryHandler(BaseHandler):
     @auth_or_token
     def get(self, source_id):
-        docs_json, render_items, custom_model_js = plot.photometry_plot(source_id)
+        if self.is_current(versioning.photometry_plot_version(source_id)):
+            return self.not_modified()
+        from .. import plot  # imported lazily: Bokeh is slow to load
+        with tracing.span('bokeh', plot='photometry', source_id=source_id):
+            docs_json, render_items, custom_model_js = plot.photometry_plot(source_id)
         if docs_json is None:
             self.error(f"Could not generate plot for source {source_id}")
         else:
@@ -21,7 +25,11 @@ class PlotPhotometryHandler(BaseHandler):
 class PlotSpectroscopyHandler(BaseHandler):
     @auth_or_token
     def get(self, source_id):
-        docs_json, render_items, custom_model_js = plot.spectroscopy_plot(source_id)
+        if self.is_current(versioning.spectroscopy_plot_version(source_id)):
+            return self.not_modified()
+        from .. import plot  # imported lazily: Bokeh is slow to load
+        with tracing.span('bokeh', plot='spectroscopy', source_id=source_id):
+            docs_json, render_items, custom_model_js = plot.spectroscopy_plot(source_id)
         if docs_json is None:
             self.error(f"Could not generate plot for source {source_id}")
         else:
@@ -0,0 +1,173 @@
+import tornado.gen
+from baselayer.app.access import permissions
+from .base import BaseHandler
+from ..profiling import MemorySnapshots, SamplingProfiler
+
+
+MAX_PROFILE_SECONDS = 300
+memory_snapshots = MemorySnapshots()
+
+
+class CPUProfileHandler(BaseHandler):
+    running = False
+
+    @permissions(['System admin'])
+    async def get(self):
+        """
+        ---
+        description: |
+          Sample the stacks of all threads of this process for a number of
+          seconds, and return them in collapsed stack format (input for
+          flamegraph.pl or speedscope).  The process keeps serving requests
+          while being profiled.
+        parameters:
+          - in: query
+            name: seconds
+            schema:
+              type: number
+            description: Duration of the profile (default 10, max 300)
+          - in: query
+            name: interval
+            schema:
+              type: number
+            description: Seconds between samples (default 0.005)
+        responses:
+          200:
+            content:
+              text/plain:
+                schema:
+                  type: string
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
+        try:
+            seconds = float(self.get_query_argument('seconds', 10))
+            interval = float(self.get_query_argument('interval', 0.005))
+        except ValueError:
+            return self.error('seconds and interval must be numbers')
+        if not 0 < seconds <= MAX_PROFILE_SECONDS or interval <= 0:
+            return self.error(f'seconds must be between 0 and '
+                              f'{MAX_PROFILE_SECONDS}, interval positive')
+        if CPUProfileHandler.running:
+            return self.error('A profile is already being recorded')
+
+        CPUProfileHandler.running = True
+        profiler = SamplingProfiler(interval=interval)
+        try:
+            profiler.start()
+            await tornado.gen.sleep(seconds)
+        finally:
+            profiler.stop()
+            CPUProfileHandler.running = False
+
+        self.set_header('Content-Type', 'text/plain; charset=utf-8')
+        self.set_header('Content-Disposition',
+                        'attachment; filename="profile.collapsed"')
+        self.finish(profiler.collapsed())
+
+
+class MemoryProfileHandler(BaseHandler):
+    @permissions(['System admin'])
+    def get(self, snapshot_id=None):
+        """
+        ---
+        description: |
+          List memory snapshots, show the largest allocation sites of one,
+          or, with `?compare_to=<id>`, the sites that grew the most since
+          an earlier snapshot.
+        parameters:
+          - in: path
+            name: snapshot_id
+            required: false
+            schema:
+              type: integer
+          - in: query
+            name: compare_to
+            schema:
+              type: integer
+          - in: query
+            name: key_type
+            schema:
+              type: string
+              enum: [lineno, filename, traceback]
+        responses:
+          200:
+            content:
+              application/json:
+                schema: Success
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
+        if snapshot_id is None:
+            return self.success({'snapshots': memory_snapshots.list()})
+
+        key_type = self.get_query_argument('key_type', 'lineno')
+        if key_type not in ('lineno', 'filename', 'traceback'):
+            return self.error(f'Invalid key_type {key_type}')
+        compare_to = self.get_query_argument('compare_to', None)
+        try:
+            if compare_to is not None:
+                return self.success(memory_snapshots.compare(
+                    compare_to, snapshot_id, key_type))
+            return self.success(memory_snapshots.top(snapshot_id, key_type))
+        except ValueError as e:
+            return self.error(str(e))
+
+    @permissions(['System admin'])
+    def post(self, _=None):
+        """
+        ---
+        description: |
+          Capture a memory snapshot.  Starts tracing memory allocations
+          (with `tracemalloc`) if needed, which slows down the process
+          until tracing is stopped with DELETE.
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  allOf:
+                    - Success
+                    - type: object
+                      properties:
+                        id:
+                          type: integer
+                          description: Snapshot ID
+        """
+        return self.success({'id': memory_snapshots.take()})
+
+    @permissions(['System admin'])
+    def delete(self, snapshot_id=None):
+        """
+        ---
+        description: |
+          Discard a snapshot or, without a snapshot ID, discard all
+          snapshots and stop tracing memory allocations.
+        parameters:
+          - in: path
+            name: snapshot_id
+            required: false
+            schema:
+              type: integer
+        responses:
+          200:
+            content:
+              application/json:
+                schema: Success
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
+        if snapshot_id is None:
+            memory_snapshots.stop()
+            return self.success()
+        try:
+            memory_snapshots.discard(snapshot_id)
+        except ValueError as e:
+            return self.error(str(e))
+        return self.success()
@@ -1,16 +1,19 @@
+import datetime
+
 import tornado.web
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
 from sqlalchemy.orm import joinedload
 from baselayer.app.access import permissions, auth_or_token
-from baselayer.app.handlers import BaseHandler
-from ..models import (DBSession, Comment, Instrument, Photometry, Source,
-                      Thumbnail, Token, User)
-
-from functools import reduce
+from .base import BaseHandler
+from .. import fanout, versioning
+from ..models import (DBSession, Comment, GroupSource, Instrument,
+                      Photometry, Source, Thumbnail, Token, User)
 
 
 class SourceHandler(BaseHandler):
     @auth_or_token
-    def get(self, source_id=None):
+    async def get(self, source_id=None):
         """
         ---
         single:
@@ -43,6 +46,9 @@ class SourceHandler(BaseHandler):
                   schema: Error
         """
         if source_id is not None:
+            if self.is_current(versioning.source_version(source_id)):
+                Source.get_if_owned_by(source_id, self.current_user)
+                return self.not_modified()
             source = Source.get_if_owned_by(source_id, self.current_user,
                                             options=[joinedload(Source.comments)
                                                      .joinedload(Comment.user),
@@ -53,17 +59,13 @@ class SourceHandler(BaseHandler):
             return self.success(source)
         else:
             if isinstance(self.current_user, Token):
-                token = self.current_user
-                sources = reduce(set.union,
-                                 (set(group.sources) for group in token.groups))
+                group_ids = [group.id for group in self.current_user.groups]
+                sources = (DBSession().query(Source).join(GroupSource)
+                           .filter(GroupSource.group_id.in_(group_ids)))
             else:
-                sources = self.current_user.sources
-
-        if sources is not None:
-            return self.success(list(sources))
-        else:
-            return self.error(f"Could not load source {source_id}",
-                              {"source_id": source_id})
+                sources = (DBSession().query(Source)
+                           .with_parent(self.current_user, 'sources'))
+            return await self.success_stream(sources.distinct())
 
     @permissions(['Manage sources'])
     def post(self):
@@ -142,3 +144,192 @@ class SourceHandler(BaseHandler):
         DBSession().commit()
 
         return self.success(action='cesium/FETCH_SOURCES')
+
+
+class SourceBulkHandler(BaseHandler):
+    chunk_size = 1000
+
+    @staticmethod
+    def _validate(item, default_group_ids, allowed_group_ids):
+        """Return (row, group_ids) for a bulk upload item, or raise
+        ValueError describing what is wrong with it."""
+        if not isinstance(item, dict):
+            raise ValueError('Expected an object')
+        if not isinstance(item.get('id'), str) or item['id'] == '':
+            raise ValueError('Missing source ID')
+        row = {'id': item['id']}
+        for field in ('ra', 'dec', 'red_shift'):
+            value = item.get(field)
+            if value is not None:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f'Invalid value for {field}: {value}')
+            row[field] = value
+
+        group_ids = set(item.get('group_ids', default_group_ids))
+        if not group_ids.issubset(allowed_group_ids):
+            raise ValueError('Insufficient permissions for group(s) '
+                             f'{sorted(group_ids - allowed_group_ids)}')
+        return row, group_ids
+
+    @permissions(['Manage sources'])
+    def post(self):
+        """
+        ---
+        description: Create or update many sources at once
+        requestBody:
+          content:
+            application/json:
+              schema:
+                type: object
+                properties:
+                  sources:
+                    type: array
+                    items:
+                      type: object
+                      properties:
+                        id:
+                          type: string
+                        ra:
+                          type: number
+                        dec:
+                          type: number
+                        red_shift:
+                          type: number
+                        group_ids:
+                          type: array
+                          items:
+                            type: integer
+                          description: |
+                            Groups to add the source to; overrides the
+                            top-level `group_ids`.
+                  group_ids:
+                    type: array
+                    items:
+                      type: integer
+                    description: Groups to add every source to
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  allOf:
+                    - Success
+                    - type: object
+                      properties:
+                        results:
+                          type: array
+                          description: |
+                            Per-item status, in the order of the request:
+                            `created`, `updated` or `error` (with a
+                            `message`).
+        """
+        data = self.get_json()
+        items = data.get('sources', [])
+        default_group_ids = data.get('group_ids', [])
+        allowed_group_ids = {g.id for g in self.current_user.groups}
+
+        results = [None] * len(items)
+        rows, memberships, index = [], set(), {}
+        for i, item in enumerate(items):
+            try:
+                row, group_ids = self._validate(item, default_group_ids,
+                                                allowed_group_ids)
+            except ValueError as e:
+                results[i] = {'id': item.get('id') if isinstance(item, dict)
+                              else None, 'status': 'error', 'message': str(e)}
+                continue
+            if row['id'] in index:
+                # Last occurrence of a duplicate ID wins
+                rows[index[row['id']]] = row
+            else:
+                index[row['id']] = len(rows)
+                rows.append(row)
+            memberships |= {(group_id, row['id']) for group_id in group_ids}
+            results[i] = {'id': row['id']}
+
+        # Existing sources may only be updated by members of their groups
+        visible_sources = (sa.select([GroupSource.source_id])
+                           .where(GroupSource.group_id.in_(allowed_group_ids)))
+        hidden = set()
+        source_ids = list(index)
+        for start in range(0, len(source_ids), self.chunk_size):
+            chunk_ids = source_ids[start:start + self.chunk_size]
+            hidden |= {source_id for source_id, in
+                       DBSession().query(Source.id)
+                       .filter(Source.id.in_(chunk_ids))
+                       .filter(~Source.id.in_(visible_sources))}
+        if hidden:
+            rows = [row for row in rows if row['id'] not in hidden]
+            memberships = {(group_id, source_id) for group_id, source_id
+                           in memberships if source_id not in hidden}
+            for result in results:
+                if result.get('id') in hidden and 'status' not in result:
+                    result.update(status='error', message='Insufficient '
+                                  f'permissions for source {result["id"]}')
+
+        now = datetime.datetime.now()
+        status = {}
+        table = Source.__table__
+        try:
+            for start in range(0, len(rows), self.chunk_size):
+                chunk = [{**row, 'created_at': now, 'modified': now}
+                         for row in rows[start:start + self.chunk_size]]
+                stmt = psql.insert(table).values(chunk)
+                update = {c: sa.func.coalesce(stmt.excluded[c], table.c[c])
+                          for c in ('ra', 'dec', 'red_shift')}
+                update['modified'] = stmt.excluded.modified
+                update['version'] = table.c.version + 1
+                # onupdate defaults are not applied to ON CONFLICT updates
+                update['txid'] = sa.func.txid_current()
+                # Also guards against sources created by someone else since
+                # they were looked up, which are then not returned
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.c.id], set_=update,
+                    where=table.c.id.in_(visible_sources)
+                ).returning(table.c.id,
+                            sa.literal_column('xmax = 0').label('inserted'))
+                for source_id, inserted in DBSession().execute(stmt):
+                    status[source_id] = 'created' if inserted else 'updated'
+
+            memberships = {(group_id, source_id) for group_id, source_id
+                           in memberships if source_id in status}
+            source_ids = list(status)
+            for start in range(0, len(source_ids), self.chunk_size):
+                chunk_ids = source_ids[start:start + self.chunk_size]
+                memberships -= set(
+                    DBSession().query(GroupSource.group_id,
+                                      GroupSource.source_id)
+                    .filter(GroupSource.source_id.in_(chunk_ids))
+                )
+            if memberships:
+                DBSession().execute(
+                    psql.insert(GroupSource.__table__).on_conflict_do_nothing(),
+                    [{'group_id': group_id, 'source_id': source_id}
+                     for group_id, source_id in memberships]
+                )
+            DBSession().commit()
+            fanout.membership.invalidate(source_ids)
+        except sa.exc.SQLAlchemyError as e:
+            DBSession().rollback()
+            return self.error(f'Bulk upsert failed: {e}')
+
+        updated = [source_id for source_id, op in status.items()
+                   if op == 'updated']
+        for start in range(0, len(updated), self.chunk_size):
+            # Look up the users of the sources in bulk before pushing
+            fanout.membership.users(updated[start:start + self.chunk_size])
+        for source_id in updated:
+            self.push_source(source_id, 'skyportal/REFRESH_SOURCE',
+                             {'source_id': source_id})
+
+        for result in results:
+            if 'status' in result:
+                continue
+            if result['id'] in status:
+                result['status'] = status[result['id']]
+            else:
+                result.update(status='error', message='Insufficient '
+                              f'permissions for source {result["id"]}')
+        return self.success({'results': results})
@@ -1,26 +1,110 @@
 import tornado.web
 from sqlalchemy.orm import joinedload
 from baselayer.app.access import permissions, auth_or_token
-from baselayer.app.handlers.base import BaseHandler
+from .base import BaseHandler
 from ..models import DBSession, Spectrum, Comment
+from .. import deltas
+from .streaming import StreamingUploadHandler
 
 
 class SpectrumHandler(BaseHandler):
     @permissions(['Upload data'])
     def post(self):
-        data = self.get_json()
+        """
+        ---
+        description: Upload one or more spectra
+        requestBody:
+          content:
+            application/json:
+              schema:
+                oneOf:
+                  - Spectrum
+                  - type: array
+                    items: Spectrum
+            multipart/form-data:
+              schema:
+                type: object
+                properties:
+                  sourceID:
+                    type: string
+                  instrumentID:
+                    type: integer
+                  observed_at:
+                    type: string
+                  spectra:
+                    type: array
+                    items:
+                      type: string
+                      format: binary
+                    description: |
+                      ASCII/CSV (wavelength, flux[, error]) or FITS files;
+                      the format is detected from the file contents.
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  allOf:
+                    - Success
+                    - type: object
+                      properties:
+                        ids:
+                          type: array
+                          description: List of new spectrum IDs
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
+        content_type = self.request.headers.get('Content-Type', '')
+        try:
+            if content_type.startswith('multipart/form-data'):
+                # imported lazily: pandas is slow to load
+                from .. import spectrum_io
+                source_id = self.get_body_argument('sourceID')
+                instrument_id = int(self.get_body_argument('instrumentID'))
+                observed_at = self.get_body_argument('observed_at')
+                spectra = []
+                for upload in self.request.files.get('spectra', []):
+                    wavelengths, fluxes, errors = spectrum_io.parse_spectrum(
+                        upload['body'])
+                    spectra.append(Spectrum(source_id=source_id,
+                                            observed_at=observed_at,
+                                            instrument_id=instrument_id,
+                                            wavelengths=wavelengths,
+                                            fluxes=fluxes, errors=errors))
+            else:
+                data = self.get_json()
+                if not isinstance(data, list):
+                    data = [data]
+                # TODO where do we get the instrument info?
+                spectra = [Spectrum(source_id=d['sourceID'],
+                                    observed_at=d['observed_at'],
+                                    instrument_id=d['instrumentID'],
+                                    wavelengths=d['wavelengths'],
+                                    fluxes=d['fluxes'],
+                                    errors=d.get('errors'))
+                           for d in data]
+        except (KeyError, ValueError) as e:
+            return self.error(f'Invalid spectrum upload: {e}')
 
-        # TODO where do we get the instrument info?
-        p = Spectrum(source_id=data['sourceID'],
-                     observed_at=data['observed_at'],
-                     instrument_id=data['instrumentID'],
-                     wavelengths=data['wavlengths'],
-                     fluxes=data['fluxes'],
-                     errors=data.get('errors', []))
-        DBSession().add(p)
+        DBSession().add_all(spectra)
+        DBSession().flush()
+        by_source = {}
+        for spectrum in spectra:
+            by_source.setdefault(spectrum.source_id, []).append(
+                deltas.spectrum_data(spectrum))
+        versions = {source_id: deltas.bump_source_version(source_id)
+                    for source_id in by_source}
         DBSession().commit()
 
-        return self.success({"id": s.id}, 'cesium/FETCH_SOURCES')
+        for source_id, data in by_source.items():
+            self.push_source(source_id, deltas.SOURCE_DELTA,
+                             deltas.source_delta(
+                                 source_id, versions[source_id], 'spectrum',
+                                 'created', data))
+        return self.success({"ids": [s.id for s in spectra]},
+                            'cesium/FETCH_SOURCES')
 
     """TODO any need for get/put/delete?
     @auth_or_token
@@ -50,3 +134,112 @@ class SpectrumHandler(BaseHandler):
 
     return self.success(action='cesium/FETCH_SOURCES')
     """
+
+
+@tornado.web.stream_request_body
+class SpectrumStreamHandler(StreamingUploadHandler):
+    """Upload a large spectrum without buffering the request body.
+
+    Values are parsed as they arrive and accumulated directly in NumPy
+    arrays; at most `max_points` points are accepted per spectrum.  The
+    arrays are converted to lists when the spectrum is stored, which costs
+    about 100 bytes per point, so `max_points` is what bounds memory use.
+    """
+    required_acls = ['Upload data']
+    max_points = 1000 * 1000
+
+    def start_stream(self):
+        self.source_id = self.get_query_argument('sourceID')
+        self.instrument_id = int(self.get_query_argument('instrumentID'))
+        self.observed_at = self.get_query_argument('observed_at')
+        columns = self.get_query_argument('columns', None)
+        # imported lazily: pandas is slow to load
+        from ..stream_parsers import parser_for, ColumnBuffer
+        self.parser = parser_for(self.request.headers.get('Content-Type'),
+                                 columns.split(',') if columns else None)
+        self.buffer = ColumnBuffer(['wavelength', 'flux', 'error'],
+                                   max_rows=self.max_points)
+        self.has_errors = False
+
+    def receive(self, chunk):
+        df = self.parser.feed(chunk)
+        if df is not None:
+            self.has_errors |= 'error' in df
+            self.buffer.append(df)
+
+    def post(self):
+        """
+        ---
+        description: Stream a spectrum
+        parameters:
+          - in: query
+            name: sourceID
+            required: true
+            schema:
+              type: string
+          - in: query
+            name: instrumentID
+            required: true
+            schema:
+              type: integer
+          - in: query
+            name: observed_at
+            required: true
+            schema:
+              type: string
+          - in: query
+            name: columns
+            required: false
+            description: |
+              Comma-separated column names (wavelength, flux and optionally
+              error), required for binary uploads and for CSV without a
+              header line.
+            schema:
+              type: string
+        requestBody:
+          content:
+            text/csv: {}
+            application/x-npy: {}
+            application/octet-stream: {}
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  allOf:
+                    - Success
+                    - type: object
+                      properties:
+                        id:
+                          type: integer
+                          description: New spectrum ID
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
+        if self.stream_error is None:
+            try:
+                df = self.parser.close()
+                if df is not None:
+                    self.buffer.append(df)
+            except Exception as e:
+                self.stream_error = str(e)
+        if self.stream_error is not None:
+            return self.error(f'Could not store spectrum: {self.stream_error}')
+
+        s = Spectrum(source_id=self.source_id,
+                     observed_at=self.observed_at,
+                     instrument_id=self.instrument_id,
+                     wavelengths=self.buffer['wavelength'],
+                     fluxes=self.buffer['flux'],
+                     errors=self.buffer['error'] if self.has_errors else None)
+        DBSession().add(s)
+        DBSession().flush()
+        version = deltas.bump_source_version(self.source_id)
+        delta = deltas.source_delta(self.source_id, version, 'spectrum',
+                                    'created', [deltas.spectrum_data(s)])
+        DBSession().commit()
+
+        self.push_source(self.source_id, deltas.SOURCE_DELTA, delta)
+        return self.success({"id": s.id}, 'cesium/FETCH_SOURCES')
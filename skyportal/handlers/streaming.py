@@ -0,0 +1,69 @@
+from sqlalchemy.orm import Session
+from tornado.web import MissingArgumentError
+from baselayer.app.access import permissions
+from .base import BaseHandler
+
+from ..models import DBSession
+
+
+class StreamingUploadHandler(BaseHandler):
+    """Base class for handlers that consume their request body incrementally.
+
+    Subclasses must be decorated with `tornado.web.stream_request_body`, and
+    implement `start_stream` (called once the request has been
+    authenticated, before any data arrives) and `receive` (called with each
+    chunk of the body).  The usual HTTP method (`post`, `put`) is called after
+    the whole body has been received.
+
+    Authentication and permission checks happen in `prepare`, before the body
+    is read, so that unauthorized uploads are rejected without being
+    buffered.  If `start_stream` raises a `ValueError` (e.g. an invalid query
+    argument) or a query argument is missing, the upload is rejected with a
+    400 error before the body is read.
+
+    Data written while the body is received must go through `session`, a
+    session of this upload only: the scoped `DBSession` is shared by all
+    requests handled by the thread in between.  Any error raised while
+    receiving data is stored in `stream_error`, `session` is rolled back and
+    the remainder of the body is discarded; the HTTP method handler should
+    report it, or else commit `session`.
+    """
+    required_acls = []
+    max_body_size = 10 * 1024 ** 3
+    session = None
+
+    def prepare(self):
+        super().prepare()
+        self.session = Session(bind=DBSession().get_bind())
+        permissions(self.required_acls)(lambda self: None)(self)
+        self.request.connection.set_max_body_size(self.max_body_size)
+        self.stream_error = None
+        try:
+            self.start_stream()
+        except (MissingArgumentError, ValueError) as e:
+            # The rest of the body is discarded by `data_received`
+            self.stream_error = str(e)
+            self.error(f'Invalid upload: {e}')
+            if not self._finished:
+                self.finish()
+
+    def start_stream(self):
+        pass
+
+    def receive(self, chunk):
+        raise NotImplementedError
+
+    def data_received(self, chunk):
+        if self.stream_error is not None:
+            return
+        try:
+            self.receive(chunk)
+        except Exception as e:
+            self.session.rollback()
+            self.stream_error = str(e)
+
+    def on_finish(self):
+        if self.session is not None:
+            # Rolls back anything not committed, e.g. if the client went away
+            self.session.close()
+        super().on_finish()
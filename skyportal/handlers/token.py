@@ -1,4 +1,4 @@
-from baselayer.app.handlers.base import BaseHandler
+from .base import BaseHandler
 from baselayer.app.access import permissions, auth_or_token
 from ..models import User, Token, DBSession
 from ..model_util import create_token
@@ -0,0 +1,249 @@
+"""In-process metrics, exposed in the Prometheus text format.
+
+Counters and histograms are plain dictionaries keyed by label values, so
+recording a sample costs a dictionary lookup and an addition.  Handlers are
+instrumented by `skyportal.handlers.base.BaseHandler`; SQL statements and
+database connection pool checkouts by `instrument_engine`.  Statements
+executed while a request is being handled are attributed to it through a
+context variable, so that each request also records how many queries it
+made and how many rows they returned.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+
+import sqlalchemy as sa
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    @staticmethod
+    def _format_labels(names, values, extra=''):
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def expose(self):
+        documentation = (self.documentation.replace('\\', '\\\\')
+                         .replace('\n', '\\n'))
+        lines = [f'# HELP {self.name} {documentation}',
+                 f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    """Escape a label value for the exposition format."""
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f'{self.name}{self._format_labels(self.labels, key)} {value}'
+                for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """Gauge whose value is computed by `function` at collection time."""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, function, labels=()):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def _samples(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f'{self.name}{self._format_labels(self.labels, key)} {value}'
+                for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = sorted(buckets)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Per-bucket counts (not cumulative), the +Inf bucket, sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def _samples(self):
+        samples = []
+        for key, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], counts[:-1]):
+                cumulative += count
+                labels = self._format_labels(self.labels, key,
+                                             f'le="{bound}"')
+                samples.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = self._format_labels(self.labels, key)
+            samples.append(f'{self.name}_sum{labels} {counts[-1]}')
+            samples.append(f'{self.name}_count{labels} {cumulative}')
+        return samples
+
+
+REGISTRY = []
+
+
+def register(metric):
+    """Add `metric` to `REGISTRY`, replacing any metric of the same name, so
+    that instrumenting an engine or outbox again (e.g. by another call to
+    `make_app`) does not expose it twice."""
+    REGISTRY[:] = [m for m in REGISTRY if m.name != metric.name]
+    REGISTRY.append(metric)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+REQUEST_DURATION = Histogram(
+    'skyportal_http_request_duration_seconds',
+    'Time spent handling HTTP requests', ('handler', 'method'),
+    LATENCY_BUCKETS)
+REQUESTS = Counter(
+    'skyportal_http_requests_total', 'HTTP requests by response status',
+    ('handler', 'method', 'status'))
+REQUEST_QUERIES = Histogram(
+    'skyportal_http_request_queries', 'SQL statements executed per request',
+    ('handler', 'method'), QUERY_BUCKETS)
+ROWS_RETURNED = Counter(
+    'skyportal_db_rows_returned_total',
+    'Rows returned by SQL statements, by handler', ('handler',))
+QUERIES = Counter('skyportal_db_queries_total', 'SQL statements executed')
+POOL_CHECKOUT_WAIT = Histogram(
+    'skyportal_db_pool_checkout_wait_seconds',
+    'Time spent waiting for a database connection from the pool',
+    buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+WEBSOCKET_MESSAGES = Counter(
+    'skyportal_websocket_messages_total',
+    'Messages pushed to websocket clients', ('action', 'target'))
+WEBSOCKET_COALESCED = Counter(
+    'skyportal_websocket_messages_coalesced_total',
+    'Websocket messages merged into a queued message', ('action',))
+WEBSOCKET_EVICTED = Counter(
+    'skyportal_websocket_messages_evicted_total',
+    'Websocket messages evicted from full coalescing queues within a window',
+    ('action',))
+
+
+class RequestMetrics:
+    __slots__ = ('start', 'queries', 'rows')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.rows = 0
+
+
+_current_request = contextvars.ContextVar('skyportal_request_metrics',
+                                          default=None)
+
+
+def start_request():
+    """Start recording metrics for the request handled in this context."""
+    request = RequestMetrics()
+    _current_request.set(request)
+    return request
+
+
+def finish_request(request, handler, method, status):
+    _current_request.set(None)
+    REQUEST_DURATION.observe(time.perf_counter() - request.start,
+                             handler=handler, method=method)
+    REQUESTS.inc(handler=handler, method=method, status=status)
+    REQUEST_QUERIES.observe(request.queries, handler=handler, method=method)
+    if request.rows:
+        ROWS_RETURNED.inc(request.rows, handler=handler)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    QUERIES.inc()
+    request = _current_request.get()
+    if request is not None:
+        request.queries += 1
+        if cursor.description is not None and cursor.rowcount > 0:
+            request.rows += cursor.rowcount
+
+
+def instrument_engine(engine):
+    """Record SQL statements executed with `engine`, the time spent waiting
+    for pooled connections and the state of the pool."""
+    if getattr(engine, '_skyportal_metrics', False):
+        return
+    engine._skyportal_metrics = True
+    sa.event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    pool = engine.pool
+    do_get = pool._do_get
+
+    def timed_do_get():
+        tic = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - tic)
+    pool._do_get = timed_do_get
+
+    def pool_state():
+        if not hasattr(pool, 'checkedout'):
+            return {}
+        return {('checked_out',): pool.checkedout(),
+                ('idle',): pool.checkedin(),
+                ('overflow',): max(pool.overflow(), 0)}
+    Gauge('skyportal_db_pool_connections', 'Database connections in the pool',
+          pool_state, ('state',))
+
+
+def instrument_outbox(outbox):
+    """Expose the depth of the websocket message queues of `outbox` (see
+    `skyportal.outbox`)."""
+    def depth():
+        total, longest = outbox.depth()
+        return {('total',): total, ('longest',): longest}
+    Gauge('skyportal_websocket_queued_messages',
+          'Websocket messages queued, in total and for the longest queue',
+          depth, ('queue',))
+
+
+def expose():
+    """All metrics, in the Prometheus text exposition format."""
+    return '\n'.join(metric.expose() for metric in REGISTRY) + '\n'
@@ -1,17 +1,40 @@
+from contextlib import contextmanager
 import datetime
+import hashlib
+import io
+import json
+import logging
 import os
 from pathlib import Path
 import shutil
 import numpy as np
-import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
 
 from baselayer.app.env import load_env
 from baselayer.app.model_util import status, create_tables, drop_tables
 from social_tornado.models import TornadoStorage
-from skyportal.models import (init_db, Base, DBSession, ACL, Comment,
-                              Instrument, Group, GroupUser, Photometry, Role,
-                              Source, Spectrum, Telescope, Thumbnail, User,
-                              Token)
+from skyportal.attachments import store_base64_attachment
+from skyportal.models import (init_db, Base, DBSession, ACL,
+                              BootstrapVersion, Comment, Instrument, Group,
+                              GroupUser, Photometry, Role, Source, Spectrum,
+                              Telescope, Thumbnail, User, Token)
+
+
+ACL_IDS = ['Become user', 'Comment', 'Manage users', 'Manage sources',
+           'Manage groups', 'Upload data', 'System admin']
+
+ROLE_ACLS = {
+    'Super admin': ACL_IDS,
+    'Group admin': ['Comment', 'Manage sources', 'Upload data'],
+    'Full user': ['Comment', 'Upload data']
+}
+
+log = logging.getLogger('skyportal.model_util')
+
+# Key of the PostgreSQL advisory lock held while bootstrapping
+BOOTSTRAP_LOCK_KEY = 0x736b79706f7274
 
 
 def add_super_user(username):
@@ -34,25 +57,149 @@ def setup_permissions():
     """Create default ACLs/Roles needed by application.
 
     If a given ACL or Role already exists, it will be skipped."""
-    all_acl_ids = ['Become user', 'Comment', 'Manage users', 'Manage sources',
-                   'Manage groups', 'Upload data', 'System admin']
-    all_acls = [ACL.create_or_get(a) for a in all_acl_ids]
+    all_acls = [ACL.create_or_get(a) for a in ACL_IDS]
     DBSession().add_all(all_acls)
     DBSession().commit()
 
-    role_acls = {
-        'Super admin': all_acl_ids,
-        'Group admin': ['Comment', 'Manage sources', 'Upload data'],
-        'Full user': ['Comment', 'Upload data']
-    }
-
-    for r, acl_ids in role_acls.items():
+    for r, acl_ids in ROLE_ACLS.items():
         role = Role.create_or_get(r)
         role.acls = [ACL.query.get(a) for a in acl_ids]
         DBSession().add(role)
     DBSession().commit()
 
 
+def bootstrap_version():
+    """Hash of the DDL of all tables and indexes, and of the default
+    permissions: changes whenever `bootstrap` has something new to do."""
+    dialect = psql.dialect()
+    ddl = [str(CreateTable(table).compile(dialect=dialect))
+           for table in Base.metadata.sorted_tables]
+    ddl += sorted(str(CreateIndex(index).compile(dialect=dialect))
+                  for table in Base.metadata.sorted_tables
+                  for index in table.indexes)
+    h = hashlib.sha256('\n'.join(ddl).encode())
+    h.update(json.dumps([ACL_IDS, ROLE_ACLS], sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def _bootstrap_stamp():
+    """The version stamp of the database, or None."""
+    try:
+        version = (DBSession().query(BootstrapVersion.version)
+                   .filter(BootstrapVersion.name == 'skyportal').scalar())
+    except sa.exc.ProgrammingError:  # not bootstrapped yet: no table
+        version = None
+    DBSession().rollback()
+    return version
+
+
+def create_missing_columns():
+    """Add columns added to existing tables, which `create_tables` only
+    creates along with new tables.  New columns must be nullable or have a
+    server default."""
+    engine = DBSession().get_bind()
+    inspector = sa.inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                engine.execute(f'ALTER TABLE {table.name} ADD COLUMN {ddl}')
+
+
+def create_missing_indexes():
+    """Create indexes added to existing tables, which `create_tables`
+    only creates along with new tables."""
+    engine = DBSession().get_bind()
+    inspector = sa.inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+
+
+def migrate_comment_attachments():
+    """Move attachments stored base64-encoded in `comments.attachment_bytes`
+    by earlier versions to chunked storage, then drop that column."""
+    engine = DBSession().get_bind()
+    columns = {column['name'] for column in
+               sa.inspect(engine).get_columns('comments')}
+    if 'attachment_bytes' not in columns:
+        return
+    comment_ids = [comment_id for comment_id, in DBSession().execute(
+        'SELECT id FROM comments WHERE attachment_bytes IS NOT NULL '
+        'AND attachment_id IS NULL')]
+    # One attachment at a time, so that only one is held in memory
+    for comment_id in comment_ids:
+        data = DBSession().execute(
+            sa.text('SELECT attachment_bytes FROM comments WHERE id = :id'),
+            {'id': comment_id}).scalar()
+        attachment = store_base64_attachment(bytes(data).decode())
+        DBSession().execute(Comment.__table__.update()
+                            .where(Comment.id == comment_id)
+                            .values(attachment_id=attachment.id))
+        DBSession().commit()
+    DBSession().execute('ALTER TABLE comments DROP COLUMN attachment_bytes')
+    DBSession().commit()
+
+
+@contextmanager
+def _bootstrap_lock():
+    """Hold the advisory lock serializing processes that bootstrap."""
+    with DBSession().get_bind().connect() as lock_connection:
+        lock_connection.execute(sa.text('SELECT pg_advisory_lock(:key)'),
+                                key=BOOTSTRAP_LOCK_KEY)
+        try:
+            yield
+        finally:
+            lock_connection.execute(sa.text('SELECT pg_advisory_unlock(:key)'),
+                                    key=BOOTSTRAP_LOCK_KEY)
+
+
+def bootstrap(force=False):
+    """Create missing tables, columns and indexes, migrate old data and
+    create default permissions, then stamp the database with
+    `bootstrap_version`.  Run by `tools/bootstrap.py` when deploying.
+
+    Processes bootstrapping concurrently are serialized by an advisory lock;
+    the first one does the work and the others find the stamp up to date,
+    unless `force` is set.  Returns whether the database was bootstrapped.
+    """
+    version = bootstrap_version()
+    with _bootstrap_lock():
+        if not force and _bootstrap_stamp() == version:
+            return False
+        create_tables()
+        create_missing_columns()
+        create_missing_indexes()
+        migrate_comment_attachments()
+        setup_permissions()
+        stamp = (BootstrapVersion.query
+                 .filter(BootstrapVersion.name == 'skyportal').first()
+                 or BootstrapVersion(name='skyportal'))
+        stamp.version = version
+        DBSession().add(stamp)
+        DBSession().commit()
+        return True
+
+
+def ensure_bootstrapped():
+    """Check the database stamp at boot, which costs a single query.
+
+    When it is out of date, only missing tables and default permissions are
+    created; adding columns and indexes to existing tables and migrating
+    data are left to `tools/bootstrap.py`, and the stamp is not updated.
+    """
+    if _bootstrap_stamp() == bootstrap_version():
+        return
+    log.warning('Database is not bootstrapped for this version; run '
+                '`make db_bootstrap` (tools/bootstrap.py)')
+    with _bootstrap_lock():
+        create_tables()
+        setup_permissions()
+
+
 def create_token(group_id, permissions=[], created_by_id=None, description=None):
     group = Group.query.get(group_id)
     t = Token(acl_ids=permissions, created_by_id=created_by_id,
@@ -65,3 +212,59 @@ def create_token(group_id, permissions=[], created_by_id=None, description=None)
     DBSession().add(t)
     DBSession().commit()
     return t.id
+
+
+# Written for missing values by `copy_dataframe`, so that empty strings are
+# kept as such instead of being read as NULL
+COPY_NULL = r'\N'
+
+
+def _pg_array(values):
+    return '{' + ','.join(map(repr, np.asarray(values, dtype=float).tolist())) + '}'
+
+
+def copy_dataframe(df, table_name, session=None, skip_existing=False):
+    """Bulk load a `pandas.DataFrame` into a table using PostgreSQL's `COPY`.
+
+    Columns of `df` must match column names of the table; missing values are
+    stored as NULL.  Columns containing sequences (e.g. spectrum
+    wavelengths) are converted to PostgreSQL array literals.  The data is
+    written as part of the session's current transaction, so the caller
+    must commit.
+
+    If `skip_existing` is True, the rows are copied to a temporary table
+    first and then inserted with ``ON CONFLICT DO NOTHING``, so that rows
+    violating a unique constraint (e.g. loaded by an earlier, interrupted
+    run) are skipped instead of failing the whole load.
+
+    This is typically an order of magnitude faster than inserting the same
+    rows through the ORM.  Returns the number of rows inserted.
+    """
+    session = session or DBSession()
+    df = df.copy()
+    for col in df.columns:
+        values = df[col].dropna()
+        if (df[col].dtype == object and len(values) > 0 and
+                isinstance(values.iloc[0], (list, tuple, np.ndarray))):
+            df[col] = df[col].map(lambda v: None if v is None
+                                  else _pg_array(v))
+
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False, na_rep=COPY_NULL)
+    buf.seek(0)
+
+    columns = ', '.join(f'"{c}"' for c in df.columns)
+    cursor = session.connection().connection.cursor()
+    target = f'_copy_{table_name}' if skip_existing else table_name
+    if skip_existing:
+        cursor.execute(f'CREATE TEMPORARY TABLE {target} AS '
+                       f'SELECT {columns} FROM {table_name} WITH NO DATA')
+    cursor.copy_expert(f'COPY {target} ({columns}) FROM STDIN '
+                       f"WITH (FORMAT csv, NULL '{COPY_NULL}')", buf)
+    if not skip_existing:
+        return len(df)
+    cursor.execute(f'INSERT INTO {table_name} ({columns}) '
+                   f'SELECT {columns} FROM {target} ON CONFLICT DO NOTHING')
+    n_rows = cursor.rowcount
+    cursor.execute(f'DROP TABLE {target}')
+    return n_rows
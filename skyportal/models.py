@@ -1,6 +1,4 @@
 import os.path
-import re
-import requests
 import numpy as np
 
 import sqlalchemy as sa
@@ -10,8 +8,6 @@ from sqlalchemy.orm import backref, relationship, mapper
 from baselayer.app.models import (init_db, join_model, Base, DBSession, ACL,
                                   Role, User, Token)
 
-from . import schema
-
 
 def is_owned_by(self, user_or_token):
     """Generic ownership logic for any `skyportal` ORM model.
@@ -33,6 +29,11 @@ Base.is_owned_by = is_owned_by
 class NumpyArray(sa.types.TypeDecorator):
     impl = psql.ARRAY(sa.Float)
 
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        return value
+
     def process_result_value(self, value, dialect):
         return np.array(value)
 
@@ -86,6 +87,9 @@ class Source(Base):
     ra = sa.Column(sa.Float)
     dec = sa.Column(sa.Float)
     red_shift = sa.Column(sa.Float, nullable=True)
+    # Incremented with each change pushed to clients (see `skyportal.deltas`)
+    version = sa.Column(sa.Integer, nullable=False, default=0,
+                        server_default='0')
 
     groups = relationship('Group', secondary='group_sources', cascade='all')
     comments = relationship('Comment', back_populates='source', cascade='all',
@@ -98,16 +102,33 @@ class Source(Base):
     thumbnails = relationship('Thumbnail', back_populates='source',
                               secondary='photometry', cascade='all')
 
-    def add_linked_thumbnails(self):
-        sdss_thumb = Thumbnail(photometry=self.photometry[0],
+    def add_linked_thumbnails(self, resolver=None):
+        """Add SDSS and PS1 thumbnails, attached to the earliest photometry.
+
+        The PS1 image location has to be looked up on an external service, so
+        its URL is filled in later by a background `CutoutResolver`; this
+        method never waits on the network.
+        """
+        phot_id = (DBSession().query(Photometry.id)
+                   .filter(Photometry.source_id == self.id)
+                   .order_by(Photometry.observed_at)
+                   .limit(1).scalar())
+        if phot_id is None:
+            return
+
+        sdss_thumb = Thumbnail(photometry_id=phot_id,
                                public_url=self.get_sdss_url(),
                                type='sdss')
-        ps1_thumb = Thumbnail(photometry=self.photometry[0],
-                              public_url=self.get_panstarrs_url(),
+        ps1_thumb = Thumbnail(photometry_id=phot_id, public_url=None,
                               type='ps1')
         DBSession().add_all([sdss_thumb, ps1_thumb])
         DBSession().commit()
 
+        if resolver is None:
+            from .cutouts import get_resolver
+            resolver = get_resolver()
+        return resolver.submit(ps1_thumb.id, self.ra, self.dec)
+
     def get_sdss_url(self):
         """Construct URL for public Sloan Digital Sky Survey (SDSS) cutout."""
         return (f"http://skyservice.pha.jhu.edu/DR9/ImgCutout/getjpeg.aspx"
@@ -120,16 +141,17 @@ class Source(Base):
         The cutout service doesn't allow directly querying for an image; the
         best we can do is request a page that contains a link to the image we
         want (in this case a combination of the green/blue/red filters).
+
+        This never waits on the external service: if the position has not
+        been resolved before, it is looked up in the background (see
+        `skyportal.cutouts`) and None is returned until then.
         """
-        try:
-            ps_query_url = (f"http://ps1images.stsci.edu/cgi-bin/ps1cutouts"
-                            f"?pos={self.ra}+{self.dec}&filter=color&filter=g"
-                            f"&filter=r&filter=i&filetypes=stack&size=400")
-            response = requests.get(ps_query_url)
-            match = re.search('src="//ps1images.stsci.edu.*?"', response.content.decode())
-            return match.group().replace('src="', 'http:').replace('"', '')
-        except (ValueError, ConnectionError) as e:
-            return None
+        from .cutouts import get_resolver
+        resolver = get_resolver()
+        url = resolver.cached_panstarrs_url(self.ra, self.dec)
+        if url is None:
+            resolver.lookup(self.ra, self.dec)
+        return url
 
 
 GroupSource = join_model('group_sources', Group, Source)
@@ -170,11 +192,34 @@ class Instrument(Base):
                            cascade='all')
 
 
+class Attachment(Base):
+    """A binary file, stored in chunks in `attachment_chunks`.
+
+    See `skyportal.attachments` for reading and writing attachment data.
+    """
+    sha256 = sa.Column(sa.String(64), nullable=True, unique=True)
+    size = sa.Column(sa.BigInteger, nullable=False)
+    chunk_size = sa.Column(sa.Integer, nullable=False)
+
+
+class AttachmentChunk(Base):
+    __tablename__ = 'attachment_chunks'
+    __table_args__ = (sa.UniqueConstraint('attachment_id', 'seq'),)
+    attachment_id = sa.Column(sa.ForeignKey('attachments.id',
+                                            ondelete='CASCADE'),
+                              nullable=False)
+    seq = sa.Column(sa.Integer, nullable=False)
+    data = sa.Column(sa.LargeBinary, nullable=False)
+
+
 class Comment(Base):
     text = sa.Column(sa.String, nullable=False)
     attachment_name = sa.Column(sa.String, nullable=True)
     attachment_type = sa.Column(sa.String, nullable=True)
-    attachment_bytes = sa.Column(sa.types.LargeBinary, nullable=True)
+    attachment_id = sa.Column(sa.ForeignKey('attachments.id',
+                                            ondelete='SET NULL'),
+                              nullable=True, index=True)
+    attachment = relationship('Attachment')
 
     user_id = sa.Column(sa.ForeignKey('users.id', ondelete='CASCADE'),
                         nullable=False, index=True)
@@ -229,11 +274,26 @@ class Spectrum(Base):
 
     @classmethod
     def from_ascii(cls, filename, source_id, instrument_id, observed_at):
-        data = np.loadtxt(filename)
-        if data.shape[1] != 2:  # TODO support other formats
-            raise ValueError(f"Expected 2 columns, got {data.shape[1]}")
+        """Create a spectrum from a two- or three-column (wavelength, flux,
+        error) ASCII/CSV file."""
+        from . import spectrum_io  # imported lazily: pandas is slow to load
+        wavelengths, fluxes, errors = spectrum_io.read_ascii(filename)
+        return cls(wavelengths=wavelengths, fluxes=fluxes, errors=errors,
+                   source_id=source_id, instrument_id=instrument_id,
+                   observed_at=observed_at)
 
-        return cls(wavelengths=data[:, 0], fluxes=data[:, 1],
+    @classmethod
+    def from_file(cls, filename, source_id, instrument_id, observed_at,
+                  format=None):
+        """Create a spectrum from an ASCII/CSV or FITS file.
+
+        The format is detected from the file contents unless specified; see
+        `skyportal.spectrum_io.read_spectrum`.
+        """
+        from . import spectrum_io  # imported lazily: pandas is slow to load
+        wavelengths, fluxes, errors = spectrum_io.read_spectrum(filename,
+                                                                format)
+        return cls(wavelengths=wavelengths, fluxes=fluxes, errors=errors,
                    source_id=source_id, instrument_id=instrument_id,
                    observed_at=observed_at)
 
@@ -251,6 +311,16 @@ class Spectrum(Base):
 #        return '/' + file_uri.lstrip('./')
 
 
+class SurveyCutout(Base):
+    """Cache of external survey cutout URLs, keyed by position."""
+    __tablename__ = 'survey_cutouts'
+    __table_args__ = (sa.UniqueConstraint('survey', 'ra', 'dec'),)
+    survey = sa.Column(sa.String, nullable=False)
+    ra = sa.Column(sa.Float, nullable=False)
+    dec = sa.Column(sa.Float, nullable=False)
+    url = sa.Column(sa.String, nullable=False)
+
+
 class Thumbnail(Base):
     # TODO delete file after deleting row
     type = sa.Column(sa.Enum('new', 'ref', 'sub', 'sdss', 'ps1',
@@ -265,4 +335,21 @@ class Thumbnail(Base):
                           secondary='photometry', cascade='all')
 
 
-schema.setup_schema()
+# Change feed (see `skyportal.changes`): the id of the transaction that last
+# wrote each row, and an index for keyset pagination
+for _model in (Source, Photometry, Spectrum, Comment):
+    _model.txid = sa.Column(sa.BigInteger, nullable=False,
+                            server_default=sa.text('txid_current()'),
+                            onupdate=sa.func.txid_current())
+    sa.Index(f'ix_{_model.__tablename__}_txid_id',
+             _model.__table__.c.txid, _model.__table__.c.id)
+del _model
+
+
+class BootstrapVersion(Base):
+    """Version stamp of the tables and permissions created by
+    `model_util.bootstrap`, checked at boot to skip bootstrapping."""
+    __tablename__ = 'bootstrap_versions'
+    name = sa.Column(sa.String, nullable=False, unique=True)
+    version = sa.Column(sa.String, nullable=False)
+
@@ -1,10 +1,25 @@
+import hashlib
+import inspect
+import json
+import os
+import sys
+
 from . import __version__
 
 from tornado.routing import URLSpec
-from apispec import APISpec
+import apispec
+from apispec import APISpec, yaml_utils
 from apispec.ext.marshmallow import MarshmallowPlugin
+from marshmallow import Schema
 from . import schema
 
+HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch")
+
+
+def _api_handlers(handlers):
+    return [handler for handler in handlers if not
+            isinstance(handler, URLSpec) and len(handler) == 2]
+
 
 def spec_from_handlers(handlers):
     """Generate an OpenAPI spec from Tornado handlers.
@@ -65,14 +80,9 @@ def spec_from_handlers(handlers):
     openapi_spec.components.security_scheme("token", token_scheme)
 
     schema.register_components(openapi_spec)
-    from apispec import yaml_utils
-    import inspect
     import re
 
-    HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch")
-    handlers = [handler for handler in handlers if not
-                isinstance(handler, URLSpec) and len(handler) == 2]
-    for (endpoint, handler) in handlers:
+    for (endpoint, handler) in _api_handlers(handlers):
         for http_method in HTTP_METHODS:
             method = getattr(handler, http_method)
             if method.__doc__ is None:
@@ -114,3 +124,85 @@ def spec_from_handlers(handlers):
                 )
 
     return openapi_spec
+
+
+def spec_fingerprint(handlers):
+    """Hash of everything the spec is generated from: the routes, the
+    docstrings and signatures of the handler methods, and the fields of the
+    schemas in `schema`."""
+    h = hashlib.sha256(f'{__version__} {apispec.__version__}'.encode())
+    for (endpoint, handler) in _api_handlers(handlers):
+        h.update(f'{endpoint} {handler.__qualname__}'.encode())
+        for http_method in HTTP_METHODS:
+            method = getattr(handler, http_method)
+            if method.__doc__ is not None:
+                h.update(f'{http_method} {inspect.signature(method)}'.encode())
+                h.update(method.__doc__.encode())
+    schema.setup_schema()
+    schemas = inspect.getmembers(sys.modules[schema.__name__],
+                                 lambda m: isinstance(m, Schema))
+    for (name, schema_instance) in schemas:
+        h.update(name.encode())
+        for field_name, field in sorted(schema_instance.fields.items()):
+            h.update(f'{field_name} {type(field).__name__} {field.required} '
+                     f'{field.allow_none} '
+                     f'{sorted(field.metadata.items(), key=str)}'.encode())
+    return h.hexdigest()
+
+
+class CachedSpec:
+    """OpenAPI spec generated on first use, and cached on disk.
+
+    Parsing the docstrings of all handlers takes a noticeable part of the
+    startup time of each server process, so the generated spec is saved in
+    `cache_dir` under its `spec_fingerprint` and reused by later processes
+    (and deploys) until a docstring, route or schema changes.
+
+    Parameters
+    ----------
+    handlers : list
+        Tornado handlers, as passed to `spec_from_handlers`.
+    cache_dir : str, optional
+        Where to cache generated specs; if None, specs are not cached.
+    """
+    def __init__(self, handlers, cache_dir=None):
+        self.handlers = handlers
+        self.cache_dir = cache_dir
+        self._fingerprint = None
+        self._json = None
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = spec_fingerprint(self.handlers)
+        return self._fingerprint
+
+    def to_json(self):
+        """The spec, as JSON bytes."""
+        if self._json is not None:
+            return self._json
+
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir,
+                                f'openapi-{self.fingerprint}.json')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    self._json = f.read()
+                return self._json
+
+        spec = spec_from_handlers(self.handlers).to_dict()
+        self._json = json.dumps(spec).encode()
+        if path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(self._json)
+            os.replace(tmp_path, path)  # atomic, for concurrent workers
+        return self._json
+
+    def to_dict(self):
+        return json.loads(self.to_json())
+
+    def to_yaml(self):
+        return yaml_utils.dict_to_yaml(self.to_dict())
@@ -0,0 +1,113 @@
+"""Coalescing queues of websocket messages.
+
+Messages pushed to all users (`BaseHandler.push_all`) or to the users who
+can see a source (`BaseHandler.push_source`) are queued per recipient and
+sent `window` seconds after the first of them, rather than immediately.
+While queued, messages with the same action about the same source (or, for
+messages not about a source, identical messages) are coalesced: refresh
+messages are sent once, and source deltas are merged (see
+`skyportal.deltas.merge`), so that a burst of changes to a popular source
+costs each client a single message.
+
+This is bounded coalescing, not backpressure: queues are flushed to the
+websocket server (through `Flow`) every `window` seconds whatever the pace
+of the clients, since the server does not report how far behind a client
+is.  `max_size` only bounds the distinct messages a recipient can
+accumulate within one window; when a queue is full, its oldest message is
+evicted.  A client missing a source delta refetches the source when it
+receives the next one.
+"""
+
+import collections
+import json
+import logging
+
+from tornado.ioloop import IOLoop
+
+from baselayer.app.flow import Flow
+from . import deltas, metrics
+
+
+log = logging.getLogger(__name__)
+
+
+def coalescing_key(action, payload):
+    if 'source_id' in payload:
+        return action, payload['source_id']
+    return action, json.dumps(payload, sort_keys=True, default=str)
+
+
+class CoalescingOutbox:
+    """Bounded per-recipient queues of coalesced messages, flushed every
+    `window` seconds.
+
+    Parameters
+    ----------
+    send : callable
+        `send(recipient, action, payload)` delivers a message.
+    window : float
+        Seconds during which messages are held and coalesced; if 0, messages
+        are sent immediately.
+    max_size : int
+        Maximum number of (coalesced) messages queued per recipient within
+        a window; beyond it, the oldest are evicted.
+    merge : dict
+        Functions combining the payloads of two messages, by action;
+        messages of other actions are replaced by the later one.
+    """
+    def __init__(self, send=None, window=0.1, max_size=1000, merge={}):
+        self.send = send
+        self.window = window
+        self.max_size = max_size
+        self.merge = merge
+        self.queues = {}
+        self.scheduled = False
+
+    def push(self, recipient, action, payload={}):
+        if not self.window:
+            return self.send(recipient, action, payload)
+        queue = self.queues.setdefault(recipient, collections.OrderedDict())
+        key = coalescing_key(action, payload)
+        queued = queue.get(key)
+        if queued is not None:
+            merge = self.merge.get(action)
+            queue[key] = (action, merge(queued[1], payload) if merge
+                          else payload)
+            metrics.WEBSOCKET_COALESCED.inc(action=action)
+        else:
+            if len(queue) >= self.max_size:
+                _, (evicted, _) = queue.popitem(last=False)
+                metrics.WEBSOCKET_EVICTED.inc(action=evicted)
+            queue[key] = (action, payload)
+        if not self.scheduled:
+            self.scheduled = True
+            IOLoop.current().call_later(self.window, self.flush)
+
+    def flush(self):
+        """Send all queued messages."""
+        queues, self.queues = self.queues, {}
+        self.scheduled = False
+        for recipient, queue in queues.items():
+            for action, payload in queue.values():
+                try:
+                    self.send(recipient, action, payload)
+                except Exception:
+                    log.exception(f'Could not push {action} to {recipient}')
+
+    def depth(self):
+        """Number of messages queued, in total and for the longest queue."""
+        sizes = [len(queue) for queue in self.queues.values()]
+        return sum(sizes), max(sizes, default=0)
+
+
+_flow = None
+
+
+def _send(recipient, action, payload):
+    global _flow
+    if _flow is None:
+        _flow = Flow()
+    _flow.push(recipient, action, payload)
+
+
+outbox = CoalescingOutbox(_send, merge={deltas.SOURCE_DELTA: deltas.merge})
@@ -0,0 +1,148 @@
+"""Diagnose running processes: sampling CPU profiler and memory snapshots.
+
+`SamplingProfiler` samples the stacks of all threads from a background
+thread at a fixed interval, and reports them in the "collapsed stack"
+format understood by flamegraph.pl, speedscope and similar tools:
+
+    MainThread;start (tornado/ioloop.py);get (handlers/source.py) 42
+
+Sampling has a small, constant overhead and does not require the process to
+be started under a profiler.  `MemorySnapshots` captures `tracemalloc`
+snapshots and compares them, to find where memory grows over time.
+"""
+
+from collections import Counter
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    parts = filename.split(os.sep)
+    # Keep only the last two path components, e.g. handlers/source.py
+    return f'{code.co_name} ({"/".join(parts[-2:])}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling the stacks of all threads.
+
+    Parameters
+    ----------
+    interval : float
+        Seconds between samples.
+    max_depth : int
+        Frames kept per stack, counted from the outermost one.
+    """
+    def __init__(self, interval=0.005, max_depth=100):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='skyportal-profiler')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(stack[::-1][:self.max_depth])] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Samples in collapsed stack format, one stack per line."""
+        return ''.join(f'{stack} {count}\n'
+                       for stack, count in self.stacks.most_common())
+
+    def profile(self, seconds):
+        """Sample for `seconds` (blocking) and return the collapsed stacks."""
+        self.start()
+        time.sleep(seconds)
+        self.stop()
+        return self.collapsed()
+
+
+class MemorySnapshots:
+    """Capture `tracemalloc` snapshots and compare them.
+
+    Tracing is started with the first snapshot; it slows down allocations,
+    so `stop` should be called once done.
+    """
+    def __init__(self, max_snapshots=10, nframes=10):
+        self.max_snapshots = max_snapshots
+        self.nframes = nframes
+        self.snapshots = {}
+        self._next_id = 1
+
+    def take(self):
+        """Take a snapshot and return its id (an int)."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframes)
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        snapshot_id = self._next_id
+        self._next_id += 1
+        self.snapshots[snapshot_id] = (time.time(), snapshot)
+        while len(self.snapshots) > self.max_snapshots:
+            del self.snapshots[min(self.snapshots)]
+        return snapshot_id
+
+    def _get(self, snapshot_id):
+        try:
+            return self.snapshots[int(snapshot_id)][1]
+        except (KeyError, ValueError):
+            raise ValueError(f'Unknown snapshot {snapshot_id}')
+
+    def top(self, snapshot_id, key_type='lineno', limit=25):
+        """Largest allocation sites of a snapshot."""
+        stats = self._get(snapshot_id).statistics(key_type)
+        return {'total_kb': sum(s.size for s in stats) / 1024,
+                'top': [{'traceback': [str(frame) for frame in s.traceback],
+                         'size_kb': s.size / 1024, 'count': s.count}
+                        for s in stats[:limit]]}
+
+    def compare(self, base_id, snapshot_id, key_type='lineno', limit=25):
+        """Allocation sites that grew the most between two snapshots."""
+        stats = self._get(snapshot_id).compare_to(self._get(base_id),
+                                                  key_type)
+        return {'total_diff_kb': sum(s.size_diff for s in stats) / 1024,
+                'top': [{'traceback': [str(frame) for frame in s.traceback],
+                         'size_kb': s.size / 1024,
+                         'size_diff_kb': s.size_diff / 1024,
+                         'count_diff': s.count_diff}
+                        for s in stats[:limit]]}
+
+    def discard(self, snapshot_id):
+        self._get(snapshot_id)
+        del self.snapshots[int(snapshot_id)]
+
+    def list(self):
+        return [{'id': snapshot_id, 'taken_at': taken_at}
+                for snapshot_id, (taken_at, _) in sorted(self.snapshots.items())]
+
+    def stop(self):
+        self.snapshots.clear()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
@@ -0,0 +1,139 @@
+"""Record the SQL statements made while handling a request (debug/test mode).
+
+When enabled (`debug:query_log` in the configuration), every statement
+executed while a request is handled is recorded with its normalized shape
+and the SkyPortal code that issued it.  Statement shapes repeated at least
+`debug:n_plus_one_threshold` times in one request -- the signature of lazy
+loading in a loop (N+1 queries) -- are logged together with the offending
+call sites, and responses carry the headers
+
+- `X-Query-Count`: number of statements executed;
+- `X-Query-Repeated`: the most repeated shape and where it was issued.
+
+Tests can then assert a query budget per endpoint, see
+`skyportal.tests.assert_query_budget`.  Code can also be checked in-process:
+
+    with query_log.record() as log:
+        source.is_owned_by(user)
+    assert log.count <= 2, log.report()
+"""
+
+from collections import Counter
+import contextlib
+import contextvars
+import logging
+import os
+import re
+import traceback
+
+import sqlalchemy as sa
+
+
+log = logging.getLogger('skyportal.query_log')
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),  # strings
+    (re.compile(r'\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b'), '?'),  # numbers
+    (re.compile(r'%\(\w+\)s|%s|:\w+'), '?'),  # bound parameters
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?)'),  # IN lists
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def normalize(statement):
+    """Reduce a SQL statement to its shape, with literals and parameters
+    replaced by `?`."""
+    for pattern, replacement in _LITERALS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def call_site(limit=3):
+    """The innermost frames of SkyPortal code on the current stack."""
+    frames = [frame for frame in traceback.extract_stack()
+              if frame.filename.startswith(PACKAGE_DIR) and
+              not frame.filename.endswith(('query_log.py', 'metrics.py'))]
+    return ' <- '.join(f'{os.path.relpath(f.filename, PACKAGE_DIR)}:'
+                       f'{f.lineno} {f.name}'
+                       for f in frames[::-1][:limit]) or '<unknown>'
+
+
+class QueryLog:
+    def __init__(self):
+        self.statements = []  # (shape, call site)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def repeated(self, threshold=2):
+        """Statement shapes executed at least `threshold` times, with the call
+        sites that issued them, most frequent first."""
+        counts = Counter(shape for shape, site in self.statements)
+        result = []
+        for shape, n in counts.most_common():
+            if n < threshold:
+                break
+            sites = Counter(site for s, site in self.statements
+                            if s == shape)
+            result.append((shape, n, [site for site, _ in
+                                      sites.most_common()]))
+        return result
+
+    def report(self, threshold=2):
+        lines = [f'{self.count} statements']
+        for shape, n, sites in self.repeated(threshold):
+            lines.append(f'  {n}x {shape[:200]}')
+            lines.extend(f'     at {site}' for site in sites[:3])
+        return '\n'.join(lines)
+
+
+_current_log = contextvars.ContextVar('skyportal_query_log', default=None)
+_enabled = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    query_log = _current_log.get()
+    if query_log is not None:
+        query_log.statements.append((normalize(statement), call_site()))
+
+
+def enable():
+    """Start listening to statements of all engines in this process."""
+    global _enabled
+    if not _enabled:
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute',
+                        _before_cursor_execute)
+        _enabled = True
+
+
+def start_request():
+    query_log = QueryLog()
+    _current_log.set(query_log)
+    return query_log
+
+
+def finish_request(query_log, description, threshold):
+    """Stop recording and log statement shapes repeated `threshold` times."""
+    _current_log.set(None)
+    repeated = query_log.repeated(threshold)
+    if repeated:
+        log.warning('Possible N+1 queries in %s: %s', description,
+                    query_log.report(threshold))
+    return repeated
+
+
+@contextlib.contextmanager
+def record():
+    """Record the statements executed within this block."""
+    enable()
+    previous = _current_log.get()
+    query_log = QueryLog()
+    _current_log.set(query_log)
+    try:
+        yield query_log
+    finally:
+        _current_log.set(previous)
@@ -24,6 +24,7 @@ from baselayer.app.models import (
 
 import sys
 import inspect
+import threading
 from enum import Enum
 
 
@@ -62,39 +63,59 @@ def success(schema_name, base_schema=None):
     return type(schema_name, (_Schema,), schema_fields)
 
 
+_schemas_set_up = False
+_setup_lock = threading.Lock()
+
+
 def setup_schema():
     """For each model, install a marshmallow schema generator as
     `model.__schema__()`, and add an entry to the `schema`
     module.
 
+    Generating the schemas is slow, so this is done on first use (see
+    `__getattr__` below) rather than when the models are imported.
     """
-    for class_ in _Base._decl_class_registry.values():
-        if hasattr(class_, '__tablename__'):
-            if class_.__name__.endswith('Schema'):
-                raise _ModelConversionError(
-                    "For safety, setup_schema can not be used when a"
-                    "Model class ends with 'Schema'"
+    global _schemas_set_up
+    with _setup_lock:
+        if _schemas_set_up:
+            return
+        for class_ in _Base._decl_class_registry.values():
+            if hasattr(class_, '__tablename__'):
+                if class_.__name__.endswith('Schema'):
+                    raise _ModelConversionError(
+                        "For safety, setup_schema can not be used when a"
+                        "Model class ends with 'Schema'"
+                    )
+
+                class Meta(object):
+                    model = class_
+                    sqla_session = _DBSession
+
+                schema_class_name = '%s' % class_.__name__
+
+                schema_class = type(
+                    schema_class_name,
+                    (_ModelSchema,),
+                    {'Meta': Meta}
                 )
 
-            class Meta(object):
-                model = class_
-                sqla_session = _DBSession
+                setattr(class_, '__schema__', schema_class)
+                setattr(sys.modules[__name__], class_.__name__,
+                        schema_class())
+        _schemas_set_up = True
 
-            schema_class_name = '%s' % class_.__name__
-
-            schema_class = type(
-                schema_class_name,
-                (_ModelSchema,),
-                {'Meta': Meta}
-            )
 
-            setattr(class_, '__schema__', schema_class)
-            setattr(sys.modules[__name__], class_.__name__,
-                    schema_class())
+def __getattr__(name):
+    # Model schemas, e.g. `schema.Source`, are generated on first access
+    if name.startswith('_') or _schemas_set_up:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    setup_schema()
+    return getattr(sys.modules[__name__], name)
 
 
 def register_components(spec):
     print('Registering schemas with APISpec')
+    setup_schema()
 
     schemas = inspect.getmembers(
         sys.modules[__name__],
@@ -0,0 +1,82 @@
+"""Fast JSON serialization of API responses.
+
+`BaseHandler.success` serializes responses with `to_json`, which uses
+`orjson` (with native support for NumPy arrays and scalars, datetimes and
+NaN, encoded as null) instead of the standard library encoder.
+
+ORM objects are serialized, as by `Base.to_dict`, to their loaded
+attributes: relationships appear only if they were eagerly loaded.  For the
+models returned in bulk (`HOT_MODELS`), the attribute names are collected
+once per class from the mapper, so that serializing an object is a single
+dictionary lookup per attribute; other models fall back to `to_dict`.
+Expired attributes (e.g. after a commit) are reloaded first, as accessing
+them would.
+"""
+
+import datetime
+import decimal
+
+import numpy as np
+import orjson
+import sqlalchemy as sa
+
+from baselayer.app.models import Base
+from .models import Comment, Group, Photometry, Source
+
+
+HOT_MODELS = (Comment, Group, Photometry, Source)
+
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+_extractors = {}
+
+
+def compile_extractor(cls):
+    """Return a function mapping instances of `cls` to a dictionary of their
+    loaded, mapped attributes."""
+    keys = tuple(attr.key for attr in sa.inspect(cls).attrs
+                 if not attr.key.startswith('_'))
+
+    def extract(obj):
+        state = sa.inspect(obj)
+        if state.expired_attributes and state.session is not None:
+            state.session.refresh(obj, list(state.expired_attributes))
+        loaded = obj.__dict__
+        return {key: loaded[key] for key in keys if key in loaded}
+
+    return extract
+
+
+def _default(obj):
+    cls = type(obj)
+    extract = _extractors.get(cls)
+    if extract is None and cls in HOT_MODELS:
+        extract = _extractors[cls] = compile_extractor(cls)
+    if extract is not None:
+        return extract(obj)
+    if isinstance(obj, Base):
+        return obj.to_dict()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):  # e.g. non-contiguous arrays
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', errors='replace')
+    raise TypeError(f'Object of type {cls.__name__} is not JSON serializable')
+
+
+def to_json(data):
+    """Serialize `data` to JSON bytes."""
+    return orjson.dumps(data, default=_default, option=OPTIONS)
+
+
+def to_primitive(data):
+    """Convert `data` (e.g. ORM objects) to JSON-compatible Python objects,
+    for payloads serialized elsewhere, such as websocket messages."""
+    return orjson.loads(to_json(data))
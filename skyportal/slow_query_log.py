@@ -0,0 +1,176 @@
+"""Log slow SQL statements together with their query plans.
+
+Statements that take longer than `slow_query_log:threshold_ms` are logged
+as JSON lines (to `slow_query_log:path` and the `skyportal.slow_query_log`
+logger) with
+
+- the normalized statement and the shape of its bound parameters (names
+  and types, not values, which may be private);
+- the handler that was serving the request and the SkyPortal code that
+  issued the statement;
+- for SELECT statements, the output of `EXPLAIN (ANALYZE, BUFFERS)`
+  (or plain `EXPLAIN` with `explain: plain`).  Since EXPLAIN ANALYZE runs
+  the statement again, each statement shape is explained at most once per
+  `explain_interval` seconds.
+
+`plan_shape` reduces a plan to its node types, relations and indexes, which
+the test suite compares against stored snapshots to catch plans regressing
+to sequential scans (see `skyportal/tests/test_query_plans.py`).
+"""
+
+import contextvars
+import json
+import logging
+import os
+import time
+
+import sqlalchemy as sa
+
+from .query_log import call_site, normalize
+
+
+log = logging.getLogger('skyportal.slow_query_log')
+
+_current_handler = contextvars.ContextVar('skyportal_handler', default=None)
+
+
+def set_handler(name):
+    """Record which handler is serving the request in this context."""
+    _current_handler.set(name)
+
+
+def parameter_shape(parameters, executemany=False):
+    """Names and types of bound parameters, without their values."""
+    if executemany:
+        return {'executemany': len(parameters),
+                'row': parameter_shape(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__
+                for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return None
+
+
+def explain(connection, statement, parameters=None, analyze=True,
+            settings=()):
+    """Return the JSON query plan of a statement.
+
+    The statement is explained within a savepoint that is rolled back
+    afterwards, so that neither the planner settings nor a failed EXPLAIN
+    affect the surrounding transaction.
+
+    Parameters
+    ----------
+    connection : DBAPI (psycopg2) connection, within a transaction
+    settings : list of str
+        Planner settings to explain the statement with, e.g.
+        `['enable_seqscan = off']`.
+    """
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+    cursor = connection.cursor()
+    cursor.execute('SAVEPOINT skyportal_explain')
+    try:
+        for setting in settings:
+            cursor.execute(f'SET LOCAL {setting}')
+        cursor.execute(f'EXPLAIN ({options}) {statement}', parameters)
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.execute('ROLLBACK TO SAVEPOINT skyportal_explain')
+        cursor.execute('RELEASE SAVEPOINT skyportal_explain')
+        cursor.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def plan_shape(plan, depth=0):
+    """Indented lines with the node type, relation and index of each plan
+    node; costs and row estimates are left out, so that the shape only
+    changes when the plan does."""
+    node = plan['Node Type']
+    if 'Relation Name' in plan:
+        node += f' on {plan["Relation Name"]}'
+    if 'Index Name' in plan:
+        node += f' using {plan["Index Name"]}'
+    lines = ['  ' * depth + node]
+    for child in plan.get('Plans', []):
+        lines.extend(plan_shape(child, depth + 1))
+    return lines
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=500, explain='analyze',
+                 explain_interval=600, path=None):
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.path = path
+        self.last_explained = {}
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        conn.info.setdefault('skyportal_query_start', []).append(
+            time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        starts = conn.info.get('skyportal_query_start')
+        if not starts:
+            return
+        duration = time.perf_counter() - starts.pop()
+        if duration < self.threshold:
+            return
+
+        shape = normalize(statement)
+        entry = {'time': time.time(), 'duration_ms': 1000 * duration,
+                 'statement': shape,
+                 'parameters': parameter_shape(parameters, executemany),
+                 'handler': _current_handler.get(),
+                 'call_site': call_site()}
+
+        words = statement.split(None, 1)
+        is_select = bool(words) and words[0].upper() in ('SELECT', 'WITH')
+        now = time.monotonic()
+        if (self.explain != 'off' and is_select and not executemany and
+                now - self.last_explained.get(shape, -1e9) >
+                self.explain_interval):
+            self.last_explained[shape] = now
+            try:
+                plan = explain(cursor.connection, statement, parameters,
+                               analyze=self.explain == 'analyze')
+                entry['plan'] = plan
+                entry['plan_shape'] = plan_shape(plan)
+            except Exception as e:
+                entry['plan_error'] = repr(e)
+        self.write(entry)
+
+    def write(self, entry):
+        log.warning('Slow query (%.0f ms) in %s: %s', entry['duration_ms'],
+                    entry['handler'], entry['statement'][:500])
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry, default=str) + '\n')
+
+
+_slow_query_log = None
+
+
+def enable(threshold_ms=500, explain='analyze', explain_interval=600,
+           path=None):
+    """Log statements slower than `threshold_ms`, for all engines."""
+    global _slow_query_log
+    if _slow_query_log is not None:
+        sa.event.remove(sa.engine.Engine, 'before_cursor_execute',
+                        _slow_query_log.before_cursor_execute)
+        sa.event.remove(sa.engine.Engine, 'after_cursor_execute',
+                        _slow_query_log.after_cursor_execute)
+    _slow_query_log = SlowQueryLog(threshold_ms, explain, explain_interval,
+                                   path)
+    sa.event.listen(sa.engine.Engine, 'before_cursor_execute',
+                    _slow_query_log.before_cursor_execute)
+    sa.event.listen(sa.engine.Engine, 'after_cursor_execute',
+                    _slow_query_log.after_cursor_execute)
+    return _slow_query_log
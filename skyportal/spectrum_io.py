@@ -0,0 +1,205 @@
+"""Readers for spectrum files.
+
+All readers return a `(wavelengths, fluxes, errors)` tuple of 1D NumPy
+arrays; `errors` is None if the file contains no uncertainties.
+
+- ASCII/CSV: two or three columns (wavelength, flux[, error]), separated by
+  commas or whitespace.  Lines starting with `#` and a single header line of
+  column names are skipped.
+- FITS: either a 1D image with a linear wavelength solution in the header
+  (`CRVAL1`, `CDELT1`/`CD1_1`, `CRPIX1`), or a binary table with wavelength,
+  flux and (optionally) error columns.  Files are memory-mapped.
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+
+
+FITS_MAGIC = b'SIMPLE  ='
+
+WAVELENGTH_COLUMNS = ('wavelength', 'wave', 'lambda', 'wl', 'loglam')
+FLUX_COLUMNS = ('flux', 'fluxes', 'f_lambda', 'flam')
+ERROR_COLUMNS = ('error', 'errors', 'err', 'flux_err', 'flux_error',
+                 'sigma', 'ivar')
+
+
+def detect_format(filename):
+    """Return 'fits' or 'ascii', based on the first bytes of the file."""
+    with open(filename, 'rb') as f:
+        return 'fits' if f.read(len(FITS_MAGIC)) == FITS_MAGIC else 'ascii'
+
+
+def _find_column(names, candidates):
+    lower = {n.lower(): n for n in names}
+    for candidate in candidates:
+        if candidate in lower:
+            return lower[candidate]
+    return None
+
+
+def _split_columns(data, names=None):
+    """Split a 2D array into (wavelengths, fluxes, errors).
+
+    Without column names, the columns are taken to be wavelength, flux and,
+    optionally, error.  With names, columns are matched by name and any
+    others are ignored; `loglam` wavelengths are converted to wavelengths,
+    and `ivar` (inverse variance) to errors.
+    """
+    if names is not None:
+        wave_col = _find_column(names, WAVELENGTH_COLUMNS)
+        flux_col = _find_column(names, FLUX_COLUMNS)
+        err_col = _find_column(names, ERROR_COLUMNS)
+        wave_idx = names.index(wave_col) if wave_col is not None else 0
+        flux_idx = names.index(flux_col) if flux_col is not None else 1
+        wavelengths, fluxes = data[:, wave_idx], data[:, flux_idx]
+        if wave_col is not None and wave_col.lower() == 'loglam':
+            wavelengths = 10 ** wavelengths
+        errors = None
+        if err_col is not None:
+            errors = data[:, names.index(err_col)]
+            if err_col.lower() == 'ivar':
+                with np.errstate(divide='ignore'):
+                    errors = 1 / np.sqrt(errors)
+        return wavelengths, fluxes, errors
+
+    if data.shape[1] not in (2, 3):
+        raise ValueError(f"Expected 2 or 3 columns, got {data.shape[1]}")
+    wavelengths, fluxes = data[:, 0], data[:, 1]
+    errors = data[:, 2] if data.shape[1] == 3 else None
+    return wavelengths, fluxes, errors
+
+
+def _first_data_line(text):
+    """Return (start, end) offsets of the first non-blank, non-comment line."""
+    start = 0
+    while start < len(text):
+        end = text.find(b'\n', start)
+        if end == -1:
+            end = len(text)
+        line = text[start:end].strip()
+        if line and not line.startswith(b'#'):
+            return start, end
+        start = end + 1
+    raise ValueError("No data found")
+
+
+def parse_ascii(text):
+    """Parse the contents of an ASCII/CSV spectrum file.
+
+    Only the first data line is inspected in Python, to detect the delimiter
+    and an optional header line; the numbers themselves are converted by the
+    C parser of `pandas.read_csv`, which is considerably faster than
+    `np.loadtxt` on large files.
+
+    Parameters
+    ----------
+    text : bytes or str
+        File contents.
+    """
+    if isinstance(text, str):
+        text = text.encode()
+    start, end = _first_data_line(text)
+    first_line = text[start:end]
+    names = None
+    try:
+        [float(v) for v in first_line.replace(b',', b' ').split()]
+    except ValueError:  # header line
+        names = first_line.decode().replace(',', ' ').split()
+        text = text[end + 1:]
+        start, end = _first_data_line(text)
+        first_line = text[start:end]
+
+    sep = ',' if b',' in first_line else r'\s+'
+    data = pd.read_csv(io.BytesIO(text), sep=sep, header=None, comment='#',
+                       dtype=float, engine='c').values
+    # Indented comment lines show up as rows of NaN
+    data = data[~np.isnan(data).all(axis=1)]
+    return _split_columns(data, names)
+
+
+def read_ascii(filename):
+    """Read an ASCII/CSV spectrum file; see `parse_ascii`."""
+    with open(filename, 'rb') as f:
+        return parse_ascii(f.read())
+
+
+def read_fits(filename):
+    """Read a FITS spectrum, either a 1D image or a binary table.
+
+    `filename` may also be a file-like object.
+    """
+    from astropy.io import fits
+
+    with fits.open(filename, memmap=True) as hdul:
+        for hdu in hdul:
+            if hdu.data is None:
+                continue
+
+            if isinstance(hdu, fits.BinTableHDU):
+                names = hdu.columns.names
+                wave_col = _find_column(names, WAVELENGTH_COLUMNS)
+                flux_col = _find_column(names, FLUX_COLUMNS)
+                if wave_col is None or flux_col is None:
+                    continue
+                err_col = _find_column(names, ERROR_COLUMNS)
+                columns = [c for c in (wave_col, flux_col, err_col)
+                           if c is not None]
+                data = np.column_stack([
+                    np.array(hdu.data[c], dtype=float).ravel()
+                    for c in columns])
+                return _split_columns(data, columns)
+
+            elif hdu.data.ndim == 1:
+                header = hdu.header
+                fluxes = np.array(hdu.data, dtype=float)
+                delta = header.get('CDELT1', header.get('CD1_1'))
+                if delta is None or 'CRVAL1' not in header:
+                    raise ValueError("No wavelength solution in FITS header")
+                pixels = np.arange(1, len(fluxes) + 1)
+                wavelengths = (header['CRVAL1'] +
+                               (pixels - header.get('CRPIX1', 1)) * delta)
+                return wavelengths, fluxes, None
+
+    raise ValueError(f"No spectrum found in {filename}")
+
+
+def parse_spectrum(data, format=None):
+    """Parse the contents of a spectrum file, detecting its format if not
+    specified.
+
+    Parameters
+    ----------
+    data : bytes
+        File contents.
+    format : {'ascii', 'fits'}, optional
+        File format.  Detected from the file contents if not given.
+    """
+    if format is None:
+        format = 'fits' if data.startswith(FITS_MAGIC) else 'ascii'
+    if format == 'fits':
+        return read_fits(io.BytesIO(data))
+    elif format == 'ascii':
+        return parse_ascii(data)
+    else:
+        raise ValueError(f"Unknown spectrum format: {format}")
+
+
+def read_spectrum(filename, format=None):
+    """Read a spectrum file, detecting its format if not specified.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the file.
+    format : {'ascii', 'fits'}, optional
+        File format.  Detected from the file contents if not given.
+    """
+    format = format or detect_format(filename)
+    if format == 'fits':
+        return read_fits(filename)
+    elif format == 'ascii':
+        return read_ascii(filename)
+    else:
+        raise ValueError(f"Unknown spectrum format: {format}")
@@ -0,0 +1,183 @@
+"""Incremental parsers for streamed uploads.
+
+Each parser is fed raw chunks of a request body as they arrive and returns
+whatever complete rows it could decode so far, as a `pandas.DataFrame`, so
+that an upload never has to be held in memory as a whole.
+"""
+
+import ast
+import io
+
+import numpy as np
+import pandas as pd
+
+
+class CSVStreamParser:
+    """Parse comma-separated text, one block of complete lines at a time.
+
+    Parameters
+    ----------
+    columns : list of str, optional
+        Column names.  If not given, the first non-comment line of the
+        stream is used as header.
+    comment : str
+        Lines starting with this character are ignored.
+    """
+    def __init__(self, columns=None, comment='#'):
+        self.columns = columns
+        self.comment = comment
+        self._partial = b''
+
+    def _parse(self, block):
+        if self.columns is None:
+            lines = block.split(b'\n')
+            for i, line in enumerate(lines):
+                line = line.strip()
+                if line and not line.startswith(self.comment.encode()):
+                    self.columns = [c.strip() for c in
+                                    line.decode().split(',')]
+                    block = b'\n'.join(lines[i + 1:])
+                    break
+            else:
+                return None
+
+        if not block.strip():
+            return None
+        return pd.read_csv(io.BytesIO(block), header=None, names=self.columns,
+                           comment=self.comment, skipinitialspace=True)
+
+    def feed(self, chunk):
+        data = self._partial + chunk
+        cut = data.rfind(b'\n')
+        if cut == -1:
+            self._partial = data
+            return None
+        block, self._partial = data[:cut + 1], data[cut + 1:]
+        return self._parse(block)
+
+    def close(self):
+        block, self._partial = self._partial, b''
+        return self._parse(block)
+
+
+class RecordStreamParser:
+    """Decode fixed-size binary records, either raw or in NumPy `.npy` format.
+
+    Parameters
+    ----------
+    columns : list of str
+        Column names.  Required for raw records and for `.npy` files that
+        contain a plain 2D array; ignored for structured `.npy` arrays.
+    dtype : str or numpy.dtype
+        Type of each column for raw records.
+    npy : bool
+        Whether the stream starts with a `.npy` header.
+    """
+    NPY_MAGIC = b'\x93NUMPY'
+
+    def __init__(self, columns=None, dtype='<f8', npy=False):
+        self.columns = columns
+        self.dtype = None if npy else self._record_dtype(np.dtype(dtype))
+        self._buffer = bytearray()
+
+    def _record_dtype(self, dtype):
+        if dtype.names is not None:
+            return dtype
+        if not self.columns:
+            raise ValueError('Column names are required for unstructured '
+                             'binary data')
+        return np.dtype([(c, dtype) for c in self.columns])
+
+    def _parse_npy_header(self):
+        if len(self._buffer) < 10:
+            return False
+        if bytes(self._buffer[:6]) != self.NPY_MAGIC:
+            raise ValueError('Not a .npy stream')
+        major = self._buffer[6]
+        if major == 1:
+            header_len = int.from_bytes(self._buffer[8:10], 'little')
+            start = 10
+        else:
+            if len(self._buffer) < 12:
+                return False
+            header_len = int.from_bytes(self._buffer[8:12], 'little')
+            start = 12
+        if len(self._buffer) < start + header_len:
+            return False
+
+        header = ast.literal_eval(
+            bytes(self._buffer[start:start + header_len]).decode('latin1'))
+        if header['fortran_order']:
+            raise ValueError('Fortran-ordered .npy data cannot be streamed')
+        self.dtype = self._record_dtype(
+            np.lib.format.descr_to_dtype(header['descr']))
+        del self._buffer[:start + header_len]
+        return True
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        if self.dtype is None and not self._parse_npy_header():
+            return None
+
+        n = len(self._buffer) // self.dtype.itemsize
+        if n == 0:
+            return None
+        nbytes = n * self.dtype.itemsize
+        records = np.frombuffer(bytes(self._buffer[:nbytes]), self.dtype)
+        del self._buffer[:nbytes]
+        return pd.DataFrame(records)
+
+    def close(self):
+        if self._buffer:
+            raise ValueError(f'Stream ended with {len(self._buffer)} bytes '
+                             'of an incomplete record')
+        return None
+
+
+def parser_for(content_type, columns=None):
+    """Return a stream parser suitable for the given `Content-Type`.
+
+    Supported types are `text/csv` (the default), `application/x-npy` and
+    `application/octet-stream` (raw little-endian float64 records).
+    """
+    content_type = (content_type or '').split(';')[0].strip()
+    if content_type in ('application/x-npy', 'application/npy'):
+        return RecordStreamParser(columns, npy=True)
+    elif content_type == 'application/octet-stream':
+        return RecordStreamParser(columns)
+    else:
+        return CSVStreamParser(columns)
+
+
+class ColumnBuffer:
+    """Accumulate numeric columns in preallocated, growable NumPy arrays.
+
+    Appending is amortized O(1); the buffers are doubled in size whenever they
+    fill up.  `max_rows` bounds the memory used by a single upload.
+    """
+    def __init__(self, columns, max_rows=None, initial_size=1024):
+        self.columns = columns
+        self.max_rows = max_rows
+        self.n = 0
+        self._arrays = {c: np.empty(initial_size) for c in columns}
+
+    def append(self, df):
+        n_new = len(df)
+        if self.max_rows is not None and self.n + n_new > self.max_rows:
+            raise ValueError(f'Upload exceeds maximum of {self.max_rows} rows')
+        size = len(next(iter(self._arrays.values())))
+        if self.n + n_new > size:
+            size = max(2 * size, self.n + n_new)
+            for c, arr in self._arrays.items():
+                grown = np.empty(size)
+                grown[:self.n] = arr[:self.n]
+                self._arrays[c] = grown
+        for c in self.columns:
+            if c in df:
+                self._arrays[c][self.n:self.n + n_new] = df[c].values
+            else:
+                self._arrays[c][self.n:self.n + n_new] = np.nan
+        self.n += n_new
+
+    def __getitem__(self, column):
+        return self._arrays[column][:self.n]
@@ -0,0 +1,215 @@
+"""Generate large synthetic datasets of transients.
+
+All quantities are drawn in bulk with NumPy and returned as
+`pandas.DataFrame`s whose columns match the corresponding tables, so that
+they can be bulk loaded with `model_util.copy_dataframe`:
+
+- sources are distributed uniformly over the sky, with redshifts following
+  a constant comoving rate (p(z) ~ z^2) out to `z_max`;
+- light curves are sampled at survey-like cadences (exponentially
+  distributed gaps, random filters) around a SN Ia-like template:
+  a quadratic rise to a peak absolute magnitude of about -19.3 and a linear
+  decline, with per-epoch limiting magnitudes, noise and non-detections;
+- spectra are blackbody continua with broad, blueshifted absorption
+  features, redshifted to each source.
+
+Use `tools/generate_data.py` to populate a database.
+"""
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from .model_util import copy_dataframe
+from .models import DBSession, Source
+
+
+SPEED_OF_LIGHT = 299792.458  # km/s
+H0 = 70.  # km/s/Mpc
+
+FILTERS = np.array(['g', 'r', 'i'])
+FILTER_OFFSETS = np.array([0.0, 0.1, 0.4])  # mag, at peak
+FILTER_COLOR_EVOLUTION = np.array([0.02, 0.0, -0.005])  # mag/day after peak
+
+# (rest wavelength [A], depth, width [A]) of the strongest SN Ia features
+ABSORPTION_LINES = np.array([[3945., 0.6, 80.], [5640., 0.3, 60.],
+                             [6355., 0.5, 70.]])
+
+
+def sky_positions(n, rng):
+    """Uniformly distributed (ra, dec) in degrees."""
+    ra = 360 * rng.random(n)
+    dec = np.degrees(np.arcsin(2 * rng.random(n) - 1))
+    return ra, dec
+
+
+def redshifts(n, rng, z_max=0.15):
+    """Redshifts for a constant volumetric rate, p(z) ~ z^2."""
+    return z_max * rng.random(n) ** (1 / 3)
+
+
+def distance_modulus(z):
+    """Low-redshift approximation of the distance modulus."""
+    luminosity_distance = SPEED_OF_LIGHT * z / H0 * (1 + z / 2)  # Mpc
+    return 5 * np.log10(luminosity_distance) + 25
+
+
+def generate_sources(n, rng, prefix='synth', offset=0, z_max=0.15):
+    ra, dec = sky_positions(n, rng)
+    ids = pd.Series(np.arange(offset, offset + n)).map(
+        lambda i: f'{prefix}{i:09d}')
+    return pd.DataFrame({'id': ids, 'ra': ra, 'dec': dec,
+                         'red_shift': redshifts(n, rng, z_max)})
+
+
+def generate_photometry(sources, rng, instrument_ids, start=None,
+                        duration=365., mean_epochs=30, cadence=3.):
+    """Light curves for `sources` (a DataFrame from `generate_sources`).
+
+    Each source is observed `mean_epochs` times on average (Poisson
+    distributed), with exponentially distributed gaps of mean `cadence`
+    days, starting up to 30 days before peak.  Peak times are uniformly
+    distributed over a survey of `duration` days beginning at `start`.
+    """
+    start = start or datetime.datetime(2018, 1, 1)
+    n_sources = len(sources)
+    peak_time = duration * rng.random(n_sources)
+    peak_mag = (rng.normal(-19.3, 0.3, n_sources) +
+                distance_modulus(sources['red_shift'].values))
+    rise_rate = rng.uniform(0.005, 0.02, n_sources)  # mag/day^2
+    decline_rate = rng.uniform(0.02, 0.08, n_sources)  # mag/day
+
+    n_epochs = rng.poisson(mean_epochs - 1, n_sources) + 1
+    n = n_epochs.sum()
+    source_index = np.repeat(np.arange(n_sources), n_epochs)
+    first = np.repeat(np.cumsum(n_epochs) - n_epochs, n_epochs)
+
+    # Observation times: cumulative sums of gaps, restarted for each source
+    gaps = rng.exponential(cadence, n)
+    elapsed = np.cumsum(gaps)
+    elapsed -= elapsed[first]
+    first_epoch = peak_time - 30 * rng.random(n_sources)
+    t = first_epoch[source_index] + elapsed
+    dt = t - peak_time[source_index]
+
+    filter_index = rng.integers(0, len(FILTERS), n)
+    true_mag = (peak_mag[source_index] + FILTER_OFFSETS[filter_index] +
+                np.where(dt < 0, rise_rate[source_index] * dt ** 2,
+                         (decline_rate[source_index] +
+                          FILTER_COLOR_EVOLUTION[filter_index]) * dt))
+
+    lim_mag = rng.normal(20.5, 0.3, n)
+    e_mag = np.minimum(0.02 + 0.2 * 10 ** (0.4 * (true_mag - lim_mag)), 0.5)
+    mag = true_mag + e_mag * rng.standard_normal(n)
+    detected = mag < lim_mag
+
+    return pd.DataFrame({
+        'source_id': sources['id'].values[source_index],
+        'instrument_id': rng.choice(instrument_ids, n),
+        'observed_at': pd.Timestamp(start) + pd.to_timedelta(t, unit='D'),
+        'time_format': 'iso',
+        'time_scale': 'tcb',
+        'filter': FILTERS[filter_index],
+        'mag': np.where(detected, mag, np.nan),
+        'e_mag': np.where(detected, e_mag, np.nan),
+        'lim_mag': lim_mag
+    })
+
+
+def generate_spectra(sources, rng, instrument_ids, start=None,
+                     duration=365., fraction=0.2, n_points=1000):
+    """Spectra for a random `fraction` of `sources`; sources with spectra
+    have one or more (1 + Poisson(0.5)) at random phases."""
+    start = start or datetime.datetime(2018, 1, 1)
+    has_spectra = rng.random(len(sources)) < fraction
+    n_spectra = np.where(has_spectra,
+                         1 + rng.poisson(0.5, len(sources)), 0)
+    n = n_spectra.sum()
+    source_index = np.repeat(np.arange(len(sources)), n_spectra)
+    z = sources['red_shift'].values[source_index]
+
+    wavelengths = np.linspace(3500., 9500., n_points)
+    rest = wavelengths[None, :] / (1 + z[:, None])
+    temperature = rng.uniform(6000., 15000., n)
+    # Planck function up to a constant, with wavelengths in Angstrom
+    x = 1.4388e8 / (rest * temperature[:, None])
+    continuum = rest ** -5 / np.expm1(np.minimum(x, 700))
+    continuum /= continuum.max(axis=1, keepdims=True)
+
+    velocity = rng.uniform(9000., 14000., n)  # km/s
+    blueshift = 1 - velocity / SPEED_OF_LIGHT
+    absorption = np.ones_like(rest)
+    for center, depth, width in ABSORPTION_LINES:
+        absorption -= depth * np.exp(
+            -0.5 * ((rest - center * blueshift[:, None]) / width) ** 2)
+    fluxes = 1e-16 * continuum * np.clip(absorption, 0.05, None)
+    errors = fluxes / rng.uniform(20., 50., n)[:, None]
+    fluxes = fluxes + errors * rng.standard_normal(fluxes.shape)
+
+    observed_at = (pd.Timestamp(start) +
+                   pd.to_timedelta(duration * rng.random(n), unit='D'))
+    return pd.DataFrame({
+        'source_id': sources['id'].values[source_index],
+        'instrument_id': rng.choice(instrument_ids, n),
+        'observed_at': observed_at,
+        'wavelengths': [wavelengths] * n,
+        'fluxes': list(fluxes),
+        'errors': list(errors)
+    })
+
+
+def next_offset(prefix='synth'):
+    """Number following the highest generated source name with `prefix`."""
+    last = (DBSession().query(Source.id).filter(Source.id.like(f'{prefix}%'))
+            .order_by(Source.id.desc()).first())
+    if last is None:
+        return 0
+    try:
+        return int(last[0][len(prefix):]) + 1
+    except ValueError:
+        return 0
+
+
+def load(n_sources, group_ids, instrument_ids, seed=None, chunk_size=10000,
+         prefix='synth', offset=0, session=None, progress=None, **kwargs):
+    """Generate `n_sources` sources with light curves and spectra and bulk
+    load them into the database, `chunk_size` sources per transaction.
+
+    Extra keyword arguments (`mean_epochs`, `cadence`, `spectra_fraction`,
+    ...) are passed on to the generators.  `progress`, if given, is called
+    with the number of sources loaded after each chunk.
+    """
+    session = session or DBSession()
+    rng = np.random.default_rng(seed)
+    phot_kwargs = {k: kwargs[k] for k in ('start', 'duration', 'mean_epochs',
+                                          'cadence') if k in kwargs}
+    spec_kwargs = {k: kwargs[k] for k in ('start', 'duration') if k in kwargs}
+    if 'spectra_fraction' in kwargs:
+        spec_kwargs['fraction'] = kwargs['spectra_fraction']
+
+    counts = {'sources': 0, 'photometry': 0, 'spectra': 0}
+    for chunk_start in range(0, n_sources, chunk_size):
+        n = min(chunk_size, n_sources - chunk_start)
+        now = datetime.datetime.now()
+        sources = generate_sources(n, rng, prefix, offset + chunk_start)
+        group_sources = pd.DataFrame({
+            'group_id': np.repeat(group_ids, n),
+            'source_id': np.tile(sources['id'].values, len(group_ids))
+        })
+        photometry = generate_photometry(sources, rng, instrument_ids,
+                                         **phot_kwargs)
+        spectra = generate_spectra(sources, rng, instrument_ids,
+                                   **spec_kwargs)
+
+        for table, df in [('sources', sources),
+                          ('group_sources', group_sources),
+                          ('photometry', photometry), ('spectra', spectra)]:
+            df['created_at'] = df['modified'] = now
+            n_rows = copy_dataframe(df, table, session)
+            if table in counts:
+                counts[table] += n_rows
+        session.commit()
+        if progress is not None:
+            progress(chunk_start + n)
+    return counts
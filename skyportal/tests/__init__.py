@@ -32,3 +32,29 @@ def api(method, endpoint, data=None, token=None):
     headers = {'Authorization': f'token {token}'} if token else None
     response = requests.request(method, url, json=data, headers=headers)
     return response.status_code, response.json()
+
+
+def assert_query_budget(method, endpoint, max_queries, data=None, token=None):
+    """Make an API call and assert that it executed at most `max_queries`
+    SQL statements.
+
+    Requires the server to run with `debug:query_log` enabled (as in
+    `test_config.yaml`), which reports the count in `X-Query-Count`.
+
+    Returns
+    -------
+    code : str
+        HTTP status code.
+    json : dict
+        Response JSON.
+    """
+    url = urllib.parse.urljoin(f'http://localhost:{cfg["ports:app"]}/api/',
+                               endpoint)
+    headers = {'Authorization': f'token {token}'} if token else None
+    response = requests.request(method, url, json=data, headers=headers)
+    n_queries = int(response.headers['X-Query-Count'])
+    assert n_queries <= max_queries, (
+        f'{method} {endpoint} executed {n_queries} SQL statements '
+        f'(budget: {max_queries}); most repeated: '
+        f'{response.headers.get("X-Query-Repeated", "none")}')
+    return response.status_code, response.json()
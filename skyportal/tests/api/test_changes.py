@@ -0,0 +1,68 @@
+from sqlalchemy.orm import Session
+
+from skyportal.tests import api
+from skyportal.models import DBSession, Comment
+
+
+def poll(token, cursor=None, limit=500):
+    changes = []
+    while True:
+        endpoint = f'changes?limit={limit}' + (f'&cursor={cursor}'
+                                               if cursor else '')
+        status, data = api('GET', endpoint, token=token)
+        assert status == 200
+        changes.extend(data['data']['changes'])
+        cursor = data['data']['cursor']
+        if not data['data']['has_more']:
+            return changes, cursor
+
+
+def test_change_feed(token, user, public_source, private_source):
+    changes, cursor = poll(token, limit=7)
+    keys = [(c['modified'], c['type'], c['id']) for c in changes]
+    assert len(keys) == len(set(keys))  # pages do not overlap
+    ids = {(c['type'], c['id']) for c in changes}
+    assert ('source', public_source.id) in ids
+    assert ('source', private_source.id) not in ids
+    assert {('photometry', p.id) for p in public_source.photometry} <= ids
+    assert {('spectrum', s.id) for s in public_source.spectra} <= ids
+
+    comment = Comment(text='Change feed', user=user,
+                      source_id=public_source.id)
+    DBSession().add(comment)
+    DBSession().commit()
+    changes, cursor = poll(token, cursor)
+    assert [(c['type'], c['id']) for c in changes] == [('comment',
+                                                        comment.id)]
+    assert changes[0]['data']['text'] == 'Change feed'
+
+
+def test_invalid_cursor(token):
+    status, data = api('GET', 'changes?cursor=nonsense', token=token)
+    assert status == 400
+
+
+def test_late_commit_is_not_skipped(token, user, public_source):
+    changes, cursor = poll(token)
+
+    # A transaction writing a comment, but committing after the next poll
+    session = Session(bind=DBSession().get_bind())
+    comment = Comment(text='Committed late', user_id=user.id,
+                      source_id=public_source.id)
+    session.add(comment)
+    session.flush()
+    comment_id = comment.id
+    try:
+        later = Comment(text='Committed first', user=user,
+                        source_id=public_source.id)
+        DBSession().add(later)
+        DBSession().commit()
+        changes, cursor = poll(token, cursor)
+        assert changes == []  # held back by the transaction in progress
+        session.commit()
+    finally:
+        session.close()
+
+    changes, cursor = poll(token, cursor)
+    assert {c['id'] for c in changes if c['type'] == 'comment'} == {
+        comment_id, later.id}
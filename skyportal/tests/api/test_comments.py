@@ -0,0 +1,34 @@
+import requests
+
+from skyportal.models import DBSession, Comment
+from skyportal.model_util import create_token
+from skyportal.tests import cfg
+from skyportal.tests.fixtures import UserFactory
+
+
+def put_attachment(comment_id, token, data):
+    return requests.put(
+        f'http://localhost:{cfg["ports:app"]}/api/comment/{comment_id}/'
+        'attachment', params={'name': 'notes.txt'}, data=data,
+        headers={'Authorization': f'token {token}',
+                 'Content-Type': 'text/plain'})
+
+
+def test_attachment_upload_requires_author(user, public_group, public_source):
+    comment = Comment(text='Mine', user=user, source_id=public_source.id)
+    DBSession().add(comment)
+    DBSession().commit()
+    comment_id = comment.id
+
+    other = UserFactory(groups=[public_group])
+    token = create_token(public_group.id, ['Comment'], created_by_id=other.id)
+    response = put_attachment(comment_id, token, b'Not yours')
+    assert response.status_code == 400
+    DBSession().expire_all()
+    assert Comment.query.get(comment_id).attachment_id is None
+
+    token = create_token(public_group.id, ['Comment'], created_by_id=user.id)
+    response = put_attachment(comment_id, token, b'Mine')
+    assert response.status_code == 200
+    DBSession().expire_all()
+    assert Comment.query.get(comment_id).attachment.size == 4
@@ -0,0 +1,44 @@
+import requests
+
+from skyportal import versioning
+from skyportal.tests import cfg
+from skyportal.models import DBSession, Comment
+
+
+def get(endpoint, token, etag=None):
+    headers = {'Authorization': f'token {token}'}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    return requests.get(f'http://localhost:{cfg["ports:app"]}/api/{endpoint}',
+                        headers=headers)
+
+
+def test_source_etag(token, user, public_source):
+    response = get(f'sources/{public_source.id}', token)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert 'Last-Modified' not in response.headers
+
+    response = get(f'sources/{public_source.id}', token, etag)
+    assert response.status_code == 304
+    assert response.content == b''
+
+    DBSession().add(Comment(text='New comment', user=user,
+                            source_id=public_source.id))
+    DBSession().commit()
+    response = get(f'sources/{public_source.id}', token, etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.json()['data']['comments'][-1]['text'] == 'New comment'
+
+
+def test_source_etag_checks_access(token, public_source, private_source):
+    etag = versioning.source_version(private_source.id).etag
+    response = get(f'sources/{private_source.id}', token, f'"{etag}"')
+    assert response.status_code == 400
+
+
+def test_plot_etag(token, public_source):
+    endpoint = f'internal/plot/photometry/{public_source.id}'
+    etag = get(endpoint, token).headers['ETag']
+    assert get(endpoint, token, etag).status_code == 304
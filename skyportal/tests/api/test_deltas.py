@@ -0,0 +1,44 @@
+import requests
+
+from skyportal import deltas
+from skyportal.models import DBSession, Comment, Source
+from skyportal.model_util import create_token
+from skyportal.tests import api, cfg
+
+
+def test_comment_bumps_source_version(public_group, public_source):
+    token = create_token(public_group.id, ['Comment'])
+    version = public_source.version
+    status, data = api('POST', 'comment', data={'source_id': public_source.id,
+                                                 'text': 'Delta'},
+                       token=token)
+    assert status == 200
+    DBSession().expire_all()
+    assert Source.query.get(public_source.id).version == version + 1
+
+
+def test_source_delta_payload(user, public_source):
+    comment = Comment(text='Delta', user=user, source_id=public_source.id)
+    DBSession().add(comment)
+    DBSession().commit()
+    delta = deltas.source_delta(public_source.id, 3, 'comment', 'created',
+                                [deltas.comment_data(comment)])
+    assert delta['version'] == 3
+    assert delta['data'][0]['id'] == comment.id
+    assert isinstance(delta['data'][0]['created_at'], str)
+
+
+def test_streamed_upload_bumps_source_version(public_group, public_source):
+    token = create_token(public_group.id, ['Upload data'])
+    version = public_source.version
+    response = requests.post(
+        f'http://localhost:{cfg["ports:app"]}/api/spectrum/stream',
+        data=b'wavelength,flux\n3000,1.5\n3001,1.6\n',
+        params={'sourceID': public_source.id,
+                'instrumentID': public_source.spectra[0].instrument_id,
+                'observed_at': '2019-01-01T00:00:00'},
+        headers={'Authorization': f'token {token}',
+                 'Content-Type': 'text/csv'})
+    assert response.status_code == 200
+    DBSession().expire_all()
+    assert Source.query.get(public_source.id).version == version + 1
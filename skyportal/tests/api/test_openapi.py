@@ -0,0 +1,17 @@
+import requests
+
+from skyportal.tests import cfg
+
+
+def test_openapi_spec_etag():
+    url = f'http://localhost:{cfg["ports:app"]}/api/openapi.json'
+    response = requests.get(url)
+    assert response.status_code == 200
+    spec = response.json()
+    assert spec['info']['title'] == 'SkyPortal'
+    assert '/api/sources/{source_id}' in spec['paths']
+
+    etag = response.headers['ETag']
+    response = requests.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
@@ -0,0 +1,80 @@
+import io
+
+import numpy as np
+import requests
+
+from skyportal.models import Photometry
+from skyportal.model_util import create_token
+from skyportal.tests import cfg
+
+
+def stream_url(endpoint):
+    return f'http://localhost:{cfg["ports:app"]}/api/{endpoint}'
+
+
+def test_stream_photometry_csv(public_group, public_source):
+    token = create_token(public_group.id, ['Upload data'])
+    instrument_id = public_source.photometry[0].instrument_id
+
+    def body():
+        yield b'obsTime,mag,e_mag\n'
+        for i in range(2000):
+            yield f'58000.{i:04d},{20 + i / 1000},0.1\n'.encode()
+
+    response = requests.post(
+        stream_url('photometry/stream'), data=body(),
+        params={'sourceID': public_source.id, 'instrumentID': instrument_id,
+                'timeFormat': 'mjd', 'timeScale': 'utc', 'filter': 'g'},
+        headers={'Authorization': f'token {token}',
+                 'Content-Type': 'text/csv'})
+    assert response.status_code == 200
+    assert response.json()['data']['count'] == 2000
+    assert (Photometry.query.filter(Photometry.source_id == public_source.id)
+            .filter(Photometry.time_format == 'iso').count()) >= 2000
+
+
+def test_stream_photometry_requires_permission(public_group, public_source):
+    token = create_token(public_group.id, [])
+    response = requests.post(
+        stream_url('photometry/stream'), data=b'obsTime,mag\n',
+        params={'sourceID': public_source.id, 'instrumentID': 1,
+                'timeFormat': 'iso', 'timeScale': 'tcb'},
+        headers={'Authorization': f'token {token}'})
+    assert response.status_code == 401
+
+
+def test_stream_photometry_invalid_arguments(public_group, public_source):
+    token = create_token(public_group.id, ['Upload data'])
+    params = {'sourceID': public_source.id, 'instrumentID': 'one',
+              'timeFormat': 'iso', 'timeScale': 'tcb'}
+    headers = {'Authorization': f'token {token}'}
+    response = requests.post(stream_url('photometry/stream'),
+                             data=b'obsTime,mag\n', params=params,
+                             headers=headers)
+    assert response.status_code == 400
+
+    # Binary records without column names
+    params['instrumentID'] = public_source.photometry[0].instrument_id
+    response = requests.post(
+        stream_url('photometry/stream'), data=b'\0' * 16, params=params,
+        headers={**headers, 'Content-Type': 'application/octet-stream'})
+    assert response.status_code == 400
+    assert 'Column names are required' in response.json()['message']
+
+
+def test_stream_spectrum_npy(public_group, public_source):
+    token = create_token(public_group.id, ['Upload data'])
+    instrument_id = public_source.spectra[0].instrument_id
+
+    data = np.column_stack([np.linspace(3000, 9000, 10000),
+                            np.random.random(10000)])
+    f = io.BytesIO()
+    np.save(f, data)
+    response = requests.post(
+        stream_url('spectrum/stream'), data=f.getvalue(),
+        params={'sourceID': public_source.id, 'instrumentID': instrument_id,
+                'observed_at': '2019-01-01T00:00:00',
+                'columns': 'wavelength,flux'},
+        headers={'Authorization': f'token {token}',
+                 'Content-Type': 'application/x-npy'})
+    assert response.status_code == 200
@@ -0,0 +1,50 @@
+import requests
+
+from skyportal.tests import api, cfg
+from skyportal.model_util import create_token
+
+
+def test_cpu_profile(public_group):
+    token = create_token(public_group.id, ['System admin'])
+    response = requests.get(
+        f'http://localhost:{cfg["ports:app"]}/api/internal/profiler/cpu',
+        params={'seconds': 0.5, 'interval': 0.01},
+        headers={'Authorization': f'token {token}'})
+    assert response.status_code == 200
+    lines = response.text.strip().split('\n')
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert any('MainThread;' in line for line in lines)
+
+
+def test_profiler_requires_system_admin(token):
+    status, data = api('GET', 'internal/profiler/cpu?seconds=0.1', token=token)
+    assert status == 401
+    status, data = api('POST', 'internal/profiler/memory', token=token)
+    assert status == 401
+
+
+def test_memory_snapshots(public_group):
+    token = create_token(public_group.id, ['System admin'])
+    status, data = api('POST', 'internal/profiler/memory', token=token)
+    assert status == 200
+    first = data['data']['id']
+    status, data = api('POST', 'internal/profiler/memory', token=token)
+    second = data['data']['id']
+
+    status, data = api('GET', f'internal/profiler/memory/{first}', token=token)
+    assert status == 200
+    assert data['data']['total_kb'] > 0
+
+    status, data = api('GET', f'internal/profiler/memory/{second}'
+                       f'?compare_to={first}', token=token)
+    assert status == 200
+    assert 'total_diff_kb' in data['data']
+
+    status, data = api('GET', 'internal/profiler/memory/999999', token=token)
+    assert status == 400
+
+    status, data = api('DELETE', 'internal/profiler/memory', token=token)
+    assert status == 200
+    status, data = api('GET', 'internal/profiler/memory', token=token)
+    assert data['data']['snapshots'] == []
@@ -0,0 +1,31 @@
+from skyportal.tests import assert_query_budget
+from skyportal.tests.fixtures import SourceFactory
+
+
+def test_source_list_query_budget(public_group, token):
+    # The number of statements must not grow with the number of sources
+    for i in range(10):
+        SourceFactory(groups=[public_group])
+    status, data = assert_query_budget('GET', 'sources', 15, token=token)
+    assert status == 200
+    assert len(data['data']) >= 10
+
+
+def test_source_query_budget(public_source, token):
+    status, data = assert_query_budget('GET', f'sources/{public_source.id}',
+                                       15, token=token)
+    assert status == 200
+
+
+def test_photometry_plot_query_budget(public_source, token):
+    status, data = assert_query_budget(
+        'GET', f'internal/plot/photometry/{public_source.id}', 20,
+        token=token)
+    assert status == 200
+
+
+def test_spectroscopy_plot_query_budget(public_source, token):
+    status, data = assert_query_budget(
+        'GET', f'internal/plot/spectroscopy/{public_source.id}', 20,
+        token=token)
+    assert status == 200
@@ -1,7 +1,53 @@
+import uuid
+
+from skyportal.models import DBSession, Source
 from skyportal.tests import api
+from skyportal.model_util import create_token
 
 
 def test_source_list(token):
     status, data = api('GET', 'sources', token=token)
     assert status == 200
     data['status'] == 'success'
+
+
+def test_bulk_source_upsert(public_group, public_source):
+    token = create_token(public_group.id, ['Manage sources'])
+    version = public_source.version
+    new_id = str(uuid.uuid4())
+    status, data = api('POST', 'sources/bulk', token=token, data={
+        'group_ids': [public_group.id],
+        'sources': [
+            {'id': new_id, 'ra': 10.0, 'dec': -5.0},
+            {'id': public_source.id, 'red_shift': 0.5},
+            {'ra': 1.0},
+            {'id': str(uuid.uuid4()), 'group_ids': [public_group.id + 1000]}
+        ]})
+    assert status == 200
+    results = data['data']['results']
+    assert [r['status'] for r in results] == ['created', 'updated', 'error',
+                                              'error']
+
+    status, data = api('GET', f'sources/{new_id}', token=token)
+    assert status == 200
+    assert data['data']['ra'] == 10.0
+
+    status, data = api('GET', f'sources/{public_source.id}', token=token)
+    assert data['data']['red_shift'] == 0.5
+    assert data['data']['ra'] == public_source.ra
+    assert data['data']['version'] == version + 1
+
+
+def test_bulk_source_upsert_hidden_source(public_group, private_source):
+    token = create_token(public_group.id, ['Manage sources'])
+    ra = private_source.ra
+    status, data = api('POST', 'sources/bulk', token=token, data={
+        'group_ids': [public_group.id],
+        'sources': [{'id': private_source.id, 'ra': 10.0}]})
+    assert status == 200
+    [result] = data['data']['results']
+    assert result['status'] == 'error'
+    assert 'permissions' in result['message']
+
+    DBSession().expire_all()
+    assert Source.query.get(private_source.id).ra == ra
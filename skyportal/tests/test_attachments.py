@@ -0,0 +1,78 @@
+import base64
+import os
+
+from skyportal.attachments import (AttachmentWriter, delete_unused,
+                                   iter_attachment, store_attachment,
+                                   store_base64_attachment)
+from skyportal.handlers.comment import _parse_range
+from skyportal.models import DBSession, Attachment, Comment
+
+
+def test_attachment_roundtrip_and_ranges():
+    data = os.urandom(1000)
+    attachment = store_attachment(data, chunk_size=64)
+    DBSession().commit()
+
+    assert attachment.size == len(data)
+    assert b''.join(iter_attachment(attachment)) == data
+    assert b''.join(iter_attachment(attachment, 100, 101)) == data[100:101]
+    assert b''.join(iter_attachment(attachment, 60, 700)) == data[60:700]
+    assert b''.join(iter_attachment(attachment, 960)) == data[960:]
+
+
+def test_attachment_deduplicated_by_content():
+    data = os.urandom(100)
+    first = store_attachment(data)
+    DBSession().commit()
+    second = store_attachment(data, chunk_size=10)
+    DBSession().commit()
+    assert first.id == second.id
+    third = store_base64_attachment(base64.b64encode(data).decode(),
+                                    chunk_size=30)
+    DBSession().commit()
+    assert third.id == first.id
+
+
+def test_attachment_writer_uses_own_session():
+    data = os.urandom(300)
+    writer = AttachmentWriter(chunk_size=64)
+    writer.write(data[:200])
+    # Other requests committing or rolling back `DBSession` in between
+    DBSession().rollback()
+    writer.write(data[200:])
+    attachment = writer.close()
+    assert b''.join(iter_attachment(attachment)) == data
+
+    writer = AttachmentWriter(chunk_size=64)
+    writer.write(os.urandom(100))
+    DBSession().commit()
+    writer.abort()
+    assert Attachment.query.filter(Attachment.sha256.is_(None)).count() == 0
+
+
+def test_unused_attachment_deleted(user, public_source):
+    attachment = store_attachment(os.urandom(100))
+    comment = Comment(text='With attachment', user=user,
+                      source_id=public_source.id, attachment=attachment)
+    DBSession().add(comment)
+    DBSession().commit()
+    attachment_id = attachment.id
+
+    delete_unused([attachment_id])
+    DBSession().commit()
+    assert Attachment.query.get(attachment_id) is not None
+
+    comment.attachment = None
+    DBSession().flush()
+    delete_unused([attachment_id])
+    DBSession().commit()
+    assert Attachment.query.get(attachment_id) is None
+
+
+def test_parse_range():
+    assert _parse_range(None, 100) is None
+    assert _parse_range('bytes=0-9', 100) == (0, 10)
+    assert _parse_range('bytes=90-', 100) == (90, 100)
+    assert _parse_range('bytes=-10', 100) == (90, 100)
+    assert _parse_range('bytes=50-500', 100) == (50, 100)
+    assert _parse_range('bytes=0-1,5-6', 100) is None
@@ -0,0 +1,32 @@
+from skyportal import model_util, query_log
+from skyportal.models import DBSession, BootstrapVersion
+
+
+def test_bootstrap_version_is_stable():
+    assert model_util.bootstrap_version() == model_util.bootstrap_version()
+
+
+def test_boot_checks_stamp_with_one_query():
+    model_util.bootstrap()
+    assert not model_util.bootstrap()  # stamp is up to date
+
+    with query_log.record() as log:
+        model_util.ensure_bootstrapped()
+    assert log.count == 1, log.report()
+
+
+def test_forced_bootstrap():
+    assert model_util.bootstrap(force=True)
+    assert model_util._bootstrap_stamp() == model_util.bootstrap_version()
+
+
+def test_boot_does_not_migrate():
+    model_util.bootstrap()
+    stamp = BootstrapVersion.query.filter(
+        BootstrapVersion.name == 'skyportal').one()
+    stamp.version = 'stale'
+    DBSession().commit()
+
+    model_util.ensure_bootstrapped()
+    assert model_util._bootstrap_stamp() == 'stale'  # left to bootstrap()
+    assert model_util.bootstrap()
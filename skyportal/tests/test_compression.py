@@ -0,0 +1,72 @@
+import gzip
+import json
+
+import pytest
+import tornado.httpclient
+import tornado.httpserver
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+
+from skyportal import compression
+
+
+class StreamHandler(tornado.web.RequestHandler):
+    async def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.write(b'[')
+        for i in range(100):
+            self.write((b',' if i else b'') + json.dumps(i).encode())
+            await self.flush()
+        self.write(b']')
+
+
+def fetch(accept_encoding):
+    app = tornado.web.Application([('/', StreamHandler)])
+    app.add_transform(compression.CompressedContentEncoding)
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(app)
+    server.add_sockets([sock])
+
+    async def get():
+        client = tornado.httpclient.AsyncHTTPClient(force_instance=True)
+        try:
+            return await client.fetch(
+                f'http://127.0.0.1:{port}/', decompress_response=False,
+                headers={'Accept-Encoding': accept_encoding})
+        finally:
+            client.close()
+            server.stop()
+
+    return tornado.ioloop.IOLoop.current().run_sync(get)
+
+
+def test_negotiate():
+    assert compression.negotiate('gzip, deflate') == 'gzip'
+    assert compression.negotiate('gzip;q=0, identity') is None
+    assert compression.negotiate('') is None
+    if compression.brotli is not None:
+        assert compression.negotiate('gzip, deflate, br') == 'br'
+        assert compression.negotiate('br;q=0.5, gzip') == 'gzip'
+        assert compression.negotiate('*') == 'br'
+
+
+def test_gzip_stream():
+    response = fetch('gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.body)) == list(range(100))
+
+
+def test_brotli_stream():
+    if compression.brotli is None:
+        pytest.skip('brotli is not installed')
+    response = fetch('br')
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(compression.brotli.decompress(response.body)) == \
+        list(range(100))
+
+
+def test_identity():
+    response = fetch('identity')
+    assert 'Content-Encoding' not in response.headers
+    assert json.loads(response.body) == list(range(100))
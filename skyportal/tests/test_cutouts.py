@@ -0,0 +1,110 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import threading
+
+import numpy as np
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from skyportal import cutouts
+from skyportal.cutouts import CircuitBreaker, CutoutResolver
+from skyportal.models import DBSession, SurveyCutout, Thumbnail
+
+
+PS1_PAGE = ('<html><body><img src="//ps1images.stsci.edu/cgi-bin/fitscut.cgi'
+            '?red=i.fits&green=r.fits&blue=g.fits" /></body></html>')
+
+
+class FailingAdapter(HTTPAdapter):
+    def send(self, request, **kwargs):
+        raise requests.ConnectionError('Service unavailable')
+
+
+@pytest.fixture()
+def ps1_server():
+    """Local stand-in for the PS1 cutout service."""
+    requests_seen = []
+
+    class PS1Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.end_headers()
+            self.wfile.write(PS1_PAGE.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('localhost', 0), PS1Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://localhost:{server.server_port}/cgi-bin/ps1cutouts', requests_seen
+    server.shutdown()
+
+
+def test_linked_thumbnails_resolved_in_background(ps1_server, public_source):
+    ps1_url, requests_seen = ps1_server
+    public_source.ra = 360 * np.random.random()
+    DBSession().commit()
+
+    resolver = CutoutResolver(ps1_url=ps1_url)
+    url = public_source.add_linked_thumbnails(resolver=resolver).result(timeout=10)
+    assert url.startswith('http://ps1images.stsci.edu/cgi-bin/fitscut.cgi')
+
+    DBSession().expire_all()
+    thumb = (Thumbnail.query.filter(Thumbnail.type == 'ps1')
+             .filter(Thumbnail.public_url == url).first())
+    assert thumb is not None
+    assert SurveyCutout.query.filter(SurveyCutout.ra == public_source.ra).count() == 1
+
+    # Second lookup at the same position is served from the cache
+    assert resolver.panstarrs_url(public_source.ra, public_source.dec) == url
+    assert len(requests_seen) == 1
+
+
+def test_pending_thumbnails_resolved(ps1_server, public_source):
+    ps1_url, requests_seen = ps1_server
+    public_source.ra = 360 * np.random.random()
+    DBSession().commit()
+
+    # The thumbnail is created while the service is unavailable...
+    unavailable = CutoutResolver(ps1_url=ps1_url, retries=0)
+    unavailable.session.mount('http://', FailingAdapter())
+    assert public_source.add_linked_thumbnails(
+        resolver=unavailable).result(timeout=10) is None
+
+    # ...and resolved by a later pass over the pending thumbnails
+    resolver = CutoutResolver(ps1_url=ps1_url)
+    urls = [future.result(timeout=10)
+            for future in resolver.resolve_pending()]
+    assert urls and all(url.startswith('http://ps1images') for url in urls)
+    DBSession().expire_all()
+    assert (Thumbnail.query.filter(Thumbnail.type == 'ps1')
+            .filter(Thumbnail.public_url.is_(None)).count()) == 0
+
+
+def test_get_panstarrs_url_does_not_block(ps1_server, public_source,
+                                          monkeypatch):
+    ps1_url, requests_seen = ps1_server
+    public_source.ra = 360 * np.random.random()
+    DBSession().commit()
+    resolver = CutoutResolver(ps1_url=ps1_url)
+    monkeypatch.setattr(cutouts, '_resolver', resolver)
+
+    assert public_source.get_panstarrs_url() is None
+    resolver.executor.shutdown(wait=True)
+    assert public_source.get_panstarrs_url().startswith('http://ps1images')
+
+
+def test_circuit_breaker_opens_after_failures():
+    breaker = CircuitBreaker(max_failures=2, reset_timeout=60)
+    resolver = CutoutResolver(ps1_url='http://ps1.invalid/ps1cutouts',
+                              retries=0, timeout=1, breaker=breaker)
+    resolver.session.mount('http://', FailingAdapter())
+    for i in range(2):
+        assert resolver.fetch_panstarrs_url(0.0, 0.0) is None
+    assert breaker.is_open
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert not breaker.is_open
@@ -0,0 +1,152 @@
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import importlib.util
+import json
+import os
+import threading
+
+import pytest
+
+
+TOOLS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'tools')
+spec = importlib.util.spec_from_file_location(
+    'download_ptf', os.path.join(TOOLS_DIR, 'download_ptf.py'))
+download_ptf = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(download_ptf)
+
+
+SOURCE_PAGE = """<html>
+2015 Mar 02 alice [info]
+Classified as SN Ia [<a href="attachment.pdf">attachment</a>]
+2015 Mar 05 bob [info]
+Follow-up requested
+</html>"""
+
+
+@pytest.fixture()
+def marshal_server():
+    """Local stand-in for the PTF marshal.
+
+    Source `14flaky` fails twice with a 503 before succeeding; `14gone` has
+    no cutouts; `14broken` always fails.
+    """
+    requests_seen = []
+    flaky_attempts = []
+
+    class MarshalHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            if '14broken' in self.path:
+                return self.send_error(500)
+            if 'view_source' in self.path and '14flaky' in self.path:
+                flaky_attempts.append(self.path)
+                if len(flaky_attempts) <= 2:
+                    return self.send_error(503)
+            if 'thumbs' in self.path and '14gone' in self.path:
+                return self.send_error(404)
+
+            if 'view_source' in self.path:
+                body = SOURCE_PAGE.encode()
+            elif 'batch_spec' in self.path:
+                body = b'spectra tarball'
+            else:
+                body = b'\x89PNG cutout'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('localhost', 0), MarshalHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://localhost:{server.server_port}', requests_seen
+    server.shutdown()
+
+
+def run(downloader, source_ids):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(downloader.run(source_ids))
+    finally:
+        loop.close()
+
+
+def test_parse_comments():
+    comments = download_ptf.parse_comments(SOURCE_PAGE)
+    assert [(c[1], c[2]) for c in comments] == [
+        ('alice', 'Classified as SN Ia'), ('bob', 'Follow-up requested')]
+    assert comments[0][0].year == 2015 and comments[0][0].month == 3
+
+
+def test_download_with_retries_and_resume(marshal_server, tmpdir):
+    base_url, requests_seen = marshal_server
+    comments = []
+
+    class CommentSink:
+        def __call__(self, source_id, c):
+            self.buffered.append(source_id)
+            comments.extend(c)
+
+        def flush(self):
+            self.flushed.extend(self.buffered)
+            self.buffered = []
+
+    sink = CommentSink()
+    sink.buffered, sink.flushed = [], []
+
+    def make_downloader():
+        return download_ptf.Downloader(
+            str(tmpdir), sink, base_url=base_url, concurrency=4, rate=0,
+            retries=2, backoff=0.01, manifest_batch=2)
+
+    source_ids = ['14abc', '14flaky', '14gone', '14broken']
+    failures = run(make_downloader(), source_ids)
+    assert set(failures) == {'14broken'}
+    assert len(comments) == 6
+
+    assert sorted(os.listdir(tmpdir / 'spectra')) == [
+        '14abc.tar.gz', '14flaky.tar.gz', '14gone.tar.gz']
+    assert len(os.listdir(tmpdir / 'cutouts')) == 6
+    with open(tmpdir / 'manifest.jsonl') as f:
+        manifest = {m['source_id']: m for m in map(json.loads, f)}
+    assert set(manifest) == {'14abc', '14flaky', '14gone'}
+    # Sources are recorded only after their comments were flushed
+    assert set(sink.flushed) == set(manifest) and sink.buffered == []
+    assert not manifest['14gone']['cutouts']
+
+    # A second run only retries the source that failed
+    requests_seen.clear()
+    failures = run(make_downloader(), source_ids)
+    assert set(failures) == {'14broken'}
+    assert all('14broken' in path for path in requests_seen)
+
+
+def test_retry_after():
+    class Response:
+        def __init__(self, value):
+            self.headers = {'Retry-After': value} if value else {}
+
+    assert download_ptf.retry_after(None) is None
+    assert download_ptf.retry_after(Response(None)) is None
+    assert download_ptf.retry_after(Response('7')) == 7
+    assert download_ptf.retry_after(Response('100000')) == 300
+    assert download_ptf.retry_after(
+        Response('Wed, 21 Oct 2015 07:28:00 GMT')) == 0
+    assert download_ptf.retry_after(Response('soon')) is None
+
+
+def test_rate_limiter_spaces_requests():
+    async def timed_waits():
+        limiter = download_ptf.RateLimiter(rate=50)
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        await asyncio.gather(*[limiter.wait() for i in range(5)])
+        return loop.time() - start
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(timed_waits()) >= 4 / 50 * 0.9
+    finally:
+        loop.close()
@@ -0,0 +1,47 @@
+from skyportal import fanout
+
+
+class Loader:
+    def __init__(self, users):
+        self.users = users
+        self.calls = []
+
+    def __call__(self, source_ids):
+        self.calls.append(source_ids)
+        return {source_id: self.users.get(source_id, set())
+                for source_id in source_ids}
+
+
+def test_membership_index_caches_users():
+    load = Loader({'a': {1, 2}, 'b': {2}})
+    index = fanout.MembershipIndex(load=load)
+    assert index.users(['a']) == {'a': frozenset({1, 2})}
+    assert index.users(['a', 'b', 'c']) == {'a': frozenset({1, 2}),
+                                            'b': frozenset({2}),
+                                            'c': frozenset()}
+    assert load.calls == [['a'], ['b', 'c']]
+
+    load.users['a'] = {3}
+    index.invalidate(['a'])
+    assert index.users(['a', 'b']) == {'a': frozenset({3}),
+                                       'b': frozenset({2})}
+    assert load.calls[-1] == ['a']
+
+
+def test_membership_index_expiry_and_size():
+    load = Loader({})
+    index = fanout.MembershipIndex(ttl=0, load=load)
+    index.users(['a'])
+    index.users(['a'])
+    assert len(load.calls) == 2
+
+    index = fanout.MembershipIndex(max_size=2, load=load)
+    index.users(['a', 'b'])
+    index.users(['a', 'c'])
+    assert list(index.entries) == ['a', 'c']
+
+
+def test_source_users(user, public_source, private_source):
+    users = fanout.source_users([public_source.id, private_source.id])
+    assert user.id in users[public_source.id]
+    assert users[private_source.id] == set()
@@ -0,0 +1,11 @@
+import subprocess
+import sys
+
+
+def test_app_server_does_not_import_heavy_modules():
+    code = ('import sys, skyportal.app_server; '
+            'print(sorted(m for m in ("bokeh", "astropy.time", "pandas") '
+            'if m in sys.modules))')
+    result = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True)
+    assert result.stdout.strip().splitlines()[-1] == '[]'
@@ -0,0 +1,54 @@
+import requests
+
+from skyportal import metrics
+from skyportal.tests import api, cfg
+
+
+def test_histogram_exposition():
+    histogram = metrics.Histogram('test_latency_seconds', 'Test latency',
+                                  ('handler',), buckets=(0.1, 1))
+    for value in [0.05, 0.5, 5]:
+        histogram.observe(value, handler='SourceHandler')
+    lines = histogram.expose().split('\n')
+    assert lines[:2] == ['# HELP test_latency_seconds Test latency',
+                         '# TYPE test_latency_seconds histogram']
+    assert lines[2:] == [
+        'test_latency_seconds_bucket{handler="SourceHandler",le="0.1"} 1',
+        'test_latency_seconds_bucket{handler="SourceHandler",le="1"} 2',
+        'test_latency_seconds_bucket{handler="SourceHandler",le="+Inf"} 3',
+        'test_latency_seconds_sum{handler="SourceHandler"} 5.55',
+        'test_latency_seconds_count{handler="SourceHandler"} 3']
+    metrics.REGISTRY.remove(histogram)
+
+
+def test_label_values_escaped():
+    counter = metrics.Counter('test_requests_total', 'Test requests',
+                              ('path',))
+    counter.inc(path='a"b\\c\nd')
+    assert counter.expose().split('\n')[-1] == (
+        'test_requests_total{path="a\\"b\\\\c\\nd"} 1')
+    metrics.REGISTRY.remove(counter)
+
+
+def test_gauge_registered_once():
+    for value in (1, 2):
+        metrics.Gauge('test_queue_depth', 'Test queue depth', lambda: value)
+    gauges = [m for m in metrics.REGISTRY if m.name == 'test_queue_depth']
+    assert len(gauges) == 1
+    assert metrics.expose().count('# TYPE test_queue_depth gauge') == 1
+    metrics.REGISTRY.remove(gauges[0])
+
+
+def test_metrics_endpoint(token, public_source):
+    status, data = api('GET', f'sources/{public_source.id}', token=token)
+    assert status == 200
+
+    response = requests.get(f'http://localhost:{cfg["ports:app"]}'
+                            '/api/internal/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain')
+    text = response.text
+    assert ('skyportal_http_requests_total{handler="SourceHandler",'
+            'method="GET",status="200"}') in text
+    assert 'skyportal_http_request_queries_bucket{handler="SourceHandler"' in text
+    assert 'skyportal_db_pool_connections{state="checked_out"}' in text
@@ -0,0 +1,54 @@
+from skyportal import deltas, metrics
+from skyportal.outbox import CoalescingOutbox
+
+
+def delta(version):
+    return {'source_id': 'a', 'version': version, 'entity': 'comment',
+            'op': 'created', 'data': [{'id': version}]}
+
+
+def make_outbox(**kwargs):
+    sent = []
+    outbox = CoalescingOutbox(lambda *message: sent.append(message),
+                              merge={deltas.SOURCE_DELTA: deltas.merge},
+                              **kwargs)
+    return outbox, sent
+
+
+def test_coalesce():
+    outbox, sent = make_outbox()
+    for version in (1, 2, 3):
+        outbox.push(1, deltas.SOURCE_DELTA, delta(version))
+        outbox.push(1, 'skyportal/REFRESH_SOURCE', {'source_id': 'a'})
+    outbox.push(1, 'skyportal/REFRESH_GROUP', {'group_id': 1})
+    outbox.push(1, 'skyportal/REFRESH_GROUP', {'group_id': 2})
+    outbox.push(2, 'skyportal/REFRESH_GROUP', {'group_id': 1})
+    assert outbox.depth() == (5, 4)
+    assert sent == []
+
+    outbox.flush()
+    assert outbox.depth() == (0, 0)
+    assert sent[0] == (1, deltas.SOURCE_DELTA,
+                       {'source_id': 'a', 'version': 3,
+                        'deltas': [delta(1), delta(2), delta(3)]})
+    assert sent[1:] == [
+        (1, 'skyportal/REFRESH_SOURCE', {'source_id': 'a'}),
+        (1, 'skyportal/REFRESH_GROUP', {'group_id': 1}),
+        (1, 'skyportal/REFRESH_GROUP', {'group_id': 2}),
+        (2, 'skyportal/REFRESH_GROUP', {'group_id': 1})]
+
+
+def test_full_queue_evicts_oldest():
+    outbox, sent = make_outbox(max_size=2)
+    evicted = metrics.WEBSOCKET_EVICTED.values.get(('action',), 0)
+    for source_id in ('a', 'b', 'c'):
+        outbox.push(1, 'action', {'source_id': source_id})
+    outbox.flush()
+    assert [payload['source_id'] for _, _, payload in sent] == ['b', 'c']
+    assert metrics.WEBSOCKET_EVICTED.values[('action',)] == evicted + 1
+
+
+def test_no_window():
+    outbox, sent = make_outbox(window=0)
+    outbox.push('*', 'action', {})
+    assert sent == [('*', 'action', {})]
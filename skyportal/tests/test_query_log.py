@@ -0,0 +1,32 @@
+from skyportal import query_log
+from skyportal.models import DBSession, Source
+
+
+def test_normalize():
+    assert (query_log.normalize(
+        "SELECT * FROM sources\n  WHERE id = 'abc' AND ra > 1.5e3 "
+        "AND dec IN (%(p1)s, %(p2)s, %(p3)s) LIMIT %(param_1)s") ==
+        "SELECT * FROM sources WHERE id = ? AND ra > ? AND dec IN (?) LIMIT ?")
+    assert query_log.normalize('SELECT anon_1.id FROM t1 AS anon_1') == \
+        'SELECT anon_1.id FROM t1 AS anon_1'
+
+
+def test_repeated_statements_are_attributed(public_group):
+    sources = [Source(id=f'query-log-{public_group.id}-{i}', ra=i, dec=i)
+               for i in range(6)]
+    DBSession().add_all(sources)
+    DBSession().commit()
+    DBSession().expire_all()
+
+    with query_log.record() as log:
+        for source in sources:
+            source.ra  # lazy refresh of each expired object: N+1
+    [(shape, n, sites)] = log.repeated(threshold=5)
+    assert n == 6
+    assert shape.startswith('SELECT sources.')
+    assert 'tests/test_query_log.py' in sites[0]
+    assert '6x' in log.report()
+
+    for source in sources:
+        DBSession().delete(source)
+    DBSession().commit()
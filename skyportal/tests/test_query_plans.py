@@ -0,0 +1,81 @@
+"""Snapshot the query plans of key queries.
+
+The plan shape (node types, tables and indexes) of each query is compared to
+the snapshot in `data/plans/<name>.txt`.  After an intentional change (new
+index, rewritten query), or to add a query, regenerate the snapshots with
+`UPDATE_PLAN_SNAPSHOTS=1` and commit the diff; a missing snapshot is
+otherwise an error.
+
+The test database is tiny, so the planner would happily pick sequential
+scans everywhere; plans are therefore taken with `enable_seqscan = off`,
+which makes a sequential scan show up only when no index can serve the
+query.
+"""
+
+import os
+
+from sqlalchemy.dialects import postgresql
+import pytest
+
+from skyportal.models import DBSession, Group, Photometry, Source
+from skyportal.slow_query_log import explain, plan_shape
+
+
+PLAN_DIR = os.path.join(os.path.dirname(__file__), 'data', 'plans')
+
+
+def plan_of(query):
+    compiled = query.statement.compile(dialect=postgresql.dialect())
+    connection = DBSession().connection().connection
+    plan = explain(connection, str(compiled), compiled.params,
+                   analyze=False, settings=['enable_seqscan = off'])
+    return plan_shape(plan)
+
+
+def check_snapshot(name, shape):
+    path = os.path.join(PLAN_DIR, f'{name}.txt')
+    plan = '\n'.join(shape) + '\n'
+    if os.environ.get('UPDATE_PLAN_SNAPSHOTS') == '1':
+        os.makedirs(PLAN_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(plan)
+        return
+    assert os.path.exists(path), (f'No query plan snapshot for {name} (set '
+                                  f'UPDATE_PLAN_SNAPSHOTS=1 to write it):\n'
+                                  f'{plan}')
+    with open(path) as f:
+        expected = f.read()
+    assert plan == expected, (f'Query plan of {name} changed (set '
+                              f'UPDATE_PLAN_SNAPSHOTS=1 if intended):\n'
+                              f'{plan}\nexpected:\n{expected}')
+
+
+@pytest.mark.parametrize('name', ['user_sources', 'photometry_by_source',
+                                  'user_groups'])
+def test_query_plans(name, user, public_source):
+    queries = {
+        'user_sources': DBSession().query(Source).with_parent(user, 'sources'),
+        'photometry_by_source': DBSession().query(Photometry).filter(
+            Photometry.source_id == public_source.id),
+        'user_groups': DBSession().query(Group).with_parent(user, 'groups'),
+    }
+    shape = plan_of(queries[name])
+    check_snapshot(name, shape)
+
+
+def test_photometry_by_source_uses_index(public_source):
+    shape = plan_of(DBSession().query(Photometry).filter(
+        Photometry.source_id == public_source.id))
+    assert not any('Seq Scan on photometry' in line for line in shape), \
+        '\n'.join(shape)
+
+
+def test_plan_shape():
+    plan = {'Node Type': 'Nested Loop', 'Total Cost': 12.3, 'Plans': [
+        {'Node Type': 'Index Scan', 'Relation Name': 'photometry',
+         'Index Name': 'ix_photometry_source_id', 'Plan Rows': 10},
+        {'Node Type': 'Seq Scan', 'Relation Name': 'sources'}]}
+    assert plan_shape(plan) == [
+        'Nested Loop',
+        '  Index Scan on photometry using ix_photometry_source_id',
+        '  Seq Scan on sources']
@@ -0,0 +1,45 @@
+import datetime
+import json
+
+import numpy as np
+from sqlalchemy.orm import joinedload
+
+from skyportal import serialize
+from skyportal.models import DBSession, Photometry, Source
+
+
+def test_loaded_attributes_only(public_source):
+    DBSession().expire_all()
+    source = (Source.query.options(joinedload(Source.photometry))
+              .get(public_source.id))
+    data = json.loads(serialize.to_json(source))
+    assert data['id'] == public_source.id
+    assert len(data['photometry']) == 20
+    assert {'mag', 'e_mag', 'observed_at', 'filter'} <= \
+        set(data['photometry'][0])
+    assert 'comments' not in data  # not loaded
+    assert not any(key.startswith('_') for key in data)
+
+
+def test_numpy_nan_and_datetimes():
+    observed_at = datetime.datetime(2019, 1, 2, 3, 4, 5)
+    photometry = Photometry(mag=np.float32(19.5), e_mag=float('nan'),
+                            observed_at=observed_at)
+    data = json.loads(serialize.to_json({
+        'photometry': [photometry], 'spectrum': np.arange(3.),
+        'count': np.int64(3)}))
+    assert data['photometry'][0]['mag'] == 19.5
+    assert data['photometry'][0]['e_mag'] is None
+    assert data['photometry'][0]['observed_at'] == observed_at.isoformat()
+    assert data['spectrum'] == [0., 1., 2.]
+    assert data['count'] == 3
+
+
+def test_expired_after_commit(public_source):
+    photometry = Photometry.query.filter(
+        Photometry.source_id == public_source.id).first()
+    DBSession().commit()  # expires all instances
+    data = json.loads(serialize.to_json(photometry))
+    assert data['id'] == photometry.id
+    assert data['source_id'] == public_source.id
+    assert {'mag', 'e_mag', 'observed_at', 'filter'} <= set(data)
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pytest
+
+from skyportal import spectrum_io
+from skyportal.tests.fixtures import TMP_DIR
+
+
+def test_parse_ascii_whitespace_and_comments():
+    wavelengths, fluxes, errors = spectrum_io.parse_ascii(
+        b"# A comment\n3000 1.5\n\n  # indented comment\n3001\t1.6\n")
+    np.testing.assert_allclose(wavelengths, [3000, 3001])
+    np.testing.assert_allclose(fluxes, [1.5, 1.6])
+    assert errors is None
+
+
+def test_parse_ascii_csv_with_header_and_errors():
+    wavelengths, fluxes, errors = spectrum_io.parse_ascii(
+        "wavelength,flux,flux_err\n3000,1.5,0.1\n3001,1.6,0.2\n")
+    np.testing.assert_allclose(errors, [0.1, 0.2])
+
+
+def test_parse_ascii_ivar():
+    wavelengths, fluxes, errors = spectrum_io.parse_ascii(
+        b"wavelength flux ivar\n3000 1 4\n3001 1 0.25\n")
+    np.testing.assert_allclose(errors, [0.5, 2])
+
+
+def test_parse_ascii_header_selects_columns():
+    spec_file = os.path.join(os.path.dirname(__file__), 'data', 'spec.csv')
+    wavelengths, fluxes, errors = spectrum_io.read_ascii(spec_file)
+    assert errors is None  # `instrument_id` column is ignored
+    assert len(wavelengths) == len(fluxes) > 0
+
+
+def test_parse_ascii_rejects_bad_data():
+    with pytest.raises(ValueError):
+        spectrum_io.parse_ascii("3000 1.5\n3001 oops\n")
+    with pytest.raises(ValueError):
+        spectrum_io.parse_ascii("1 2 3 4\n")
+
+
+def test_read_fits_table_and_image():
+    from astropy.io import fits
+
+    wavelengths = np.linspace(3000, 9000, 100)
+    fluxes = np.random.random(100)
+
+    table_file = os.path.join(TMP_DIR, 'spec_table.fits')
+    fits.BinTableHDU.from_columns([
+        fits.Column(name='WAVE', format='D', array=wavelengths),
+        fits.Column(name='FLUX', format='D', array=fluxes),
+        fits.Column(name='IVAR', format='D', array=np.full(100, 4.))
+    ]).writeto(table_file, overwrite=True)
+    assert spectrum_io.detect_format(table_file) == 'fits'
+    w, f, e = spectrum_io.read_spectrum(table_file)
+    np.testing.assert_allclose(w, wavelengths)
+    np.testing.assert_allclose(e, 0.5)
+
+    image_file = os.path.join(TMP_DIR, 'spec_image.fits')
+    hdu = fits.PrimaryHDU(fluxes)
+    hdu.header.update(CRVAL1=3000., CDELT1=2., CRPIX1=1.)
+    hdu.writeto(image_file, overwrite=True)
+    w, f, e = spectrum_io.read_spectrum(image_file)
+    np.testing.assert_allclose(w[:3], [3000, 3002, 3004])
+    np.testing.assert_allclose(f, fluxes)
+    assert e is None
@@ -0,0 +1,46 @@
+import uuid
+
+import numpy as np
+
+from skyportal import synthetic
+from skyportal.models import DBSession, Source
+from skyportal.tests.fixtures import InstrumentFactory
+
+
+def test_generated_distributions():
+    rng = np.random.default_rng(0)
+    sources = synthetic.generate_sources(10000, rng)
+    assert sources['id'].is_unique
+    assert sources['ra'].between(0, 360).all()
+    # Uniform on the sphere: mean |dec| is 90 - 180 / pi ~ 32.7 deg
+    assert abs(np.abs(sources['dec']).mean() - 32.7) < 1
+    assert sources['red_shift'].between(0, 0.15).all()
+
+    photometry = synthetic.generate_photometry(sources, rng, [1, 2],
+                                               mean_epochs=20)
+    assert abs(len(photometry) / len(sources) - 20) < 1
+    assert set(photometry['filter']) == {'g', 'r', 'i'}
+    detected = photometry['mag'].notnull()
+    assert 0 < detected.mean() < 1
+    assert (photometry['mag'][detected] < photometry['lim_mag'][detected]).all()
+    assert photometry.groupby('source_id')['observed_at'].is_monotonic_increasing.all()
+
+    spectra = synthetic.generate_spectra(sources, rng, [1, 2], fraction=0.1)
+    assert 0.1 < len(spectra) / len(sources) < 0.2
+    assert spectra['fluxes'].map(len).eq(len(spectra['wavelengths'].iloc[0])).all()
+
+
+def test_load(public_group):
+    instrument = InstrumentFactory()
+    prefix = f'synth-{uuid.uuid4().hex[:8]}-'
+    counts = synthetic.load(25, [public_group.id], [instrument.id], seed=1,
+                            chunk_size=10, prefix=prefix, mean_epochs=5)
+    assert counts['sources'] == 25
+
+    sources = Source.query.filter(Source.id.like(f'{prefix}%')).all()
+    assert len(sources) == 25
+    assert all(s.groups == [public_group] for s in sources)
+    assert sum(len(s.photometry) for s in sources) == counts['photometry']
+    assert sum(len(s.spectra) for s in sources) == counts['spectra']
+    assert synthetic.next_offset(prefix) == 25
+    DBSession().rollback()
@@ -0,0 +1,74 @@
+import json
+import time
+
+import sqlalchemy as sa
+
+from skyportal import tracing
+
+
+def read_spans(path, n, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if path.exists():
+            spans = [json.loads(line) for line in path.read_text().splitlines()]
+            if len(spans) >= n:
+                return spans
+        time.sleep(0.05)
+    raise AssertionError(f'Expected {n} spans in {path}')
+
+
+def test_trace_spans_are_nested_and_exported(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    tracing.configure(sample_rate=1, exporter='file', path=str(path))
+    engine = sa.create_engine('sqlite://')
+    try:
+        root = tracing.start_trace('GET SourceHandler', **{'http.target': '/'})
+        with tracing.span('serialize') as serialize:
+            engine.execute(sa.text('SELECT :x'), x=1)
+        tracing.finish_trace(root, **{'http.status_code': 200})
+
+        spans = {s['name']: s for s in read_spans(path, 3)}
+        assert set(spans) == {'GET SourceHandler', 'serialize', 'sql'}
+        assert len({s['trace_id'] for s in spans.values()}) == 1
+        assert spans['GET SourceHandler']['kind'] == 'server'
+        assert spans['GET SourceHandler']['attributes']['http.status_code'] == 200
+        assert spans['serialize']['parent_id'] == root.span_id
+        assert spans['sql']['parent_id'] == serialize.span_id
+        assert spans['sql']['attributes']['db.statement'] == 'SELECT ?'
+    finally:
+        tracing.configure(sample_rate=0)
+
+
+def test_traceparent_and_sampling(tmp_path):
+    tracing.configure(sample_rate=0)
+    assert tracing.start_trace('GET', None) is None
+    with tracing.span('noop') as span:
+        assert span is None
+
+    trace_id, parent_id = 'ab' * 16, 'cd' * 8
+    tracing.configure(sample_rate=1, path=str(tmp_path / 'traces.jsonl'))
+    try:
+        root = tracing.start_trace('GET', f'00-{trace_id}-{parent_id}-01')
+        assert root.trace.trace_id == trace_id
+        assert root.parent_id == parent_id
+        assert tracing.current_trace_id() == trace_id
+        tracing.finish_trace(root)
+        assert tracing.start_trace('GET', f'00-{trace_id}-{parent_id}-00') is None
+    finally:
+        tracing.configure(sample_rate=0)
+
+    # Clients cannot force a request to be traced
+    tracing.configure(sample_rate=1e-9, path=str(tmp_path / 'traces.jsonl'))
+    try:
+        assert tracing.start_trace('GET', f'00-{trace_id}-{parent_id}-01') is None
+    finally:
+        tracing.configure(sample_rate=0)
+
+
+def test_otlp_attributes():
+    assert tracing.OTLPExporter._attributes(
+        {'ok': True, 'n': 3, 'ms': 1.5, 'path': '/api'}) == [
+            {'key': 'ok', 'value': {'boolValue': True}},
+            {'key': 'n', 'value': {'intValue': '3'}},
+            {'key': 'ms', 'value': {'doubleValue': 1.5}},
+            {'key': 'path', 'value': {'stringValue': '/api'}}]
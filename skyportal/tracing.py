@@ -0,0 +1,281 @@
+"""Lightweight, sampled request tracing.
+
+A trace is started for a sampled fraction (`tracing:sample_rate`) of
+requests.  While a request is being handled, the current span is kept in a
+context variable, and nested spans are recorded for each SQL statement,
+serialization of the response (`BaseHandler.success`), websocket pushes and
+any code wrapped in `span(...)`:
+
+    with tracing.span('bokeh', source_id=source_id):
+        ...
+
+Unsampled requests pay only for a context variable lookup per span.
+Finished traces are exported from a background thread, either appended to a
+JSON lines file (`tracing:exporter: file`) or posted to an OpenTelemetry
+collector in the OTLP/HTTP JSON format (`tracing:exporter: otlp`).
+Incoming W3C `traceparent` headers are honored, so that traces can be
+continued from an upstream proxy or client; the sampling decision is still
+made locally, so that clients cannot force requests to be traced.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+
+import sqlalchemy as sa
+
+from .query_log import normalize
+
+
+log = logging.getLogger('skyportal.tracing')
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start', 'end',
+                 'attributes', 'error', 'kind')
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+        self.kind = 'internal'
+
+    def finish(self, error=None):
+        self.end = time.time_ns()
+        self.error = error
+        self.trace.spans.append(self)
+
+    def to_dict(self):
+        return {'trace_id': self.trace.trace_id, 'span_id': self.span_id,
+                'parent_id': self.parent_id, 'name': self.name,
+                'start': self.start, 'end': self.end,
+                'duration_ms': (self.end - self.start) / 1e6,
+                'kind': self.kind, 'attributes': self.attributes,
+                'error': self.error}
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.spans = []
+
+
+class FileExporter:
+    """Append spans as JSON lines to a file."""
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, spans):
+        with open(self.path, 'a') as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str) + '\n')
+
+
+class OTLPExporter:
+    """Post spans to an OpenTelemetry collector (OTLP/HTTP, JSON encoding)."""
+    def __init__(self, endpoint, service_name='skyportal', timeout=5):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    @staticmethod
+    def _value(v):
+        # bool is a subclass of int
+        if isinstance(v, bool):
+            return {'boolValue': v}
+        elif isinstance(v, int):
+            return {'intValue': str(v)}
+        elif isinstance(v, float):
+            return {'doubleValue': v}
+        return {'stringValue': str(v)}
+
+    @classmethod
+    def _attributes(cls, attributes):
+        return [{'key': k, 'value': cls._value(v)}
+                for k, v in attributes.items()]
+
+    def export(self, spans):
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': self._attributes(
+                {'service.name': self.service_name})},
+            'scopeSpans': [{
+                'scope': {'name': 'skyportal.tracing'},
+                'spans': [{
+                    'traceId': span.trace.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent_id or '',
+                    'name': span.name,
+                    'kind': 2 if span.kind == 'server' else 1,
+                    'startTimeUnixNano': str(span.start),
+                    'endTimeUnixNano': str(span.end),
+                    'attributes': self._attributes(span.attributes),
+                    'status': ({'code': 2, 'message': span.error}
+                               if span.error else {'code': 0})
+                } for span in spans]
+            }]
+        }]}
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(request, timeout=self.timeout).close()
+
+
+class Tracer:
+    """Makes sampling decisions and exports finished traces in the
+    background, in batches."""
+    def __init__(self, sample_rate=0., exporter=None, max_queue=10000,
+                 batch_size=512, interval=1.):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue(max_queue)
+        if exporter is not None:
+            threading.Thread(target=self._export_loop, daemon=True).start()
+
+    def sample(self):
+        return self.exporter is not None and random.random() < self.sample_rate
+
+    def submit(self, trace):
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            pass  # drop traces rather than slow down requests
+
+    def _export_loop(self):
+        while True:
+            spans = []
+            deadline = time.monotonic() + self.interval
+            while len(spans) < self.batch_size:
+                try:
+                    trace = self.queue.get(
+                        timeout=max(deadline - time.monotonic(), 0.01))
+                except queue.Empty:
+                    break
+                spans.extend(trace.spans)
+            if spans:
+                try:
+                    self.exporter.export(spans)
+                except Exception as e:
+                    log.warning('Could not export %d spans: %s',
+                                len(spans), e)
+
+
+_tracer = Tracer()
+_current_span = contextvars.ContextVar('skyportal_span', default=None)
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+def configure(sample_rate=0., exporter='file', path='log/traces.jsonl',
+              otlp_endpoint='http://localhost:4318/v1/traces'):
+    """Set up tracing; called once by `make_app`."""
+    global _tracer
+    if not sample_rate:
+        _tracer = Tracer()
+        return
+    if exporter == 'otlp':
+        exporter = OTLPExporter(otlp_endpoint)
+    else:
+        exporter = FileExporter(path)
+    _tracer = Tracer(sample_rate, exporter)
+    if not sa.event.contains(sa.engine.Engine, 'before_cursor_execute',
+                             _before_cursor_execute):
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute',
+                        _before_cursor_execute)
+        sa.event.listen(sa.engine.Engine, 'after_cursor_execute',
+                        _after_cursor_execute)
+        sa.event.listen(sa.engine.Engine, 'handle_error', _handle_error)
+
+
+def start_trace(name, traceparent=None, **attributes):
+    """Start the root span of a request, if it is sampled.
+
+    Requests are sampled at the configured rate.  A sampled request with a
+    valid `traceparent` header continues the caller's trace, unless the
+    caller did not sample it.  Returns the span or None.
+    """
+    match = TRACEPARENT.match(traceparent or '')
+    if match and not int(match.group(3), 16) & 1:
+        return None
+    if not _tracer.sample():
+        return None
+    if match:
+        root = Span(Trace(match.group(1)), name, match.group(2), attributes)
+    else:
+        root = Span(Trace(), name, None, attributes)
+    root.kind = 'server'
+    _current_span.set(root)
+    return root
+
+
+def finish_trace(root, **attributes):
+    _current_span.set(None)
+    root.attributes.update(attributes)
+    root.finish()
+    _tracer.submit(root.trace)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Record a child span of the current span, if the request is sampled."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.finish(error=repr(e))
+        raise
+    else:
+        child.finish()
+    finally:
+        _current_span.reset(token)
+
+
+def current_trace_id():
+    current = _current_span.get()
+    return current.trace.trace_id if current is not None else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    parent = _current_span.get()
+    if parent is not None:
+        conn.info.setdefault('skyportal_spans', []).append(
+            Span(parent.trace, 'sql', parent.span_id,
+                 {'db.statement': normalize(statement)[:1000]}))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    spans = conn.info.get('skyportal_spans')
+    if spans:
+        current = spans.pop()
+        if cursor.rowcount >= 0:
+            current.attributes['db.rows'] = cursor.rowcount
+        current.finish()
+
+
+def _handle_error(context):
+    spans = context.connection.info.get('skyportal_spans') \
+        if context.connection is not None else None
+    if spans:
+        spans.pop().finish(error=repr(context.original_exception))
@@ -0,0 +1,89 @@
+"""Cheap version stamps of API resources, for conditional requests.
+
+A resource (e.g. a source with its comments, photometry and spectra) is
+made of rows of several tables.  Its version is derived from the number of
+rows and the latest `modified` timestamp of each of those tables, computed
+in a single aggregate query; counting rows catches deletions, which leave
+no timestamp behind.  Handlers compare the resulting ETag with the client's
+`If-None-Match` header (see `BaseHandler.is_current`) and answer 304 Not
+Modified without loading or serializing the resource.
+"""
+
+from collections import namedtuple
+import hashlib
+
+import sqlalchemy as sa
+
+from . import __version__
+from .models import (DBSession, Comment, Group, GroupSource, GroupUser,
+                     Photometry, Source, Spectrum, Thumbnail, User)
+
+
+Version = namedtuple('Version', ['etag', 'modified'])
+
+
+def stamp(parts, *extra):
+    """Version of the rows of `parts`, a list of `(model, criterion)` pairs.
+
+    `extra` values (e.g. the user a listing is specific to) are included in
+    the ETag.
+    """
+    columns = []
+    for model, criterion in parts:
+        table = model.__table__
+        columns.append(sa.select([sa.func.count()]).select_from(table)
+                       .where(criterion).as_scalar())
+        columns.append(sa.select([sa.func.max(table.c.modified)])
+                       .where(criterion).as_scalar())
+    row = tuple(DBSession().execute(sa.select(columns)).first())
+    modified = max((m for m in row[1::2] if m is not None), default=None)
+    etag = hashlib.sha1(repr((__version__, row, extra)).encode()).hexdigest()
+    return Version(etag, modified)
+
+
+def _source_photometry(source_id):
+    return sa.select([Photometry.id]).where(Photometry.source_id == source_id)
+
+
+def source_version(source_id):
+    """A source with its groups, comments, photometry, spectra and
+    thumbnails."""
+    return stamp([
+        (Source, Source.id == source_id),
+        (GroupSource, GroupSource.source_id == source_id),
+        (Comment, Comment.source_id == source_id),
+        (Photometry, Photometry.source_id == source_id),
+        (Spectrum, Spectrum.source_id == source_id),
+        (Thumbnail, Thumbnail.photometry_id.in_(
+            _source_photometry(source_id))),
+    ])
+
+
+def photometry_plot_version(source_id):
+    return stamp([(Photometry, Photometry.source_id == source_id)], 'plot')
+
+
+def spectroscopy_plot_version(source_id):
+    return stamp([(Spectrum, Spectrum.source_id == source_id)], 'plot')
+
+
+def group_version(group_id):
+    """A group with its members."""
+    return stamp([
+        (Group, Group.id == group_id),
+        (GroupUser, GroupUser.group_id == group_id),
+        (User, User.id.in_(sa.select([GroupUser.user_id])
+                           .where(GroupUser.group_id == group_id))),
+    ])
+
+
+def group_listing_version(user, all_groups):
+    """The groups of `user` and, if `all_groups`, all groups."""
+    return stamp([
+        (Group, sa.true()),
+        (GroupUser, GroupUser.user_id == user.id),
+    ], type(user).__name__, user.id, all_groups)
+
+
+def comment_version(comment_id):
+    return stamp([(Comment, Comment.id == comment_id)])
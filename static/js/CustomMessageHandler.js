@@ -19,6 +19,23 @@ const CustomMessageHandler = (dispatch, getState) => (
         }
         break;
       }
+      case Action.SOURCE_DELTA: {
+        const { source } = getState();
+        if (source && source.id === payload.source_id &&
+            !(source.version >= payload.version)) {
+          // Deltas coalesced by the server arrive together, in order
+          const deltas = (payload.deltas || [payload]).filter(
+            delta => !(delta.version <= source.version)
+          );
+          if (deltas.every((delta, i) => delta.version === source.version + 1 + i)) {
+            deltas.forEach(delta => dispatch({ type: Action.SOURCE_DELTA, delta }));
+          } else {
+            // Missed an update: fall back to refetching the source
+            dispatch(Action.fetchSource(payload.source_id));
+          }
+        }
+        break;
+      }
       case Action.REFRESH_GROUP: {
         const state = getState();
         const loaded_group_id = state.group ? state.group.id : null;
@@ -1,9 +1,12 @@
+import { showNotification } from 'baselayer/components/Notifications';
+
 import * as API from './API';
 
 export const FETCH_SOURCES = 'skyportal/FETCH_SOURCES';
 export const FETCH_SOURCES_OK = 'skyportal/FETCH_SOURCES_OK';
 
 export const REFRESH_SOURCE = 'skyportal/REFRESH_SOURCE';
+export const SOURCE_DELTA = 'skyportal/SOURCE_DELTA';
 export const REFRESH_GROUP = 'skyportal/REFRESH_GROUP';
 
 export const FETCH_LOADED_SOURCE = 'skyportal/FETCH_LOADED_SOURCE';
@@ -96,26 +99,34 @@ export function rotateLogo() {
 }
 
 export function addComment(form) {
-  function fileReaderPromise(file) {
-    return new Promise((resolve) => {
-      const filereader = new FileReader();
-      filereader.readAsDataURL(file);
-      filereader.onloadend = () => resolve(
-        { body: filereader.result, name: file.name }
-      );
-    });
-  }
-  if (form.attachment) {
-    return (dispatch) => {
-      fileReaderPromise(form.attachment)
-        .then(fileData => {
-          form.attachment = fileData;
-          dispatch(API.POST(`/api/comment`, ADD_COMMENT, form));
-        });
-    };
-  } else {
-    return API.POST(`/api/comment`, ADD_COMMENT, form);
+  const { attachment, ...comment } = form;
+  if (!attachment) {
+    return API.POST(`/api/comment`, ADD_COMMENT, comment);
   }
+  return async (dispatch) => {
+    const data = await dispatch(API.POST(`/api/comment`, ADD_COMMENT, comment));
+    if (data && data.comment_id) {
+      // The file is sent as the raw request body, which the server streams
+      // to storage instead of buffering
+      const name = encodeURIComponent(attachment.name);
+      const response = await fetch(
+        `/api/comment/${data.comment_id}/attachment?name=${name}`,
+        {
+          method: 'PUT',
+          credentials: 'same-origin',
+          headers: {
+            'Content-Type': attachment.type || 'application/octet-stream'
+          },
+          body: attachment
+        }
+      );
+      if (response.status !== 200) {
+        dispatch(showNotification(
+          `Could not upload attachment (${response.status})`, 'error'
+        ));
+      }
+    }
+  };
 }
 
 export function addNewGroup(form_data) {
@@ -8,8 +8,7 @@ import CommentEntry from './CommentEntry';
 
 const CommentList = ({ source_id, comments, addComment }) => {
   comments = comments || [];
-  const items = comments.map(({ id, user, created_at, text, attachment_name,
-                                attachment_bytes }) => {
+  const items = comments.map(({ id, user, created_at, text, attachment_name }) => {
     const [username, domain] = user.username.split('@', 2);
     return (
       <span key={id} className={styles.comment}>
@@ -20,11 +20,37 @@ export function sourceReducer(state={ source: null, loadError: false }, action)
         ...state,
         loadError: true
       };
+    case Action.SOURCE_DELTA:
+      return applySourceDelta(state, action.delta);
     default:
       return state;
   }
 }
 
+const DELTA_KEYS = { comment: 'comments', photometry: 'photometry', spectrum: 'spectra' };
+
+// Apply an incremental update pushed by the server (see skyportal/deltas.py)
+export function applySourceDelta(state, { version, entity, op, data }) {
+  const key = DELTA_KEYS[entity];
+  const items = state[key] || [];
+  const changed = new Map(data.map(item => [item.id, item]));
+  let updated;
+  if (op === 'created') {
+    updated = [...items.filter(item => !changed.has(item.id)), ...data];
+  } else if (op === 'updated') {
+    updated = items.map(item => (
+      changed.has(item.id) ? { ...item, ...changed.get(item.id) } : item
+    ));
+  } else {
+    updated = items.filter(item => !changed.has(item.id));
+  }
+  return {
+    ...state,
+    version,
+    [key]: updated
+  };
+}
+
 export function sourcesReducer(state={ latest: null }, action) {
   switch (action.type) {
     case Action.FETCH_SOURCES_OK: {
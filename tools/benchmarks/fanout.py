@@ -0,0 +1,168 @@
+"""Compare broadcasting messages about sources to every websocket client
+with pushing them only to the users who can see the source (see
+`skyportal.fanout`).
+
+An in-process websocket server routes messages to the connections of a
+user, or to all connections, as baselayer's websocket server does (without
+the message queue in front of it), and thousands of clients, each a user in
+a few of the groups, connect to it.  Each event is a comment delta on a
+random source belonging to one group.  No database is needed: the users of
+each source are resolved by `MembershipIndex` from the synthetic groups.
+
+    PYTHONPATH=. python tools/benchmarks/fanout.py --clients 1000 5000
+"""
+import asyncio
+import collections
+import json
+import random
+import resource
+import time
+
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+import tornado.websocket
+
+from skyportal.fanout import MembershipIndex
+
+
+class Router:
+    def __init__(self):
+        self.connections = collections.defaultdict(set)
+
+    def push(self, user_id, message):
+        targets = (
+            [c for conns in self.connections.values() for c in conns]
+            if user_id == '*' else self.connections.get(user_id, ()))
+        for connection in targets:
+            connection.write_message(message)
+
+
+class SocketHandler(tornado.websocket.WebSocketHandler):
+    def initialize(self, router):
+        self.router = router
+
+    def open(self, user_id):
+        self.user_id = int(user_id)
+        self.router.connections[self.user_id].add(self)
+
+    def on_close(self):
+        self.router.connections[self.user_id].discard(self)
+
+
+class Clients:
+    def __init__(self):
+        self.received = self.bytes = 0
+        self.expected = None
+        self.done = asyncio.Event()
+
+    def on_message(self, message):
+        if message is None:
+            return
+        self.received += 1
+        self.bytes += len(message)
+        if self.received == self.expected:
+            self.done.set()
+
+    def reset(self, expected):
+        self.received = self.bytes = 0
+        self.expected = expected
+        self.done.clear()
+
+
+def make_groups(n_users, n_groups, n_sources, seed=0):
+    rng = random.Random(seed)
+    members = collections.defaultdict(set)
+    for user_id in range(n_users):
+        for group in rng.sample(range(n_groups), rng.randint(1, 3)):
+            members[group].add(user_id)
+    source_group = {f'bench{i}': rng.randrange(n_groups)
+                    for i in range(n_sources)}
+    return members, source_group
+
+
+def message(source_id, version):
+    return json.dumps({
+        'user_id': '*', 'action': 'skyportal/SOURCE_DELTA',
+        'payload': {'source_id': source_id, 'version': version,
+                    'entity': 'comment', 'op': 'created',
+                    'data': [{'id': version, 'source_id': source_id,
+                              'text': 'Looks like a SN Ia ' * 5,
+                              'created_at': '2018-01-01T00:00:00',
+                              'attachment_name': None,
+                              'user': {'username': 'bench@skyportal'}}]}})
+
+
+async def run(n_clients, n_groups, n_events):
+    router = Router()
+    app = tornado.web.Application([(r'/(\d+)', SocketHandler,
+                                    {'router': router})])
+    server = tornado.httpserver.HTTPServer(app)
+    [sock] = tornado.netutil.bind_sockets(0, '127.0.0.1')
+    server.add_sockets([sock])
+    port = sock.getsockname()[1]
+
+    clients = Clients()
+    connections = await asyncio.gather(*[
+        tornado.websocket.websocket_connect(
+            f'ws://127.0.0.1:{port}/{user_id}',
+            on_message_callback=clients.on_message)
+        for user_id in range(n_clients)])
+
+    members, source_group = make_groups(n_clients, n_groups, 1000)
+    index = MembershipIndex(load=lambda ids: {
+        source_id: members[source_group[source_id]] for source_id in ids})
+    rng = random.Random(1)
+    events = [(rng.choice(list(source_group)), i) for i in range(n_events)]
+
+    results = {}
+    for mode in ('broadcast', 'targeted'):
+        index.invalidate()
+        resolve = 0
+        if mode == 'broadcast':
+            clients.reset(n_clients * n_events)
+        else:
+            clients.reset(sum(len(members[source_group[source_id]])
+                              for source_id, _ in events))
+        start = time.perf_counter()
+        for source_id, version in events:
+            if mode == 'broadcast':
+                router.push('*', message(source_id, version))
+            else:
+                t = time.perf_counter()
+                user_ids = index.users([source_id])[source_id]
+                resolve += time.perf_counter() - t
+                for user_id in user_ids:
+                    router.push(user_id, message(source_id, version))
+            await asyncio.sleep(0)
+        await clients.done.wait()
+        results[mode] = (time.perf_counter() - start, clients.received,
+                         clients.bytes, resolve)
+
+    for connection in connections:
+        connection.close()
+    server.stop()
+    return results
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+',
+                        default=[1000, 5000])
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--events', type=int, default=100)
+    args, _ = parser.parse_known_args()
+
+    # Each client uses two file descriptors (its socket and the server's)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    for n_clients in args.clients:
+        results = asyncio.run(run(n_clients, args.groups, args.events))
+        for mode, (elapsed, received, n_bytes, resolve) in results.items():
+            print(f'{n_clients:>6} clients, {mode:>9}: '
+                  f'{received:>8} messages, {n_bytes / 2**20:7.1f} MiB, '
+                  f'delivered in {elapsed:6.2f} s'
+                  + (f' (resolving users {1000 * resolve:.1f} ms)'
+                     if mode == 'targeted' else ''))
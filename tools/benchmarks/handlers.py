@@ -0,0 +1,267 @@
+"""Benchmark API handlers in-process, at several dataset scales.
+
+For each scale, a group with that many synthetic sources (see
+`skyportal.synthetic`) is created in the configured database, unless it
+already exists from a previous run.  The app is then started in this
+process and each benchmark case is requested repeatedly through the full
+Tornado stack, with a token that has access to that group only.  For every
+case and scale we record:
+
+- latency (min, median, p95, mean) over the timed repetitions;
+- the number of SQL statements executed per request;
+- the peak Python memory allocated while handling a request (`tracemalloc`,
+  measured in a separate, untimed request).
+
+Results are written as JSON, together with the SkyPortal version and git
+revision, so that runs can be compared:
+
+    PYTHONPATH=. python tools/benchmarks/handlers.py --scales 100 10000 \\
+        --output bench-new.json --compare bench-old.json
+
+Use a dedicated database (e.g. `--config test_config.yaml`): benchmark
+groups, sources and tokens are left in place to be reused by later runs.
+A case fails the benchmark if any of its requests is not successful (2xx),
+so that error paths are never timed instead of the handlers.
+"""
+import datetime
+import json
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import sqlalchemy as sa
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+from tornado.httpclient import AsyncHTTPClient
+
+from baselayer.app.env import load_env
+import skyportal
+from skyportal import app_server, synthetic
+from skyportal.models import (DBSession, Comment, Group, GroupUser,
+                              Instrument, Spectrum,
+                              Telescope, Token, User)
+from skyportal.model_util import create_token
+
+
+class QueryCounter:
+    """Count SQL statements executed by any engine in this process."""
+    def __init__(self):
+        self.count = 0
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute',
+                        self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def seed(scale):
+    """Create (or reuse) the group, sources and token for one scale.
+
+    Returns a dict of identifiers used to build the benchmark requests.
+    """
+    prefix = f'bench{scale}-'
+    group = Group.query.filter(Group.name == f'Benchmark {scale}').first()
+    if group is None:
+        group = Group(name=f'Benchmark {scale}')
+        DBSession().add(group)
+    user = User.query.filter(User.username == 'benchmark@skyportal').first()
+    if user is None:
+        user = User(username='benchmark@skyportal')
+    if user not in group.users:
+        DBSession().add(GroupUser(group=group, user=user, admin=True))
+    instrument = Instrument.query.filter(
+        Instrument.name == 'Benchmark Camera').first()
+    if instrument is None:
+        instrument = Instrument(
+            name='Benchmark Camera', type='both', band='optical',
+            telescope=Telescope(name='Benchmark Telescope', nickname='BNC',
+                                lat=0., lon=0., elevation=0., diameter=1.))
+        DBSession().add(instrument)
+    DBSession().commit()
+
+    n_existing = synthetic.next_offset(prefix)
+    if n_existing < scale:
+        print(f'Seeding {scale - n_existing} sources for scale {scale}')
+        synthetic.load(scale - n_existing, [group.id], [instrument.id],
+                       seed=scale, prefix=prefix, offset=n_existing)
+
+    spectrum = (Spectrum.query.filter(Spectrum.source_id.like(f'{prefix}%'))
+                .first())
+    source_id = spectrum.source_id if spectrum else f'{prefix}000000000'
+    comment = Comment.query.filter(Comment.source_id == source_id).first()
+    if comment is None:
+        comment = Comment(text='Benchmark comment', source_id=source_id,
+                          user=user)
+        DBSession().add(comment)
+        DBSession().commit()
+
+    token = Token.query.filter(Token.description == f'Benchmark {scale}').first()
+    token_id = token.id if token else create_token(
+        group.id, ['Upload data', 'Comment', 'Manage sources'],
+        created_by_id=user.id, description=f'Benchmark {scale}')
+    return {'group_id': group.id, 'source_id': source_id,
+            'comment_id': comment.id,
+            'instrument_id': instrument.id, 'token': token_id}
+
+
+def photometry_payload(ids):
+    return {'sourceID': ids['source_id'], 'instrumentID': ids['instrument_id'],
+            'timeFormat': 'iso', 'timeScale': 'tcb', 'filter': 'r',
+            'lim_mag': 21., 'mag': [18.5, 18.6, 18.7],
+            'e_mag': [0.05, 0.05, 0.06],
+            'obsTime': ['2018-06-01T00:00:00', '2018-06-02T00:00:00',
+                        '2018-06-03T00:00:00']}
+
+
+# name -> (method, endpoint, payload); endpoints are formatted with the
+# identifiers returned by `seed`
+CASES = {
+    'sources_list': ('GET', 'sources', None),
+    'source_get': ('GET', 'sources/{source_id}', None),
+    'photometry_post': ('POST', 'photometry', photometry_payload),
+    'comment_get': ('GET', 'comment/{comment_id}', None),
+    'changes': ('GET', 'changes', None),
+    'groups_list': ('GET', 'groups', None),
+    'group_get': ('GET', 'groups/{group_id}', None),
+    'plot_photometry': ('GET', 'internal/plot/photometry/{source_id}', None),
+    'plot_spectroscopy': ('GET', 'internal/plot/spectroscopy/{source_id}',
+                          None),
+}
+
+
+async def run_case(client, base_url, ids, method, endpoint, payload,
+                   counter, repeat, warmup):
+    url = f'{base_url}/api/{endpoint.format(**ids)}'
+    body = json.dumps(payload(ids)) if payload else None
+    headers = {'Authorization': f'token {ids["token"]}'}
+
+    async def request():
+        response = await client.fetch(url, method=method, body=body,
+                                      headers=headers, raise_error=False,
+                                      request_timeout=600)
+        if not 200 <= response.code < 300:
+            raise RuntimeError(f'{method} {url}: HTTP {response.code}\n'
+                               f'{(response.body or b"")[:1000].decode()}')
+        return response
+
+    for i in range(warmup):
+        await request()
+
+    latencies, queries = [], []
+    for i in range(repeat):
+        n_queries = counter.count
+        tic = time.perf_counter()
+        await request()
+        latencies.append(time.perf_counter() - tic)
+        queries.append(counter.count - n_queries)
+
+    tracemalloc.start()
+    await request()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies = np.array(latencies) * 1000
+    return {'latency_ms': {'min': latencies.min(),
+                           'median': np.median(latencies),
+                           'p95': np.percentile(latencies, 95),
+                           'mean': latencies.mean()},
+            'queries': int(np.median(queries)),
+            'peak_memory_kb': peak_memory / 1024}
+
+
+async def run(app, scales, cases, repeat, warmup):
+    server = tornado.httpserver.HTTPServer(app)
+    sockets = tornado.netutil.bind_sockets(0, 'localhost')
+    server.add_sockets(sockets)
+    port = sockets[0].getsockname()[1]
+    client = AsyncHTTPClient(force_instance=True)
+    counter = QueryCounter()
+
+    results = []
+    for scale in scales:
+        ids = seed(scale)
+        DBSession.remove()
+        for name in cases:
+            method, endpoint, payload = CASES[name]
+            result = await run_case(client, f'http://localhost:{port}', ids,
+                                    method, endpoint, payload, counter,
+                                    repeat, warmup)
+            results.append({'case': name, 'scale': scale, **result})
+            print(f'{name:<20} {scale:>8} '
+                  f'{result["latency_ms"]["median"]:10.1f} ms '
+                  f'{result["queries"]:6} queries '
+                  f'{result["peak_memory_kb"]:10.0f} kB')
+    client.close()
+    server.stop()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print cases that got slower by more than `threshold` (a fraction) or
+    execute more queries than in `baseline`; returns the number found."""
+    old = {(r['case'], r['scale']): r for r in baseline['results']}
+    regressions = 0
+    print(f'\nCompared to {baseline["version"]} ({baseline["git"]}):')
+    for r in results:
+        b = old.get((r['case'], r['scale']))
+        if b is None:
+            continue
+        ratio = r['latency_ms']['median'] / b['latency_ms']['median']
+        slower = ratio > 1 + threshold
+        more_queries = r['queries'] > b['queries']
+        if slower or more_queries:
+            regressions += 1
+            print(f'  REGRESSION {r["case"]} @ {r["scale"]}: {ratio:.2f}x '
+                  f'latency, queries {b["queries"]} -> {r["queries"]}')
+    if not regressions:
+        print('  no regressions')
+    return regressions
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--scales', type=int, nargs='+',
+                        default=[100, 1000, 10000])
+    parser.add_argument('--cases', nargs='+', choices=list(CASES),
+                        default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--output', default=None,
+                        help='Results file (default: '
+                             'benchmark-<version>-<date>.json)')
+    parser.add_argument('--compare', default=None,
+                        help='Previous results file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown reported as regression')
+    args, _ = parser.parse_known_args()
+
+    env, cfg = load_env()
+    app = app_server.make_app(cfg, [], {'cookie_secret':
+                                        cfg['app:secret-key']})
+
+    results = tornado.ioloop.IOLoop.current().run_sync(
+        lambda: run(app, args.scales, args.cases, args.repeat, args.warmup))
+
+    try:
+        git = subprocess.check_output(['git', 'describe', '--always',
+                                       '--dirty']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        git = None
+    output = {'version': skyportal.__version__, 'git': git,
+              'date': datetime.datetime.now().isoformat(),
+              'repeat': args.repeat, 'results': results}
+    output_file = (args.output or
+                   f'benchmark-{skyportal.__version__}-'
+                   f'{datetime.date.today().isoformat()}.json')
+    with open(output_file, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f'\nResults written to {output_file}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            raise SystemExit(1)
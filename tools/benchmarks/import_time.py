@@ -0,0 +1,96 @@
+"""Measure the cold-start import time of the app factory.
+
+Imports `skyportal.app_server` in fresh interpreters started with
+`python -X importtime`, and reports the median wall time of the import
+together with the modules with the largest cumulative import time (from
+the first run).  Results can be written as JSON and compared with a previous
+run, like `handlers.py`:
+
+    PYTHONPATH=. python tools/benchmarks/import_time.py \\
+        --output import-new.json --compare import-old.json
+
+Modules that handlers load lazily (Bokeh, astropy; see
+`skyportal.app_server.warmup`) should not show up in the report.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULE = 'skyportal.app_server'
+
+
+def parse_importtime(stderr):
+    """Cumulative import time (seconds) of each module, from the output of
+    `python -X importtime`."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, total, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(total) / 1e6
+    return cumulative
+
+
+def measure(module):
+    code = (f'import time; start = time.perf_counter(); import {module}; '
+            f'print(time.perf_counter() - start)')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.getcwd(), os.environ.get('PYTHONPATH', '')]))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, env=env,
+                            check=True)
+    return float(result.stdout.strip().splitlines()[-1]), \
+        parse_importtime(result.stderr)
+
+
+def run(repeat=5, top=25):
+    durations = []
+    modules = None
+    for i in range(repeat):
+        duration, cumulative = measure(MODULE)
+        durations.append(duration)
+        modules = modules or cumulative
+    slowest = sorted(modules.items(), key=lambda item: -item[1])[:top]
+    return {'module': MODULE, 'median_s': statistics.median(durations),
+            'min_s': min(durations), 'n_modules': len(modules),
+            'slowest': dict(slowest)}
+
+
+def compare(results, previous, threshold):
+    change = results['median_s'] / previous['median_s'] - 1
+    print(f'Import time: {previous["median_s"]:.3f}s -> '
+          f'{results["median_s"]:.3f}s ({100 * change:+.0f}%)')
+    new_modules = set(results['slowest']) - set(previous['slowest'])
+    for name in sorted(new_modules):
+        print(f'  new among slowest: {name} '
+              f'({results["slowest"][name]:.3f}s)')
+    return change > threshold
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None,
+                        help='Previous results file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown reported as regression')
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.top)
+    print(f'import {MODULE}: {results["median_s"]:.3f}s median '
+          f'({results["n_modules"]} modules)')
+    for name, seconds in results['slowest'].items():
+        print(f'  {seconds:8.3f}s  {name}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                sys.exit(1)
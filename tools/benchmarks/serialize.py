@@ -0,0 +1,53 @@
+"""Compare response serialization with baselayer's `to_json` and with
+`skyportal.serialize.to_json`, on lists of sources with their photometry.
+
+No database is needed: the objects are created in memory.
+
+    PYTHONPATH=. python tools/benchmarks/serialize.py --sources 100 1000
+"""
+import datetime
+import timeit
+
+import numpy as np
+
+from baselayer.app.json_util import to_json as baselayer_to_json
+from skyportal import serialize
+from skyportal.models import Photometry, Source
+
+
+def make_sources(n_sources, n_photometry=20):
+    rng = np.random.default_rng(0)
+    now = datetime.datetime.now()
+    sources = []
+    for i in range(n_sources):
+        source = Source(id=f'bench{i}', ra=360 * rng.random(),
+                        dec=180 * rng.random() - 90, red_shift=rng.random())
+        # Set the loaded collection directly, as a joined load does, rather
+        # than through the relationship (which would set the backrefs)
+        source.__dict__['photometry'] = [
+            Photometry(id=i * n_photometry + j, source_id=source.id,
+                       instrument_id=1, mag=20 + rng.random(),
+                       e_mag=rng.random(), lim_mag=99., filter='g',
+                       observed_at=now - datetime.timedelta(days=j))
+            for j in range(n_photometry)]
+        sources.append(source)
+    return sources
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--sources', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args, _ = parser.parse_known_args()
+
+    for n_sources in args.sources:
+        response = {'status': 'success', 'data': make_sources(n_sources)}
+        times = {}
+        for name, func in [('baselayer', baselayer_to_json),
+                           ('skyportal', serialize.to_json)]:
+            times[name] = min(timeit.repeat(lambda: func(response),
+                                            number=1, repeat=args.repeat))
+        base, fast = times['baselayer'], times['skyportal']
+        print(f'{n_sources:>6} sources: baselayer {1000 * base:8.1f} ms, '
+              f'skyportal {1000 * fast:8.1f} ms ({base / fast:.1f}x)')
@@ -0,0 +1,69 @@
+"""Benchmark spectrum file parsing against `np.loadtxt`.
+
+usage: PYTHONPATH=. python tools/benchmarks/spectrum_io.py [--rows N]
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from skyportal import spectrum_io
+
+
+def timed(func, *args, repeat=3):
+    best = np.inf
+    for i in range(repeat):
+        tic = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - tic)
+    return best, result
+
+
+def write_ascii(path, n_rows, delimiter):
+    data = np.column_stack([np.linspace(3000, 10000, n_rows),
+                            1e-16 * np.random.random(n_rows),
+                            1e-17 * np.random.random(n_rows)])
+    np.savetxt(path, data, delimiter=delimiter,
+               header=delimiter.join(['wavelength', 'flux', 'error']))
+    return data
+
+
+def write_fits(path, data):
+    from astropy.io import fits
+    columns = [fits.Column(name=name, format='D', array=data[:, i])
+               for i, name in enumerate(['wavelength', 'flux', 'error'])]
+    fits.BinTableHDU.from_columns(columns).writeto(path, overwrite=True)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f'Parsing {args.rows} rows (best of 3)\n')
+        print(f'{"file":<12} {"reader":<24} {"seconds":>8} {"speedup":>8}')
+        for name, delimiter in [('whitespace', ' '), ('csv', ',')]:
+            path = os.path.join(tmp_dir, f'spec_{name}.txt')
+            expected = write_ascii(path, args.rows, delimiter)
+
+            t_loadtxt, _ = timed(np.loadtxt, path, None, '#',
+                                 None if delimiter == ' ' else delimiter)
+            t_ours, result = timed(spectrum_io.read_ascii, path)
+            assert np.allclose(result[0], expected[:, 0])
+
+            print(f'{name:<12} {"np.loadtxt":<24} {t_loadtxt:8.3f}')
+            print(f'{name:<12} {"spectrum_io.read_ascii":<24} {t_ours:8.3f} '
+                  f'{t_loadtxt / t_ours:7.1f}x')
+
+        try:
+            path = os.path.join(tmp_dir, 'spec.fits')
+            write_fits(path, expected)
+            t_fits, result = timed(spectrum_io.read_fits, path)
+            assert np.allclose(result[1], expected[:, 1])
+            print(f'{"fits table":<12} {"spectrum_io.read_fits":<24} '
+                  f'{t_fits:8.3f} {t_loadtxt / t_fits:7.1f}x')
+        except ImportError:
+            print('astropy not installed; skipping FITS benchmark')
@@ -0,0 +1,52 @@
+"""Measure the time spent on the OpenAPI spec when a server process starts.
+
+Compares generating the spec from the handler docstrings (what every process
+did at boot before the spec was cached) with loading it from the on-disk
+cache, and times `make_app` itself, which no longer touches the spec:
+
+    PYTHONPATH=. python tools/benchmarks/startup.py --config test_config.yaml
+"""
+import statistics
+import tempfile
+import time
+
+from baselayer.app.env import load_env
+from skyportal import app_server, openapi
+
+
+def timed(func, repeat):
+    durations = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args, _ = parser.parse_known_args()
+
+    env, cfg = load_env()
+    app = app_server.make_app(cfg, [], {})
+    handlers = app.openapi_spec.handlers
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        openapi.CachedSpec(handlers, cache_dir).to_json()  # fill the cache
+        results = {
+            'make_app': timed(lambda: app_server.make_app(cfg, [], {}),
+                              args.repeat),
+            'generate spec': timed(
+                lambda: openapi.spec_from_handlers(handlers).to_dict(),
+                args.repeat),
+            'fingerprint + cached spec': timed(
+                lambda: openapi.CachedSpec(handlers, cache_dir).to_json(),
+                args.repeat),
+        }
+
+    for name, duration in results.items():
+        print(f'{name:<28} {1000 * duration:8.1f} ms')
+    saved = results['generate spec'] - results['fingerprint + cached spec']
+    print(f'Saved per process start: {1000 * saved:.1f} ms')
@@ -0,0 +1,31 @@
+"""Create missing tables, columns and indexes, migrate old data, create
+default permissions, and stamp the database.
+
+Server processes check the stamp at boot but, when it is out of date, only
+create missing tables and permissions (see
+`skyportal.model_util.ensure_bootstrapped`); run this once when deploying a
+new version, before starting the servers:
+
+    PYTHONPATH=. python tools/bootstrap.py [--force]
+"""
+from baselayer.app.env import load_env
+from baselayer.app.model_util import status
+from skyportal.models import init_db
+from skyportal.model_util import bootstrap
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--force', action='store_true',
+                        help='Bootstrap even if the stamp is up to date')
+    args, _ = parser.parse_known_args()
+
+    env, cfg = load_env()
+    with status(f"Connecting to database {cfg['database']['database']}"):
+        init_db(**cfg['database'])
+
+    with status("Bootstrapping tables and permissions"):
+        bootstrapped = bootstrap(force=args.force)
+    if not bootstrapped:
+        print('Database was already up to date')
@@ -1,21 +1,38 @@
-"""Scrape data from PTF marshal website and saves to disk/local `ptf` database."""
-from datetime import datetime
-from glob import glob
+"""Scrape data from PTF marshal website and saves to disk/local `ptf` database.
+
+Sources are downloaded concurrently on a single asyncio event loop: at most
+`--concurrency` requests are in flight at once, requests to the same host are
+spaced out to respect `--rate` requests per second, and failed requests are
+retried with exponential backoff (or after the delay given by the server in
+`Retry-After`).  Completed sources are appended to a manifest file in the
+output directory, so an interrupted scrape can be restarted and will skip
+sources that were already downloaded.  Scraped comments are inserted into
+the database in batches, and sources are only recorded in the manifest once
+their comments are committed; comments of a source are replaced when it is
+downloaded again, so that none are lost or duplicated if the scrape is
+interrupted in between.
+"""
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import html
+import json
 import os.path
 import re
+import time
+from urllib.parse import urlsplit
 
-import pandas as pd
-import requests
-from requests.auth import HTTPBasicAuth
 import sqlalchemy as sa
 from sqlalchemy import create_engine
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.orm import Session
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+
 
+MARSHAL_URL = 'http://ptf.caltech.edu'
 
 pBase = automap_base()
-pengine = create_engine("postgresql://skyportal:@localhost:5432/ptf")
+
 
 class pComment(pBase):
     __tablename__ = 'comments'
@@ -27,53 +44,287 @@ class pComment(pBase):
     source_id = sa.Column(sa.ForeignKey('sources.name', ondelete='CASCADE'),
                           nullable=False, index=True)
     date_added = sa.Column(sa.DateTime, nullable=False)
-pBase.prepare(pengine, reflect=True)
-pBase.metadata.bind = pengine
-pBase.metadata.create_all()
 
-pUser = pBase.classes.users
-pSource = pBase.classes.sources
 
-psession = Session(pengine)
+def connect_ptf_db(url="postgresql://skyportal:@localhost:5432/ptf"):
+    """Reflect the local `ptf` database and create the comments table."""
+    pengine = create_engine(url)
+    pBase.prepare(pengine, reflect=True)
+    pBase.metadata.bind = pengine
+    pBase.metadata.create_all()
+    return Session(pengine)
 
 
-def download_source_info(source_id, auth, out_dir):
-    """Download thumbnails, comments, spectra for source from PTF Marshal."""
-    source_page = requests.get(
-        f'http://ptf.caltech.edu/cgi-bin/ptf/transient/view_source.cgi?name={source_id}',
-        auth=auth)
-    lines = html.unescape(source_page.text).split('\n')
-    comment_inds = [i for i, l in enumerate(lines) if '[info]' in l]
-    for i in comment_inds:
-        info = lines[i].split()
-        comment_date = datetime.strptime(' '.join(info[:3]), '%Y %b %d')
-        comment_username = info[3]
-        comment_user = psession.query(pUser).filter(pUser.username == comment_username).first()
-        if comment_user is None:
+def parse_comments(page):
+    """Extract `(date, username, text)` tuples from a source page."""
+    lines = html.unescape(page).split('\n')
+    comments = []
+    for i, line in enumerate(lines[:-1]):
+        if '[info]' not in line:
             continue
+        info = line.split()
+        comment_date = datetime.strptime(' '.join(info[:3]), '%Y %b %d')
         comment_text = lines[i + 1].strip()
-        comment_text = re.sub(r' *\[<a.*<\/a>]', '', comment_text)  # remove attachment link
-        c = pComment(user_id=comment_user.id, text=comment_text, date_added=comment_date,
-                     source_id=source_id)
-        psession.add(c)
-        psession.commit()
-
-    spectra = requests.get(
-        f'http://ptf.caltech.edu/cgi-bin/ptf/transient/batch_spec.cgi?name={source_id}',
-        auth=auth)
-    if not spectra.content.startswith(b'No spectrum is found'):
-        with open(os.path.join(out_dir, 'spectra', f'{source_id}.tar.gz'), 'wb') as f:
-            f.write(spectra.content)
-
-    for filename in [f'{source_id}_new.png', f'{source_id}_ref.png', f'{source_id}_sub.png']:
-        cutout = requests.get(
-            f'http://ptf.caltech.edu/marshals/transient/ptf/thumbs/{filename}',
-            auth=auth)
-        if not cutout.ok:
+        # Remove attachment links
+        comment_text = re.sub(r' *\[<a.*<\/a>]', '', comment_text)
+        comments.append((comment_date, info[3], comment_text))
+    return comments
+
+
+class CommentWriter:
+    """Buffer scraped comments and insert them into the `ptf` database in
+    batches, replacing any comments of the same sources."""
+    def __init__(self, psession, batch_size=1000):
+        self.psession = psession
+        self.batch_size = batch_size
+        self.user_ids = dict(psession.query(pBase.classes.users.username,
+                                            pBase.classes.users.id))
+        self.rows = []
+        self.source_ids = set()
+
+    def __call__(self, source_id, comments):
+        self.source_ids.add(source_id)
+        for date, username, text in comments:
+            user_id = self.user_ids.get(username)
+            if user_id is None:
+                continue
+            self.rows.append({'user_id': user_id, 'text': text,
+                              'date_added': date, 'source_id': source_id})
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.source_ids:
+            table = pComment.__table__
+            self.psession.execute(table.delete().where(
+                table.c.source_id.in_(list(self.source_ids))))
+            if self.rows:
+                self.psession.execute(table.insert(), self.rows)
+            self.psession.commit()
+            self.rows = []
+            self.source_ids = set()
+
+
+class RateLimiter:
+    """Space out requests to a host to at most `rate` per second."""
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Manifest:
+    """Append-only record of the sources that were completely downloaded."""
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = {json.loads(line)['source_id'] for line in f
+                             if line.strip()}
+
+    def add(self, entries):
+        """Record `(source_id, info)` pairs, synced to disk."""
+        with open(self.path, 'a') as f:
+            for source_id, info in entries:
+                f.write(json.dumps({'source_id': source_id, **info}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(source_id for source_id, info in entries)
+
+
+def retry_after(response, max_delay=300):
+    """Delay in seconds requested by the `Retry-After` header of `response`,
+    or None."""
+    value = response.headers.get('Retry-After') if response else None
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = (parsedate_to_datetime(value) -
+                     datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(delay, 0), max_delay)
+
+
+class Downloader:
+    """Concurrent, rate-limited downloader for PTF marshal sources.
+
+    Parameters
+    ----------
+    out_dir : str
+        Directory with `spectra` and `cutouts` subdirectories.
+    comment_sink : callable
+        Called as `comment_sink(source_id, comments)` with the comments
+        scraped from each source page; see `CommentWriter`.  If it has a
+        `flush` method, it is called before sources are recorded in the
+        manifest.
+    auth : tuple, optional
+        `(username, password)` for HTTP basic authentication.
+    base_url : str
+        Marshal URL; can be pointed at a local server for testing.
+    concurrency : int
+        Maximum number of requests in flight.
+    rate : float
+        Maximum requests per second to any single host (0: unlimited).
+    retries : int
+        Number of times a failed request is retried.
+    backoff : float
+        Delay before the first retry, in seconds; doubled for each retry.
+    manifest_batch : int
+        Number of completed sources recorded in the manifest at once.
+    """
+    def __init__(self, out_dir, comment_sink, auth=None, base_url=MARSHAL_URL,
+                 concurrency=8, rate=5, retries=3, backoff=1, timeout=60,
+                 manifest_batch=100):
+        self.out_dir = out_dir
+        self.comment_sink = comment_sink
+        self.auth = auth or (None, None)
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.manifest = Manifest(os.path.join(out_dir, 'manifest.jsonl'))
+        self.manifest_batch = manifest_batch
+        self.completed = []
+        self.limiters = {}
+        for subdir in ['spectra', 'cutouts']:
+            os.makedirs(os.path.join(out_dir, subdir), exist_ok=True)
+
+    async def fetch(self, url):
+        """GET `url`, returning the body, or None if it does not exist.
+
+        Connection errors and 5xx/429 responses are retried with exponential
+        backoff, or after the delay requested with `Retry-After`; the last
+        error is raised once retries are exhausted.
+        """
+        limiter = self.limiters.setdefault(urlsplit(url).netloc,
+                                           RateLimiter(self.rate))
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt
+            await limiter.wait()
+            try:
+                async with self.semaphore:
+                    response = await self.client.fetch(
+                        url, auth_username=self.auth[0],
+                        auth_password=self.auth[1],
+                        request_timeout=self.timeout)
+                return response.body
+            except HTTPClientError as e:
+                if e.code == 404:
+                    return None
+                if (e.code < 500 and e.code not in (429, 599)) or \
+                        attempt == self.retries:
+                    raise
+                requested = retry_after(e.response)
+                if requested is not None:
+                    delay = requested
+            except OSError:
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(delay)
+
+    def _write(self, subdir, filename, content):
+        path = os.path.join(self.out_dir, subdir, filename)
+        with open(path + '.part', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.part', path)
+
+    async def download_source_info(self, source_id):
+        """Download thumbnails, comments, spectra for source from PTF
+        Marshal."""
+        cutout_names = [f'{source_id}_new.png', f'{source_id}_ref.png',
+                        f'{source_id}_sub.png']
+        cgi_url = f'{self.base_url}/cgi-bin/ptf/transient'
+        thumbs_url = f'{self.base_url}/marshals/transient/ptf/thumbs'
+        results = await asyncio.gather(
+            self.fetch(f'{cgi_url}/view_source.cgi?name={source_id}'),
+            self.fetch(f'{cgi_url}/batch_spec.cgi?name={source_id}'),
+            *[self.fetch(f'{thumbs_url}/{filename}')
+              for filename in cutout_names],
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        source_page, spectra, *cutouts = results
+
+        comments = parse_comments(source_page.decode()) if source_page else []
+        self.comment_sink(source_id, comments)
+
+        has_spectra = bool(spectra) and not spectra.startswith(
+            b'No spectrum is found')
+        if has_spectra:
+            self._write('spectra', f'{source_id}.tar.gz', spectra)
+
+        has_cutouts = all(cutout is not None for cutout in cutouts)
+        if has_cutouts:
+            for filename, cutout in zip(cutout_names, cutouts):
+                self._write('cutouts', filename, cutout)
+        else:
             print(f"No cutouts found for {source_id}")
-            break
-        with open(os.path.join(out_dir, 'cutouts', filename), 'wb') as f:
-            f.write(cutout.content)
+
+        self.completed.append((source_id, {'comments': len(comments),
+                                           'spectra': has_spectra,
+                                           'cutouts': has_cutouts}))
+        if len(self.completed) >= self.manifest_batch:
+            self.flush()
+
+    def flush(self):
+        """Commit the comments of the completed sources, then record them in
+        the manifest."""
+        flush_comments = getattr(self.comment_sink, 'flush', None)
+        if flush_comments is not None:
+            flush_comments()
+        completed, self.completed = self.completed, []
+        if completed:
+            self.manifest.add(completed)
+
+    async def run(self, source_ids):
+        """Download all sources not yet in the manifest.
+
+        Returns a dict of `{source_id: exception}` for sources that failed.
+        """
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.client = AsyncHTTPClient(force_instance=True,
+                                      max_clients=self.concurrency)
+        todo = [s for s in source_ids if s not in self.manifest.done]
+        failures = {}
+
+        async def download(source_id):
+            try:
+                await self.download_source_info(source_id)
+            except Exception as e:
+                print(f'Failed to download {source_id}: {e}')
+                failures[source_id] = e
+
+        # Only a bounded number of sources are in progress at any time, so
+        # that a scrape of all sources does not create millions of tasks
+        queue = iter(todo)
+
+        async def worker():
+            for source_id in queue:
+                await download(source_id)
+
+        try:
+            await asyncio.gather(*[worker() for i in range(self.concurrency)])
+        finally:
+            self.client.close()
+            self.flush()
+        return failures
 
 
 if __name__ == '__main__':
@@ -82,18 +333,27 @@ if __name__ == '__main__':
     parser.add_argument('user')
     parser.add_argument('password')
     parser.add_argument('out_dir')
+    parser.add_argument('--ptf-db',
+                        default="postgresql://skyportal:@localhost:5432/ptf")
+    parser.add_argument('--base-url', default=MARSHAL_URL)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=5,
+                        help='Maximum requests per second to the marshal')
+    parser.add_argument('--retries', type=int, default=3)
     args = parser.parse_args()
-    auth = HTTPBasicAuth(args.user, args.password)
-    for subdir in ['spectra', 'cutouts']:
-        try:
-            os.mkdir(os.path.join(args.out_dir, subdir))
-        except FileExistsError:
-            pass
-
-#    from tqdm import tqdm
-#    for source in tqdm(list(psession.query(pSource))):
-#        try:
-#            download_source_info(source.name, auth, args.out_dir)
-#        except Exception as e:
-#            print(f'Failed to download f{source.id}')
-#            print(e)
+
+    psession = connect_ptf_db(args.ptf_db)
+    comment_writer = CommentWriter(psession)
+    source_ids = [name for (name,) in
+                  psession.query(pBase.classes.sources.name)
+                                 .order_by(pBase.classes.sources.name)]
+
+    downloader = Downloader(args.out_dir, comment_writer,
+                            auth=(args.user, args.password),
+                            base_url=args.base_url,
+                            concurrency=args.concurrency, rate=args.rate,
+                            retries=args.retries)
+    failures = asyncio.get_event_loop().run_until_complete(
+        downloader.run(source_ids))
+    print(f'Downloaded {len(downloader.manifest.done)}/{len(source_ids)} '
+          f'sources; {len(failures)} failed')
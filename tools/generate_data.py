@@ -0,0 +1,95 @@
+"""Populate the database with a large synthetic dataset.
+
+Creates (if needed) a group and an instrument for the synthetic data, then
+generates sources, light curves and spectra with `skyportal.synthetic` and
+bulk loads them with `COPY`.  Useful to reproduce production-scale
+performance problems locally, e.g.:
+
+    PYTHONPATH=. python tools/generate_data.py --sources 1000000
+"""
+import time
+
+from baselayer.app.env import load_env
+from baselayer.app.model_util import status, create_tables
+from skyportal.models import (init_db, DBSession, Group, GroupUser,
+                              Instrument, Telescope, User)
+from skyportal.model_util import setup_permissions
+from skyportal import synthetic
+
+
+def get_or_create_group(name, usernames):
+    group = Group.query.filter(Group.name == name).first()
+    if group is None:
+        group = Group(name=name)
+        DBSession().add(group)
+    for user in User.query.filter(User.username.in_(usernames)):
+        if user not in group.users:
+            DBSession().add(GroupUser(group=group, user=user, admin=True))
+    DBSession().commit()
+    return group
+
+
+def get_or_create_instrument():
+    instrument = Instrument.query.filter(
+        Instrument.name == 'Synthetic Camera').first()
+    if instrument is None:
+        telescope = Telescope(name='Synthetic Telescope', nickname='SYN',
+                              lat=33.3633675, lon=-116.8361345,
+                              elevation=1870, diameter=1.2)
+        instrument = Instrument(telescope=telescope, name='Synthetic Camera',
+                                type='both', band='optical')
+        DBSession().add(instrument)
+        DBSession().commit()
+    return instrument
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--sources', type=int, default=100000)
+    parser.add_argument('--epochs', type=int, default=30,
+                        help='Mean number of photometry points per source')
+    parser.add_argument('--cadence', type=float, default=3.,
+                        help='Mean days between observations')
+    parser.add_argument('--spectra-fraction', type=float, default=0.2,
+                        help='Fraction of sources with spectra')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='Sources per transaction')
+    parser.add_argument('--group', default='Synthetic sources')
+    parser.add_argument('--user', action='append', default=None,
+                        help='Add user to the group (may be repeated; '
+                             'default: testuser@cesium-ml.org)')
+    parser.add_argument('--prefix', default='synth',
+                        help='Prefix of generated source names')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    if args.user is None:
+        args.user = ['testuser@cesium-ml.org']
+
+    env, cfg = load_env()
+    with status(f"Connecting to database {cfg['database']['database']}"):
+        init_db(**cfg['database'])
+        create_tables()
+        setup_permissions()
+
+    group = get_or_create_group(args.group, args.user)
+    instrument = get_or_create_instrument()
+    # Continue numbering after sources from a previous run
+    offset = synthetic.next_offset(args.prefix)
+
+    tic = time.time()
+
+    def progress(n):
+        elapsed = time.time() - tic
+        print(f'    {n}/{args.sources} sources '
+              f'({n / elapsed:.0f} sources/s)', flush=True)
+
+    with status(f"Generating {args.sources} sources"):
+        counts = synthetic.load(args.sources, [group.id], [instrument.id],
+                                seed=args.seed, chunk_size=args.chunk_size,
+                                prefix=args.prefix, offset=offset,
+                                progress=progress, mean_epochs=args.epochs,
+                                cadence=args.cadence,
+                                spectra_fraction=args.spectra_fraction)
+    print(', '.join(f'{n} {table}' for table, n in counts.items()),
+          f'in {time.time() - tic:.1f}s')
@@ -1,9 +1,19 @@
-"""Load scraped PTF data into skyportal database"""
+"""Load scraped PTF data into skyportal database
+
+The import runs in stages (tables, spectra, cutouts, public group).  Tables
+are streamed from the PTF database in chunks and bulk loaded with `COPY`;
+spectrum files are parsed on a pool of worker processes.  After every chunk
+the progress is recorded in a checkpoint file, so an interrupted import can
+simply be restarted with the same arguments and will resume where it left
+off; table rows that were loaded but not yet recorded are skipped.
+"""
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from glob import glob
-import re
+import json
 import os.path
 
+import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 from sqlalchemy import create_engine
@@ -11,115 +21,279 @@ from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.orm import Session
 
 from baselayer.app import load_config
-from skyportal.models import (DBSession, init_db, Comment, Group, Photometry,
-                              Source, Spectrum, User)
-from skyportal.model_util import create_tables
-
-pBase = automap_base()
-pengine = create_engine("postgresql://skyportal:@localhost:5432/ptf")
-pBase.prepare(pengine, reflect=True)
-pBase.metadata.bind = pengine
-pBase.metadata.create_all()
-
-pSource = pBase.classes.sources
-pPhotometry = pBase.classes.phot
-pTelescope = pBase.classes.telescopes
-pInstrument = pBase.classes.instruments
-
-psession = Session(pengine)
-init_db(**load_config()['database'])
-create_tables()
-
-
-def import_table(ptf_table, skyportal_table, columns=None, column_map={},
-                 condition=None, dedupe=[], sql_statement=None):
-    df = pd.read_sql(sql_statement if sql_statement is not None else ptf_table,
-                     pengine, columns=columns)
-    df = df[columns]
-
-    df.rename(columns=column_map, inplace=True)
-    if condition:
-        df = df[df.apply(condition, axis=1)]
-    if 'created_at' not in df:
-        df['created_at'] = datetime.now()
-    for col in dedupe:
-        df.drop_duplicates(subset=[col], inplace=True)
-    df.to_sql(skyportal_table, DBSession().bind, index=False, if_exists='append')
+from skyportal.models import (DBSession, init_db, Group, GroupSource,
+                              Photometry, Source)
+from skyportal.model_util import create_tables, copy_dataframe
+from skyportal import spectrum_io
+
+
+class Checkpoint:
+    """Progress of an import, persisted to a JSON file after each step."""
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+        else:
+            self.state = {}
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+
+    def set(self, key, value):
+        self.state[key] = value
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+
+def reset_sequence(table):
+    max_id = DBSession().execute(f"SELECT MAX(id) FROM {table};").first()[0]
+    if max_id is not None:
+        DBSession().execute(f"ALTER SEQUENCE {table}_id_seq "
+                            f"RESTART WITH {max_id + 1};")
+        DBSession().commit()
+
+
+def import_table(pengine, checkpoint, ptf_table, skyportal_table, columns,
+                 column_map={}, select=None, key=None, chunksize=50000):
+    """Copy a PTF table into the skyportal database, chunk by chunk.
+
+    Chunks are read in order of `key` (by default, the first of `columns`),
+    each starting after the last key of the previous one, so that resuming
+    an import does not read the rows already imported.  Rows that were
+    already loaded (if the import was interrupted after committing a chunk
+    but before recording it in the checkpoint), or that duplicate a unique
+    column, are skipped.
+
+    Parameters
+    ----------
+    select : `sqlalchemy.sql.Select`, optional
+        Query of the PTF rows; by default all `columns` of `ptf_table`.
+    key : `sqlalchemy.Column`, optional
+        Unique column of `select` by which rows are read.
+    """
+    progress = checkpoint.get(skyportal_table, {'rows': 0, 'done': False})
+    if progress['done']:
+        print(f"Skipping {skyportal_table} (already imported)")
+        return
+
+    if select is None:
+        table = sa.table(ptf_table, *[sa.column(c) for c in columns])
+        select = sa.select([table])
+        key = table.c[columns[0]]
+    while True:
+        query = select.order_by(key).limit(chunksize)
+        if progress.get('last') is not None:
+            query = query.where(key > progress['last'])
+        df = pd.read_sql(query, pengine)
+        if len(df) == 0:
+            break
+        last = df[key.name].iloc[-1]
+        df = df[columns].rename(columns=column_map)
+        now = datetime.now()
+        for col in ['created_at', 'modified']:
+            if col not in df:
+                df[col] = now
+
+        copy_dataframe(df, skyportal_table, skip_existing=True)
+        DBSession().commit()
+        progress['rows'] += len(df)
+        progress['last'] = last.item() if hasattr(last, 'item') else last
+        checkpoint.set(skyportal_table, progress)
+        print(f"{skyportal_table}: {progress['rows']} rows")
+
     try:
-        max_id = DBSession().execute(f"SELECT MAX(id) FROM {skyportal_table};").first()[0]
-        DBSession().execute(f"ALTER SEQUENCE {skyportal_table}_id_seq RESTART WITH {max_id + 1};")
+        reset_sequence(skyportal_table)
     except Exception as e:
+        DBSession().rollback()
         print("Ignored exception:", e)
+    progress['done'] = True
+    checkpoint.set(skyportal_table, progress)
 
 
-def normalize_spectrum(spectrum):
+def normalize_spectrum(fluxes, wavelengths):
     """TODO copied from PTF marshal; would prefer not to do this at plot-time
     so for now I'm just copying the exact logic here.
     """
-    inds = np.abs(spectrum.wavelengths - 6400) < 100
+    inds = np.abs(wavelengths - 6400) < 100
     if inds.any():
-        spectrum.fluxes /= np.abs(np.median(spectrum.fluxes[inds]))
+        return fluxes / np.abs(np.median(fluxes[inds]))
     else:
-        spectrum.fluxes /= np.abs(np.median(spectrum.fluxes))
+        return fluxes / np.abs(np.median(fluxes))
+
+
+def parse_spectrum_file(filename):
+    """Parse a single spectrum file (run in a worker process).
+
+    Returns None if the file cannot be parsed.
+    """
+    source_id, obs_date, nickname = (os.path.basename(filename)
+                                     .replace('.ascii', '').split('_')[:3])
+    try:
+        wavelengths, fluxes, errors = spectrum_io.read_ascii(filename)
+    except ValueError:
+        return None
+    return {'source_id': source_id,
+            'observed_at': datetime.strptime(obs_date, '%Y%m%d'),
+            'nickname': nickname,
+            'wavelengths': wavelengths,
+            'fluxes': normalize_spectrum(fluxes, wavelengths),
+            'errors': errors}
+
+
+def spectrum_instruments(pengine):
+    """Map telescope nicknames to the instrument used for spectroscopy."""
+    instruments = pd.read_sql(
+        "SELECT i.id, i.type, t.nickname FROM instruments i "
+        "JOIN telescopes t ON i.telid = t.id ORDER BY i.id", pengine)
+    instrument_map = {}
+    for nickname, df in instruments.groupby('nickname'):
+        if len(df) > 1:
+            df = df[df.type != 'phot']
+        instrument_map[nickname] = int(df.id.iloc[0])
+    return instrument_map
+
+
+def import_spectra(pengine, checkpoint, data_dir, workers=None,
+                   batch_size=500):
+    spectra_files = sorted(glob(f'{data_dir}/spectra/*.ascii'))
+    n_done = checkpoint.get('spectra', 0)
+    if n_done >= len(spectra_files):
+        print("Skipping spectra (already imported)")
+        return
+    instrument_map = spectrum_instruments(pengine)
+
+    def find_instrument(nickname):
+        # PTF file names contain a prefix of the telescope nickname
+        for telescope, instrument_id in instrument_map.items():
+            if telescope.startswith(nickname):
+                return instrument_id
+        return None
+
+    remaining = spectra_files[n_done:]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(remaining), batch_size):
+            batch = remaining[start:start + batch_size]
+            rows = []
+            for f, spectrum in zip(batch, executor.map(parse_spectrum_file,
+                                                       batch, chunksize=16)):
+                instrument_id = (find_instrument(spectrum.pop('nickname'))
+                                 if spectrum is not None else None)
+                if instrument_id is None:
+                    print(f"Skipped {f}")
+                    continue
+                spectrum['instrument_id'] = instrument_id
+                rows.append(spectrum)
+
+            if rows:
+                df = pd.DataFrame(rows)
+                df['created_at'] = df['modified'] = datetime.now()
+                copy_dataframe(df, 'spectra')
+                DBSession().commit()
+            n_done += len(batch)
+            checkpoint.set('spectra', n_done)
+            print(f"spectra: {n_done}/{len(spectra_files)} files")
+
+
+def import_cutouts(checkpoint, data_dir):
+    if checkpoint.get('thumbnails', False):
+        print("Skipping thumbnails (already imported)")
+        return
+
+    # TODO can't serve from outside static/
+    cutout_files = glob(f'{data_dir}/cutouts/*')
+    phot_info = DBSession().query(sa.sql.functions.min(Photometry.id),
+                                  Photometry.source_id).group_by(Photometry.source_id).all()
+    phot_map = {source_id: phot_id for phot_id, source_id in phot_info}
+
+    df = pd.DataFrame({'file_uri': cutout_files})
+    parts = df.file_uri.str.extract(r'([^/_]+)_([^/_\.]+)\.[^/]*$')
+    df['source_id'], df['type'] = parts[0], parts[1]
+    df['photometry_id'] = df.source_id.map(phot_map)
+    df = df[df.photometry_id.notnull()].drop(columns='source_id')
+    df['photometry_id'] = df.photometry_id.astype(int)
+    df['created_at'] = df['modified'] = datetime.now()
+
+    copy_dataframe(df, 'thumbnails')
+    DBSession().commit()
+    checkpoint.set('thumbnails', True)
+
+
+def create_public_group(checkpoint):
+    if checkpoint.get('public_group', False):
+        return
+
+    g = Group(name="Public group")
+    DBSession().add(g)
+    DBSession().flush()
+    DBSession().execute(
+        GroupSource.__table__.insert().from_select(
+            ['group_id', 'source_id'],
+            sa.select([sa.literal(g.id), Source.id])
+        )
+    )
+    DBSession().commit()
+    checkpoint.set('public_group', True)
 
 
 if __name__ == '__main__':
     from argparse import ArgumentParser
     parser = ArgumentParser()
     parser.add_argument('data_dir')
+    parser.add_argument('--ptf-db', default="postgresql://skyportal:@localhost:5432/ptf")
+    parser.add_argument('--checkpoint', default=None,
+                        help='Progress file (default: DATA_DIR/import_checkpoint.json)')
+    parser.add_argument('--chunksize', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes for parsing spectra (default: #CPUs)')
     args = parser.parse_args()
 
+    pBase = automap_base()
+    pengine = create_engine(args.ptf_db)
+    pBase.prepare(pengine, reflect=True)
+    pSource = pBase.classes.sources
+    pPhotometry = pBase.classes.phot
+    psession = Session(pengine)
+
+    init_db(**load_config()['database'])
+    create_tables()
+
+    checkpoint = Checkpoint(args.checkpoint or
+                            os.path.join(args.data_dir, 'import_checkpoint.json'))
+
 
 #    """
 #    DELETE FROM phot WHERE sourceid NOT IN (SELECT id FROM sources);
 #    ALTER TABLE phot ADD CONSTRAINT fk_phot_source_id FOREIGN KEY (sourceid) REFERENCES sources(id) ON DELETE CASCADE;
 #    """
 
-    import_table('users', 'users', ['id', 'username'], dedupe=['username'])
-    import_table('telescopes', 'telescopes', ['id', 'name', 'nickname', 'lat',
-                                              'lon', 'elevation', 'diameter'])
-    import_table('instruments', 'instruments', ['id', 'name', 'type', 'band', 'telid'],
-                 {'telid': 'telescope_id'})
-    import_table('sources', 'sources', ['name', 'ra', 'dec', 'redshift'],
-                 {'name': 'id', 'redshift': 'red_shift'})
-    import_table('comments', 'comments', ['id', 'user_id', 'text',
-                                          'date_added', 'source_id'],
-                 {'date_added': 'created_at'})
-    import_table('phot', 'photometry', ['id', 'name', 'instrumentid',
-                                        'obsdate', 'filter', 'mag', 'emag',
-                                        'limmag'],
+    kwargs = dict(chunksize=args.chunksize)
+    import_table(pengine, checkpoint, 'users', 'users', ['id', 'username'],
+                 **kwargs)
+    import_table(pengine, checkpoint, 'telescopes', 'telescopes',
+                 ['id', 'name', 'nickname', 'lat', 'lon', 'elevation',
+                  'diameter'], **kwargs)
+    import_table(pengine, checkpoint, 'instruments', 'instruments',
+                 ['id', 'name', 'type', 'band', 'telid'],
+                 {'telid': 'telescope_id'}, **kwargs)
+    import_table(pengine, checkpoint, 'sources', 'sources',
+                 ['name', 'ra', 'dec', 'redshift'],
+                 {'name': 'id', 'redshift': 'red_shift'}, **kwargs)
+    import_table(pengine, checkpoint, 'comments', 'comments',
+                 ['id', 'user_id', 'text', 'date_added', 'source_id'],
+                 {'date_added': 'created_at'}, **kwargs)
+    import_table(pengine, checkpoint, 'phot', 'photometry',
+                 ['id', 'name', 'instrumentid', 'obsdate', 'filter', 'mag',
+                  'emag', 'limmag'],
                  {'name': 'source_id', 'instrumentid': 'instrument_id',
-                  'obsdate': 'obs_time', 'emag': 'e_mag', 'limmag': 'lim_mag'},
-                  sql_statement=psession.query(pPhotometry, pSource.name)
-                                        .join(pSource)
-                                        .statement)
-    spectra_files = glob(f'{args.data_dir}/spectra/*.ascii')
-
-    for f in spectra_files:
-        source_id, obs_date, nickname = os.path.basename(f.strip('.ascii')).split('_')[:3]
-        telescope = psession.query(pTelescope).filter(pTelescope.nickname.like(f'{nickname}%')).first()
-        instruments = psession.query(pInstrument).filter(pInstrument.telid == telescope.id).all()
-        if len(instruments) > 1:
-            instruments = [i for i in instruments if i.type != 'phot']
-        try:
-            spectrum = Spectrum.from_ascii(f, source_id, instruments[0].id,
-                                           datetime.strptime(obs_date, '%Y%m%d'))
-            DBSession().add(spectrum)
-            DBSession().commit()
-        except ValueError:
-            print(f"Skipped {f}")
+                  'obsdate': 'observed_at', 'emag': 'e_mag',
+                  'limmag': 'lim_mag'},
+                 select=psession.query(pPhotometry, pSource.name)
+                                .join(pSource).statement,
+                 key=pPhotometry.__table__.c.id, **kwargs)
 
-    # TODO can't serve from outside static/
-    cutout_files = glob(f'{args.data_dir}/cutouts/*')
-    phot_info = DBSession().query(sa.sql.functions.min(Photometry.id),
-                                  Photometry.source_id).group_by(Photometry.source_id).all()
-    phot_map = {source_id: phot_id for phot_id, source_id in phot_info}
-    for f in cutout_files:
-        source_id, thumb_type = re.split('[\/_\.]', f)[-3:-1]
-        DBSession().add(Thumbnail(file_uri=f, type=thumb_type,
-                                  photometry_id=phot_map[source_id]))
-        DBSession().commit()
-
-    g = Group(name="Public group", public=True, sources=list(Source.query))
-    DBSession().add(g)
-    DBSession().commit()
+    import_spectra(pengine, checkpoint, args.data_dir, workers=args.workers)
+    import_cutouts(checkpoint, args.data_dir)
+    create_public_group(checkpoint)
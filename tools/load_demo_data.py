@@ -86,7 +86,7 @@ if __name__ == "__main__":
                                      'phot.csv')
             phot_data = pd.read_csv(phot_file)
             s.photometry = [Photometry(instrument=i1, **row)
-                            for j, row in phot_data.iterrows()]
+                            for row in phot_data.to_dict('records')]
 
             spec_file = os.path.join(os.path.dirname(os.path.dirname(__file__)),
                                      'skyportal', 'tests', 'data',
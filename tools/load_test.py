@@ -0,0 +1,277 @@
+"""Generate concurrent, mixed HTTP traffic against a running SkyPortal.
+
+Each virtual user repeatedly picks a scenario according to the configured
+mix, runs its requests one after another (waiting `--think-time` seconds
+between them) and starts over, until `--duration` has elapsed.  Users
+authenticate with the given API tokens and/or session cookies, assigned
+round-robin, so that traffic from scanners (browser sessions) and brokers
+(tokens) can be mixed.
+
+Built-in scenarios:
+
+- `browse`: list sources, view a source, its comments and light curve plot;
+- `ingest`: post a batch of photometry, then upsert a batch of new sources
+  into the group given by `--group-id`;
+- `plot`: request photometry and spectroscopy plots.
+
+For example, 40 users, 80% browsing and 20% ingest, for two minutes:
+
+    python tools/load_test.py --url http://localhost:5000 --token $TOKEN \\
+        --users 40 --mix browse=0.8,ingest=0.2 --duration 120 --group-id 1
+
+Throughput, latency percentiles and error rates are reported per endpoint;
+`--output` also saves them as JSON.  Sources created by the ingest scenario
+are deleted at the end of the run, unless `--keep-sources` is given.
+"""
+import asyncio
+from collections import defaultdict
+import json
+import random
+import time
+import uuid
+
+import numpy as np
+from tornado.httpclient import AsyncHTTPClient
+
+
+class Session:
+    """A virtual user: credentials and the data it has seen so far."""
+    def __init__(self, client, base_url, token=None, cookie=None,
+                 instrument_id=1, group_id=None):
+        self.client = client
+        self.base_url = base_url.rstrip('/')
+        self.headers = {}
+        if token:
+            self.headers['Authorization'] = f'token {token}'
+        if cookie:
+            self.headers['Cookie'] = cookie
+        self.instrument_id = instrument_id
+        self.group_id = group_id
+        self.source_ids = []
+        self.created_ids = []
+
+    async def request(self, stats, name, method, endpoint, payload=None):
+        """Make a request and record its latency under `name`."""
+        body = json.dumps(payload) if payload is not None else None
+        tic = time.perf_counter()
+        try:
+            response = await self.client.fetch(
+                f'{self.base_url}/api/{endpoint}', method=method, body=body,
+                headers=self.headers, raise_error=False, request_timeout=120)
+            code = response.code
+        except Exception:
+            response, code = None, 599
+        stats.record(name, time.perf_counter() - tic, code)
+        if response is not None and code == 200:
+            return json.loads(response.body)
+        return None
+
+    def random_source(self):
+        return random.choice(self.source_ids) if self.source_ids else None
+
+
+async def browse(session, stats, think_time):
+    result = await session.request(stats, 'GET sources', 'GET', 'sources')
+    if result is not None and result.get('data'):
+        session.source_ids = [s['id'] for s in result['data'][:1000]]
+    source_id = session.random_source()
+    if source_id is None:
+        return
+    await asyncio.sleep(think_time)
+    source = await session.request(stats, 'GET sources/:id', 'GET',
+                                   f'sources/{source_id}')
+    await asyncio.sleep(think_time)
+    for comment in (source or {}).get('data', {}).get('comments', [])[:3]:
+        await session.request(stats, 'GET comment/:id', 'GET',
+                              f'comment/{comment["id"]}')
+    await session.request(stats, 'GET plot/photometry/:id', 'GET',
+                          f'internal/plot/photometry/{source_id}')
+
+
+async def ingest(session, stats, think_time, batch_size=100):
+    source_id = session.random_source()
+    if source_id is not None:
+        t0 = np.datetime64('2018-01-01') + np.random.randint(365)
+        times = t0 + np.sort(np.random.randint(0, 86400 * 30, batch_size)
+                             ).astype('timedelta64[s]')
+        await session.request(stats, 'POST photometry', 'POST', 'photometry', {
+            'sourceID': source_id, 'instrumentID': session.instrument_id,
+            'timeFormat': 'iso', 'timeScale': 'tcb', 'filter': 'r',
+            'lim_mag': 21., 'obsTime': [str(t) for t in times],
+            'mag': (18 + np.random.random(batch_size)).tolist(),
+            'e_mag': (0.05 * np.random.random(batch_size)).tolist()})
+        await asyncio.sleep(think_time)
+
+    prefix = f'load-{uuid.uuid4().hex[:8]}-'
+    result = await session.request(
+        stats, 'POST sources/bulk', 'POST', 'sources/bulk', {
+            'sources': [{'id': f'{prefix}{i}', 'ra': 360 * random.random(),
+                         'dec': 180 * random.random() - 90}
+                        for i in range(batch_size)],
+            'group_ids': [session.group_id]})
+    if result is not None:
+        session.created_ids.extend(
+            r['id'] for r in result['data']['results']
+            if r['status'] == 'created')
+
+
+async def plot(session, stats, think_time):
+    if not session.source_ids:
+        result = await session.request(stats, 'GET sources', 'GET', 'sources')
+        if result is not None and result.get('data'):
+            session.source_ids = [s['id'] for s in result['data'][:1000]]
+    source_id = session.random_source()
+    if source_id is None:
+        return
+    await session.request(stats, 'GET plot/photometry/:id', 'GET',
+                          f'internal/plot/photometry/{source_id}')
+    await asyncio.sleep(think_time)
+    await session.request(stats, 'GET plot/spectroscopy/:id', 'GET',
+                          f'internal/plot/spectroscopy/{source_id}')
+
+
+SCENARIOS = {'browse': browse, 'ingest': ingest, 'plot': plot}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.start = time.perf_counter()
+
+    def record(self, name, latency, code):
+        self.latencies[name].append(latency)
+        if code >= 400:
+            self.errors[name] += 1
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        summary = {}
+        for name, latencies in sorted(self.latencies.items()):
+            ms = 1000 * np.array(latencies)
+            summary[name] = {
+                'requests': len(ms),
+                'throughput': len(ms) / elapsed,
+                'p50_ms': np.percentile(ms, 50),
+                'p95_ms': np.percentile(ms, 95),
+                'p99_ms': np.percentile(ms, 99),
+                'error_rate': self.errors[name] / len(ms)
+            }
+        return elapsed, summary
+
+
+def parse_mix(mix):
+    """Parse 'browse=0.8,ingest=0.2' into normalized scenario weights."""
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name not in SCENARIOS:
+            raise ValueError(f'Unknown scenario {name!r}; choose from '
+                             f'{", ".join(SCENARIOS)}')
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    return {name: w / total for name, w in weights.items()}
+
+
+async def delete_sources(session):
+    """Delete the sources created by `session`, untimed."""
+    stats = Stats()
+    for source_id in session.created_ids:
+        await session.request(stats, 'DELETE sources/:id', 'DELETE',
+                              f'sources/{source_id}')
+    return sum(stats.errors.values())
+
+
+async def run(base_url, credentials, users, mix, duration, think_time,
+              ramp_up=0, instrument_id=1, group_id=None, cleanup=True):
+    client = AsyncHTTPClient(force_instance=True, max_clients=users)
+    stats = Stats()
+    deadline = time.monotonic() + duration
+    names, weights = zip(*mix.items())
+    sessions = []
+
+    async def user(i):
+        await asyncio.sleep(ramp_up * i / users)
+        token, cookie = credentials[i % len(credentials)]
+        session = Session(client, base_url, token, cookie, instrument_id,
+                          group_id)
+        sessions.append(session)
+        while time.monotonic() < deadline:
+            scenario = random.choices(names, weights)[0]
+            await SCENARIOS[scenario](session, stats, think_time)
+            await asyncio.sleep(think_time)
+
+    await asyncio.gather(*[user(i) for i in range(users)])
+    summary = stats.summary()
+    if cleanup:
+        n_created = sum(len(session.created_ids) for session in sessions)
+        if n_created:
+            print(f'Deleting {n_created} sources created by the ingest '
+                  'scenario')
+            errors = sum(await asyncio.gather(*[delete_sources(session)
+                                                for session in sessions]))
+            if errors:
+                print(f'Could not delete {errors} sources')
+    client.close()
+    return summary
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--token', action='append', default=[],
+                        help='API token (may be repeated)')
+    parser.add_argument('--cookie', action='append', default=[],
+                        help='Session cookie header of a logged-in user, '
+                             'e.g. "user_id=..." (may be repeated)')
+    parser.add_argument('--users', type=int, default=10,
+                        help='Number of concurrent virtual users')
+    parser.add_argument('--mix', default='browse=0.7,ingest=0.2,plot=0.1',
+                        help='Scenario weights')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='Seconds to run for')
+    parser.add_argument('--ramp-up', type=float, default=5,
+                        help='Seconds over which users are started')
+    parser.add_argument('--think-time', type=float, default=0.5,
+                        help='Seconds between requests of a user')
+    parser.add_argument('--instrument-id', type=int, default=1,
+                        help='Instrument used for posted photometry')
+    parser.add_argument('--group-id', type=int,
+                        help='Group of the sources created by the ingest '
+                             'scenario (required for ingest)')
+    parser.add_argument('--keep-sources', action='store_true',
+                        help='Do not delete the sources created by the '
+                             'ingest scenario at the end of the run')
+    parser.add_argument('--output', help='Save results as JSON')
+    args = parser.parse_args()
+
+    credentials = ([(token, None) for token in args.token] +
+                   [(None, cookie) for cookie in args.cookie])
+    if not credentials:
+        parser.error('At least one --token or --cookie is required')
+    mix = parse_mix(args.mix)
+    if 'ingest' in mix and args.group_id is None:
+        parser.error('--group-id is required for the ingest scenario')
+
+    elapsed, summary = asyncio.get_event_loop().run_until_complete(
+        run(args.url, credentials, args.users, mix, args.duration,
+            args.think_time, args.ramp_up, args.instrument_id, args.group_id,
+            not args.keep_sources))
+
+    print(f'{args.users} users, {elapsed:.0f}s, mix: '
+          + ', '.join(f'{name}={w:.2f}' for name, w in mix.items()) + '\n')
+    print(f'{"endpoint":<28} {"requests":>9} {"req/s":>8} {"p50 ms":>8} '
+          f'{"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for name, s in summary.items():
+        print(f'{name:<28} {s["requests"]:9d} {s["throughput"]:8.1f} '
+              f'{s["p50_ms"]:8.1f} {s["p95_ms"]:8.1f} {s["p99_ms"]:8.1f} '
+              f'{100 * s["error_rate"]:6.1f}%')
+    total = sum(s['requests'] for s in summary.values())
+    print(f'\nTotal: {total} requests, {total / elapsed:.1f} req/s')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'url': args.url, 'users': args.users, 'mix': mix,
+                       'duration': elapsed, 'endpoints': summary}, f,
+                      indent=2)